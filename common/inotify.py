@@ -0,0 +1,66 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+INOTIFY_EVENT = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+
+class Inotify():
+  """An inotify instance through libc. Raises OSError where inotify isn't available.
+
+  Events are read as (wd, mask, name) tuples, name is empty for events on the watched
+  directory itself. A blocking instance waits for events, a nonblocking one returns none
+  when nothing is pending."""
+  def __init__(self, blocking=False):
+    try:
+      self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+      fd = self.libc.inotify_init1(os.O_CLOEXEC | (0 if blocking else os.O_NONBLOCK))
+    except AttributeError:
+      raise OSError("inotify not available") from None
+    if fd < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err))
+    self.fd = fd
+
+  def add_watch(self, path, mask):
+    """The watch descriptor of path, OSError with ENOSPC when out of watches"""
+    wd = self.libc.inotify_add_watch(self.fd, path.encode(), mask)
+    if wd < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err), path)
+    return wd
+
+  def rm_watch(self, wd):
+    self.libc.inotify_rm_watch(self.fd, wd)
+
+  def read_events(self):
+    try:
+      buf = os.read(self.fd, READ_SIZE)
+    except BlockingIOError:
+      return []
+
+    events = []
+    i = 0
+    while i + INOTIFY_EVENT.size <= len(buf):
+      wd, mask, _, name_len = INOTIFY_EVENT.unpack_from(buf, i)
+      i += INOTIFY_EVENT.size
+      events.append((wd, mask, buf[i:i + name_len].rstrip(b'\0').decode()))
+      i += name_len
+    return events
+
+  def close(self):
+    if self.fd is not None:
+      os.close(self.fd)
+      self.fd = None
@@ -40,7 +40,8 @@ class SwagFormatter(logging.Formatter):
       except (ValueError, TypeError):
         record_dict['msg'] = [record.msg]+record.args
 
-    record_dict['ctx'] = self.swaglogger.get_ctx()
+    # taken when the record was made if it's formatted on another thread
+    record_dict['ctx'] = record.ctx if hasattr(record, 'ctx') else self.swaglogger.get_ctx()
 
     if record.exc_info:
       record_dict['exc_info'] = self.formatException(record.exc_info)
@@ -62,7 +63,13 @@ class SwagFormatter(logging.Formatter):
     return record_dict
 
   def format(self, record):
-    return json_robust_dumps(self.format_dict(record))
+    record_dict = self.format_dict(record)
+    # the message may be serialized already, when it had to be snapshotted
+    msg_json = getattr(record, 'msg_json', None)
+    if msg_json is None:
+      return json_robust_dumps(record_dict)
+    del record_dict['msg']
+    return '{"msg": ' + msg_json + ', ' + json_robust_dumps(record_dict)[1:]
 
 class SwagErrorFilter(logging.Filter):
   def filter(self, record):
@@ -125,11 +132,8 @@ class SwagLogger(logging.Logger):
     Find the stack frame of the caller so that we can note the source
     file name, line number and function name.
     """
+    # findCaller, _log, then the logging method, the caller is next
     f = sys._getframe(3)
-    #On some versions of IronPython, currentframe() returns None if
-    #IronPython isn't run with -X:Frames.
-    if f is not None:
-        f = f.f_back
     orig_f = f
     while f and stacklevel > 1:
         f = f.f_back
@@ -141,8 +145,8 @@ class SwagLogger(logging.Logger):
         co = f.f_code
         filename = os.path.normcase(co.co_filename)
 
-        # TODO: is this pylint exception correct?
-        if filename == _srcfile:  # pylint: disable=comparison-with-callable
+        # skips SwagLogger.event and Logger.exception
+        if filename in (_srcfile(), logging._srcfile):
             f = f.f_back
             continue
         sinfo = None
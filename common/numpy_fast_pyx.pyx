@@ -0,0 +1,140 @@
+# distutils: language = c++
+# cython: language_level = 3
+cimport cython
+from cpython.mem cimport PyMem_Malloc, PyMem_Free
+from cpython.float cimport PyFloat_CheckExact
+from cpython.long cimport PyLong_CheckExact
+
+import numpy as np
+
+cdef enum:
+  STACK_N = 32
+
+
+def clip(x, lo, hi):
+  cdef double xd, lod, hid, t
+  if PyFloat_CheckExact(x) and PyFloat_CheckExact(lo) and PyFloat_CheckExact(hi):
+    xd, lod, hid = x, lo, hi
+    # same operand order as max(lo, min(hi, x)), so NaN handling is unchanged
+    t = xd if xd < hid else hid
+    return t if t > lod else lod
+  return max(lo, min(hi, x))
+
+
+cdef inline Py_ssize_t lower_bound(const double *xp, Py_ssize_t n, double x) nogil:
+  # first index with xp[i] >= x, the same index the linear search in interp stops at
+  cdef Py_ssize_t lo = 0, hi = n, mid
+  while lo < hi:
+    mid = (lo + hi) >> 1
+    if xp[mid] < x:
+      lo = mid + 1
+    else:
+      hi = mid
+  return lo
+
+
+cdef inline double interp_one(double x, const double *xp, const double *fp, Py_ssize_t n) nogil:
+  cdef Py_ssize_t hi = lower_bound(xp, n, x), low
+  if hi == n:
+    return fp[n - 1]
+  if hi == 0:
+    return fp[0]
+  low = hi - 1
+  return (x - xp[low]) * (fp[hi] - fp[low]) / (xp[hi] - xp[low]) + fp[low]
+
+
+cdef object interp_scalar(object x, const double *xp, const double *fp, Py_ssize_t n, object fp_first, object fp_last):
+  # python numbers and np.float64 give the same result in doubles, and np.float64 stays
+  # np.float64. other types, like np.float32, compute in their own precision in interp_py
+  cdef bint is_float64 = type(x) is np.float64
+  if not (is_float64 or PyFloat_CheckExact(x) or PyLong_CheckExact(x)):
+    raise TypeError("not a double")
+
+  cdef double xd = x
+  cdef Py_ssize_t hi = lower_bound(xp, n, xd)
+  # the end points are returned as the original objects, like interp_py does
+  if hi == n:
+    return fp_last
+  if hi == 0:
+    return fp_first
+  return np.float64(interp_one(xd, xp, fp, n)) if is_float64 else interp_one(xd, xp, fp, n)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef object interp_values(object x, const double *xp, const double *fp, Py_ssize_t n, object fp_first, object fp_last):
+  cdef double[::1] xv
+  cdef Py_ssize_t i, hi
+  if not hasattr(x, '__iter__'):
+    return interp_scalar(x, xp, fp, n, fp_first, fp_last)
+
+  if isinstance(x, np.ndarray) and x.ndim == 1 and x.dtype == np.float64:
+    xv = np.ascontiguousarray(x)
+    out = [None] * xv.shape[0]
+    for i in range(xv.shape[0]):
+      hi = lower_bound(xp, n, xv[i])
+      out[i] = fp_last if hi == n else (fp_first if hi == 0 else np.float64(interp_one(xv[i], xp, fp, n)))
+    return out
+
+  return [interp_scalar(v, xp, fp, n, fp_first, fp_last) for v in x]
+
+
+def interp_py(x, xp, fp):
+  # linear search on python objects, for inputs the double path can't represent exactly
+  N = len(xp)
+
+  def get_interp(xv):
+    hi = 0
+    while hi < N and xv > xp[hi]:
+      hi += 1
+    low = hi - 1
+    return fp[-1] if hi == N and xv > xp[low] else (
+      fp[0] if hi == 0 else
+      (xv - xp[low]) * (fp[hi] - fp[low]) / (xp[hi] - xp[low]) + fp[low])
+
+  return [get_interp(v) for v in x] if hasattr(x, '__iter__') else get_interp(x)
+
+
+def interp(x, xp, fp):
+  cdef Py_ssize_t n, i
+  cdef double xp_stack[STACK_N]
+  cdef double fp_stack[STACK_N]
+  cdef double *xpb = xp_stack
+  cdef double *fpb = fp_stack
+
+  try:
+    n = len(xp)
+    if n == 0 or len(fp) != n:
+      return interp_py(x, xp, fp)
+  except TypeError:
+    return interp_py(x, xp, fp)
+
+  if n > STACK_N:
+    xpb = <double *>PyMem_Malloc(n * sizeof(double))
+    fpb = <double *>PyMem_Malloc(n * sizeof(double))
+    if xpb == NULL or fpb == NULL:
+      PyMem_Free(xpb)
+      PyMem_Free(fpb)
+      raise MemoryError()
+
+  try:
+    try:
+      for i in range(n):
+        xpb[i] = xp[i]
+        fpb[i] = fp[i]
+    except (TypeError, ValueError):
+      return interp_py(x, xp, fp)
+
+    # binary search needs sorted breakpoints, keep the linear search semantics otherwise
+    for i in range(1, n):
+      if not xpb[i - 1] <= xpb[i]:
+        return interp_py(x, xp, fp)
+
+    try:
+      return interp_values(x, xpb, fpb, n, fp[0], fp[n - 1])
+    except (TypeError, ValueError):
+      return interp_py(x, xp, fp)
+  finally:
+    if n > STACK_N:
+      PyMem_Free(xpb)
+      PyMem_Free(fpb)
@@ -1,4 +1,6 @@
-import time
+import numpy as np
+
+from common.realtime import sec_since_boot
 
 class Profiler():
   def __init__(self, enabled=False):
@@ -6,7 +8,7 @@ class Profiler():
     self.cp = {}
     self.cp_ignored = []
     self.iter = 0
-    self.start_time = time.time()
+    self.start_time = sec_since_boot()
     self.last_time = self.start_time
     self.tot = 0.
 
@@ -15,14 +17,14 @@ class Profiler():
     self.cp = {}
     self.cp_ignored = []
     self.iter = 0
-    self.start_time = time.time()
+    self.start_time = sec_since_boot()
     self.last_time = self.start_time
 
   def checkpoint(self, name, ignore=False):
     # ignore flag needed when benchmarking threads with ratekeeper
     if not self.enabled:
       return
-    tt = time.time()
+    tt = sec_since_boot()
     if name not in self.cp:
       self.cp[name] = 0.
       if ignore:
@@ -43,3 +45,50 @@ class Profiler():
       else:
         print("%30s: %9.2f  avg: %7.2f  percent: %3.0f" % (n, ms*1000.0, ms*1000.0/self.iter, ms/self.tot*100))
     print("Iter clock: %2.6f   TOTAL: %2.2f" % (self.tot/self.iter, self.tot))
+
+
+class StageTimer():
+  """Always-on timer for the stages of a soft real time loop.
+
+  Stage durations of the last `size` iterations are kept in a ring buffer,
+  percentiles are only computed when a summary is requested. Stages in `ignore`, like
+  waiting for input, are timed but left out of the total."""
+  def __init__(self, stages, size=100, ignore=()):
+    self.stages = list(stages)
+    self.stage_idx = {s: i for i, s in enumerate(self.stages)}
+    self.counted = [i for i, s in enumerate(self.stages) if s not in ignore]
+    self.size = size
+    # one row per stage, the last row holds the total loop time
+    self.durations = np.zeros((len(self.stages) + 1, size))
+    self.count = 0
+    self.col = 0
+    self.last_time = 0.
+
+  def start(self):
+    self.col = self.count % self.size
+    self.durations[:, self.col] = 0.
+    self.last_time = sec_since_boot()
+
+  def checkpoint(self, stage):
+    # time since the last checkpoint is attributed to stage, a stage may be hit more than once per loop
+    tt = sec_since_boot()
+    self.durations[self.stage_idx[stage], self.col] += tt - self.last_time
+    self.last_time = tt
+
+  def finish(self):
+    self.durations[-1, self.col] = self.durations[self.counted, self.col].sum()
+    self.count += 1
+
+  def summary(self):
+    """Returns (name, p50, p90, p99, max) in seconds for each stage and the total, over the buffered loops."""
+    n = min(self.count, self.size)
+    if n == 0:
+      return []
+    d = self.durations[:, :n]
+    p = np.percentile(d, [50, 90, 99], axis=1)
+    mx = np.max(d, axis=1)
+    return [(name, p[0, i], p[1, i], p[2, i], mx[i]) for i, name in enumerate(self.stages + ['total'])]
+
+  def overruns(self, budget):
+    n = min(self.count, self.size)
+    return int(np.count_nonzero(self.durations[-1, :n] > budget))
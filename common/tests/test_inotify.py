@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+from common.inotify import IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_IGNORED, IN_ISDIR, Inotify
+
+
+class TestInotify(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.inotify = Inotify()
+    self.addCleanup(self.inotify.close)
+
+  def test_events(self):
+    wd = self.inotify.add_watch(self.tmp, IN_CREATE | IN_CLOSE_WRITE | IN_DELETE)
+    self.assertEqual(self.inotify.read_events(), [])
+
+    with open(os.path.join(self.tmp, "rlog"), 'w') as f:
+      f.write("x")
+    os.mkdir(os.path.join(self.tmp, "segment"))
+    os.unlink(os.path.join(self.tmp, "rlog"))
+    self.assertEqual(self.inotify.read_events(), [(wd, IN_CREATE, "rlog"), (wd, IN_CLOSE_WRITE, "rlog"),
+                                                  (wd, IN_CREATE | IN_ISDIR, "segment"), (wd, IN_DELETE, "rlog")])
+
+    self.inotify.rm_watch(wd)
+    self.assertEqual(self.inotify.read_events(), [(wd, IN_IGNORED, "")])
+
+  def test_missing(self):
+    with self.assertRaises(OSError) as e:
+      self.inotify.add_watch(os.path.join(self.tmp, "missing"), IN_CREATE)
+    self.assertEqual(e.exception.errno, errno.ENOENT)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import math
+import random
+import unittest
+import numpy as np
+
+from common import numpy_fast
+from common.numpy_fast import clip_py, interp_py
+
+try:
+  from common.numpy_fast_pyx import clip, interp  # pylint: disable=no-name-in-module
+except ImportError:
+  clip, interp = None, None
+
+TABLES = [
+  ([0.], [0.25]),
+  ([0., 35.], [3.6, 2.4]),
+  ([0, 5, 35], [1, 0.8, 0]),
+  ([0., 10., 10., 40.], [0.1, 0.2, 0.5, 0.3]),
+  ([-1., 0., 5., 15., 35.], [0., 0.03, 0.05, 0.1, 0.2]),
+  (np.linspace(0., 50., 50).tolist(), np.random.RandomState(0).uniform(-1., 1., 50).tolist()),
+  ([5., 0., 10.], [1., 2., 3.]),  # not sorted
+]
+
+
+@unittest.skipIf(interp is None, "numpy_fast_pyx not built")
+class TestNumpyFast(unittest.TestCase):
+  def assertSame(self, a, b):
+    if isinstance(b, list):
+      self.assertEqual(len(a), len(b))
+      for ai, bi in zip(a, b):
+        self.assertSame(ai, bi)
+    elif isinstance(b, float) and math.isnan(b):
+      self.assertTrue(math.isnan(a))
+    else:
+      self.assertIs(type(a), type(b))
+      self.assertEqual(float(a).hex(), float(b).hex())
+
+  def test_dispatch(self):
+    self.assertIs(numpy_fast.interp, interp)
+    self.assertIs(numpy_fast.clip, clip)
+
+  def test_interp_equals_python(self):
+    random.seed(0)
+    for xp, fp in TABLES:
+      xs = list(xp) + [xp[0] - 1., xp[-1] + 1., float('inf'), float('-inf'), float('nan'), -0.0, 3]
+      xs += [random.uniform(min(xp) - 5., max(xp) + 5.) for _ in range(1000)]
+      for x in xs:
+        self.assertSame(interp(x, xp, fp), interp_py(x, xp, fp))
+      self.assertSame(interp(xs, xp, fp), interp_py(xs, xp, fp))
+      self.assertSame(interp(tuple(xs), tuple(xp), tuple(fp)), interp_py(tuple(xs), tuple(xp), tuple(fp)))
+      self.assertSame(interp(np.array(xs), xp, fp), interp_py(np.array(xs), xp, fp))
+      # numpy scalars keep their type and precision
+      for dtype in (np.float64, np.float32, np.float16):
+        self.assertSame(interp(np.array(xs, dtype=dtype), xp, fp), interp_py(np.array(xs, dtype=dtype), xp, fp))
+        self.assertSame(interp([dtype(x) for x in xs], xp, fp), interp_py([dtype(x) for x in xs], xp, fp))
+
+  def test_interp_errors(self):
+    for args in [(None, [0., 1.], [0., 1.]), ([1., None], [0., 1.], [0., 1.]), (0.5, [], [])]:
+      with self.assertRaises((TypeError, IndexError)):
+        interp_py(*args)
+      with self.assertRaises((TypeError, IndexError)):
+        interp(*args)
+
+  def test_clip_equals_python(self):
+    random.seed(0)
+    values = [float('nan'), float('inf'), -float('inf'), 0, 5, -5, 1.5, -0.0] + [random.uniform(-5, 5) for _ in range(1000)]
+    for x in values:
+      for lo, hi in [(-1., 1.), (-1, 1), (0., 0.), (float('nan'), 1.), (-1., float('nan'))]:
+        self.assertSame(clip(x, lo, hi), clip_py(x, lo, hi))
+
+
+if __name__ == "__main__":
+  unittest.main()
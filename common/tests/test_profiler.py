@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+
+from common import profiler
+from common.profiler import StageTimer
+
+
+class FakeClock():
+  def __init__(self):
+    self.t = 0.
+
+  def __call__(self):
+    return self.t
+
+
+class TestStageTimer(unittest.TestCase):
+  def setUp(self):
+    self.clock = FakeClock()
+    p = mock.patch.object(profiler, 'sec_since_boot', self.clock)
+    p.start()
+    self.addCleanup(p.stop)
+
+  def loop(self, timer, durations):
+    timer.start()
+    for stage, dt in durations:
+      self.clock.t += dt
+      timer.checkpoint(stage)
+    timer.finish()
+
+  def test_stages(self):
+    timer = StageTimer(['recv', 'a', 'b'], size=4, ignore=['recv'])
+    for i in range(6):
+      # the wait for input is long, the work is 4 or 12 ms
+      self.loop(timer, [('recv', 0.009), ('a', 0.002), ('b', 0.001), ('a', 0.001 + 0.008 * (i % 2))])
+
+    summary = {name: rest for name, *rest in timer.summary()}
+    self.assertEqual(list(summary), ['recv', 'a', 'b', 'total'])
+    self.assertAlmostEqual(summary['recv'][3], 0.009)
+    self.assertAlmostEqual(summary['a'][3], 0.011)
+    self.assertAlmostEqual(summary['b'][0], 0.001)
+    # the wait isn't counted in the total or the budget
+    self.assertAlmostEqual(summary['total'][3], 0.012)
+    self.assertAlmostEqual(min(timer.durations[-1]), 0.004)
+    self.assertEqual(timer.overruns(0.01), 2)
+
+  def test_ring(self):
+    timer = StageTimer(['a'], size=2)
+    self.assertEqual(timer.summary(), [])
+    for dt in (0.5, 0.001, 0.002):
+      self.loop(timer, [('a', dt)])
+    # the first loop fell out of the window
+    self.assertAlmostEqual(timer.summary()[-1][4], 0.002)
+    self.assertEqual(timer.overruns(0.01), 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
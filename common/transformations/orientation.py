@@ -8,11 +8,22 @@ from common.transformations.transformations import (ecef_euler_from_ned_single,
                                                     quat2euler_single,
                                                     quat2rot_single,
                                                     rot2euler_single,
-                                                    rot2quat_single)
+                                                    rot2quat_single,
+                                                    ecef_euler_from_ned_batch,
+                                                    euler2quat_batch,
+                                                    euler2rot_batch,
+                                                    ned_euler_from_ecef_batch,
+                                                    quat2euler_batch,
+                                                    quat2rot_batch,
+                                                    rot2euler_batch,
+                                                    rot2quat_batch)
 
 
-def numpy_wrap(function, input_shape, output_shape):
-  """Wrap a function to take either an input or list of inputs and return the correct shape"""
+def numpy_wrap(function, input_shape, output_shape, batch_function=None):
+  """Wrap a function to take either an input or list of inputs and return the correct shape
+
+  batch_function takes the same arguments with the input as a contiguous (N,) + input_shape
+  float64 array and returns all N outputs at once, it replaces the loop over rows when given"""
   def f(*inps):
     *args, inp = inps
     inp = np.array(inp)
@@ -23,6 +34,12 @@ def numpy_wrap(function, input_shape, output_shape):
     else:
       out_shape = (shape[0],) + output_shape
 
+    if batch_function is not None and shape[len(shape) - len(input_shape):] == input_shape and \
+       len(shape) - len(input_shape) in (0, 1) and inp.dtype.kind in 'biuf':
+      result = batch_function(*args, np.ascontiguousarray(inp.reshape((-1,) + input_shape), dtype=np.float64))
+      result.shape = out_shape
+      return result
+
     # Add empty dimension if inputs is not a list
     if len(shape) == len(input_shape):
       inp.shape = (1, ) + inp.shape
@@ -33,14 +50,14 @@ def numpy_wrap(function, input_shape, output_shape):
   return f
 
 
-euler2quat = numpy_wrap(euler2quat_single, (3,), (4,))
-quat2euler = numpy_wrap(quat2euler_single, (4,), (3,))
-quat2rot = numpy_wrap(quat2rot_single, (4,), (3, 3))
-rot2quat = numpy_wrap(rot2quat_single, (3, 3), (4,))
-euler2rot = numpy_wrap(euler2rot_single, (3,), (3, 3))
-rot2euler = numpy_wrap(rot2euler_single, (3, 3), (3,))
-ecef_euler_from_ned = numpy_wrap(ecef_euler_from_ned_single, (3,), (3,))
-ned_euler_from_ecef = numpy_wrap(ned_euler_from_ecef_single, (3,), (3,))
+euler2quat = numpy_wrap(euler2quat_single, (3,), (4,), euler2quat_batch)
+quat2euler = numpy_wrap(quat2euler_single, (4,), (3,), quat2euler_batch)
+quat2rot = numpy_wrap(quat2rot_single, (4,), (3, 3), quat2rot_batch)
+rot2quat = numpy_wrap(rot2quat_single, (3, 3), (4,), rot2quat_batch)
+euler2rot = numpy_wrap(euler2rot_single, (3,), (3, 3), euler2rot_batch)
+rot2euler = numpy_wrap(rot2euler_single, (3, 3), (3,), rot2euler_batch)
+ecef_euler_from_ned = numpy_wrap(ecef_euler_from_ned_single, (3,), (3,), ecef_euler_from_ned_batch)
+ned_euler_from_ecef = numpy_wrap(ned_euler_from_ecef_single, (3,), (3,), ned_euler_from_ecef_batch)
 
 quats_from_rotations = rot2quat
 quat_from_rot = rot2quat
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+import unittest
+import numpy as np
+
+import common.transformations.coordinates as coord
+import common.transformations.orientation as orient
+from common.transformations import transformations as t
+
+N = 2000
+
+
+def looped(name, input_shape, output_shape):
+  """The per row wrapper the batch functions replaced"""
+  return orient.numpy_wrap(getattr(t, name + '_single'), input_shape, output_shape)
+
+
+def random_inputs(seed=0):
+  rng = np.random.RandomState(seed)
+  euler = np.column_stack([rng.uniform(-np.pi, np.pi, N), rng.uniform(-np.pi / 2, np.pi / 2, N), rng.uniform(-np.pi, np.pi, N)])
+  quat = rng.normal(size=(N, 4))
+  quat /= np.linalg.norm(quat, axis=1)[:, None]
+  geodetic = np.column_stack([rng.uniform(-89., 89., N), rng.uniform(-180., 180., N), rng.uniform(-100., 5000., N)])
+  return euler, quat, geodetic
+
+
+class TestVectorizedTransforms(unittest.TestCase):
+  def assertSame(self, a, b):
+    self.assertEqual(a.shape, b.shape)
+    self.assertEqual(a.dtype, b.dtype)
+    np.testing.assert_array_equal(a, b)
+
+  def check(self, vectorized, reference, inp, *args):
+    self.assertSame(vectorized(*args, inp), reference(*args, inp))
+    # single inputs and lists keep their shapes
+    self.assertSame(vectorized(*args, inp[0]), reference(*args, inp[0]))
+    self.assertSame(vectorized(*args, inp[:3].tolist()), reference(*args, inp[:3].tolist()))
+    self.assertSame(vectorized(*args, inp[:0]), reference(*args, inp[:0]))
+
+  def test_orientation(self):
+    euler, quat, geodetic = random_inputs()
+    rot = orient.rot_from_quat(quat)
+    ecef_init = coord.geodetic2ecef(geodetic[0])
+
+    self.check(orient.euler2quat, looped('euler2quat', (3,), (4,)), euler)
+    self.check(orient.quat2euler, looped('quat2euler', (4,), (3,)), quat)
+    self.check(orient.quat2rot, looped('quat2rot', (4,), (3, 3)), quat)
+    self.check(orient.rot2quat, looped('rot2quat', (3, 3), (4,)), rot)
+    self.check(orient.euler2rot, looped('euler2rot', (3,), (3, 3)), euler)
+    self.check(orient.rot2euler, looped('rot2euler', (3, 3), (3,)), rot)
+    self.check(orient.ecef_euler_from_ned, looped('ecef_euler_from_ned', (3,), (3,)), euler, ecef_init)
+    self.check(orient.ned_euler_from_ecef, looped('ned_euler_from_ecef', (3,), (3,)), euler, ecef_init)
+
+    # non contiguous and integer input
+    self.assertSame(orient.quat2euler(quat.T.copy().T), looped('quat2euler', (4,), (3,))(quat))
+    self.assertSame(orient.euler2quat([[0, 1, 0]]), looped('euler2quat', (3,), (4,))([[0, 1, 0]]))
+
+  def test_coordinates(self):
+    _, _, geodetic = random_inputs(1)
+    ecef = coord.geodetic2ecef(geodetic)
+    converter = coord.LocalCoord.from_geodetic(geodetic[0])
+    ned = converter.ecef2ned(ecef[:100])
+
+    self.check(coord.geodetic2ecef, looped('geodetic2ecef', (3,), (3,)), geodetic)
+    self.check(coord.ecef2geodetic, looped('ecef2geodetic', (3,), (3,)), ecef)
+    for name, inp in [('ecef2ned', ecef), ('ned2ecef', ned), ('geodetic2ned', geodetic), ('ned2geodetic', ned)]:
+      reference = orient.numpy_wrap(getattr(t.LocalCoord, name + '_single'), (3,), (3,))
+      self.check(getattr(coord.LocalCoord, name), reference, inp, converter)
+
+
+if __name__ == "__main__":
+  unittest.main()
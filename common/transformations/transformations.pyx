@@ -112,6 +112,148 @@ def ecef2geodetic_single(ecef):
     return [g.lat, g.lon, g.alt]
 
 
+# Batch versions of the functions above, looping in C over the rows of a
+# C contiguous (N, ...) float64 array. orientation.py and coordinates.py
+# dispatch batched inputs to these.
+
+cdef inline Matrix3 row2matrix(const double[:, :, ::1] m, Py_ssize_t i):
+    # Matrix3(double *) reads column major
+    cdef double buf[9]
+    cdef int r, c
+    for r in range(3):
+        for c in range(3):
+            buf[c * 3 + r] = m[i, r, c]
+    return Matrix3(buf)
+
+cdef inline void matrix2row(Matrix3 m, double[:, :, ::1] out, Py_ssize_t i):
+    cdef int r, c
+    for r in range(3):
+        for c in range(3):
+            out[i, r, c] = m(r, c)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def euler2quat_batch(const double[:, ::1] euler):
+    cdef Py_ssize_t i
+    cdef Quaternion q
+    out = np.empty((euler.shape[0], 4))
+    cdef double[:, ::1] o = out
+    for i in range(euler.shape[0]):
+        q = euler2quat_c(Vector3(euler[i, 0], euler[i, 1], euler[i, 2]))
+        o[i, 0], o[i, 1], o[i, 2], o[i, 3] = q.w(), q.x(), q.y(), q.z()
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def quat2euler_batch(const double[:, ::1] quat):
+    cdef Py_ssize_t i
+    cdef Vector3 e
+    out = np.empty((quat.shape[0], 3))
+    cdef double[:, ::1] o = out
+    for i in range(quat.shape[0]):
+        e = quat2euler_c(Quaternion(quat[i, 0], quat[i, 1], quat[i, 2], quat[i, 3]))
+        o[i, 0], o[i, 1], o[i, 2] = e(0), e(1), e(2)
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def quat2rot_batch(const double[:, ::1] quat):
+    cdef Py_ssize_t i
+    out = np.empty((quat.shape[0], 3, 3))
+    cdef double[:, :, ::1] o = out
+    for i in range(quat.shape[0]):
+        matrix2row(quat2rot_c(Quaternion(quat[i, 0], quat[i, 1], quat[i, 2], quat[i, 3])), o, i)
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def rot2quat_batch(const double[:, :, ::1] rot):
+    cdef Py_ssize_t i
+    cdef Quaternion q
+    out = np.empty((rot.shape[0], 4))
+    cdef double[:, ::1] o = out
+    for i in range(rot.shape[0]):
+        q = rot2quat_c(row2matrix(rot, i))
+        o[i, 0], o[i, 1], o[i, 2], o[i, 3] = q.w(), q.x(), q.y(), q.z()
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def euler2rot_batch(const double[:, ::1] euler):
+    cdef Py_ssize_t i
+    out = np.empty((euler.shape[0], 3, 3))
+    cdef double[:, :, ::1] o = out
+    for i in range(euler.shape[0]):
+        matrix2row(euler2rot_c(Vector3(euler[i, 0], euler[i, 1], euler[i, 2])), o, i)
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def rot2euler_batch(const double[:, :, ::1] rot):
+    cdef Py_ssize_t i
+    cdef Vector3 e
+    out = np.empty((rot.shape[0], 3))
+    cdef double[:, ::1] o = out
+    for i in range(rot.shape[0]):
+        e = rot2euler_c(row2matrix(rot, i))
+        o[i, 0], o[i, 1], o[i, 2] = e(0), e(1), e(2)
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def ecef_euler_from_ned_batch(ecef_init, const double[:, ::1] ned_pose):
+    cdef ECEF init = list2ecef(ecef_init)
+    cdef Py_ssize_t i
+    cdef Vector3 e
+    out = np.empty((ned_pose.shape[0], 3))
+    cdef double[:, ::1] o = out
+    for i in range(ned_pose.shape[0]):
+        e = ecef_euler_from_ned_c(init, Vector3(ned_pose[i, 0], ned_pose[i, 1], ned_pose[i, 2]))
+        o[i, 0], o[i, 1], o[i, 2] = e(0), e(1), e(2)
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def ned_euler_from_ecef_batch(ecef_init, const double[:, ::1] ecef_pose):
+    cdef ECEF init = list2ecef(ecef_init)
+    cdef Py_ssize_t i
+    cdef Vector3 e
+    out = np.empty((ecef_pose.shape[0], 3))
+    cdef double[:, ::1] o = out
+    for i in range(ecef_pose.shape[0]):
+        e = ned_euler_from_ecef_c(init, Vector3(ecef_pose[i, 0], ecef_pose[i, 1], ecef_pose[i, 2]))
+        o[i, 0], o[i, 1], o[i, 2] = e(0), e(1), e(2)
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def geodetic2ecef_batch(const double[:, ::1] geodetic):
+    cdef Py_ssize_t i
+    cdef Geodetic g
+    cdef ECEF e
+    out = np.empty((geodetic.shape[0], 3))
+    cdef double[:, ::1] o = out
+    for i in range(geodetic.shape[0]):
+        g.lat, g.lon, g.alt = geodetic[i, 0], geodetic[i, 1], geodetic[i, 2]
+        e = geodetic2ecef_c(g)
+        o[i, 0], o[i, 1], o[i, 2] = e.x, e.y, e.z
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def ecef2geodetic_batch(const double[:, ::1] ecef):
+    cdef Py_ssize_t i
+    cdef ECEF e
+    cdef Geodetic g
+    out = np.empty((ecef.shape[0], 3))
+    cdef double[:, ::1] o = out
+    for i in range(ecef.shape[0]):
+        e.x, e.y, e.z = ecef[i, 0], ecef[i, 1], ecef[i, 2]
+        g = ecef2geodetic_c(e)
+        o[i, 0], o[i, 1], o[i, 2] = g.lat, g.lon, g.alt
+    return out
+
+
 cdef class LocalCoord:
     cdef LocalCoord_c * lc
 
@@ -170,5 +312,65 @@ cdef class LocalCoord:
         cdef Geodetic g = self.lc.ned2geodetic(n)
         return [g.lat, g.lon, g.alt]
 
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def ecef2ned_batch(self, const double[:, ::1] ecef):
+        assert self.lc
+        cdef Py_ssize_t i
+        cdef ECEF e
+        cdef NED n
+        out = np.empty((ecef.shape[0], 3))
+        cdef double[:, ::1] o = out
+        for i in range(ecef.shape[0]):
+            e.x, e.y, e.z = ecef[i, 0], ecef[i, 1], ecef[i, 2]
+            n = self.lc.ecef2ned(e)
+            o[i, 0], o[i, 1], o[i, 2] = n.n, n.e, n.d
+        return out
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def ned2ecef_batch(self, const double[:, ::1] ned):
+        assert self.lc
+        cdef Py_ssize_t i
+        cdef NED n
+        cdef ECEF e
+        out = np.empty((ned.shape[0], 3))
+        cdef double[:, ::1] o = out
+        for i in range(ned.shape[0]):
+            n.n, n.e, n.d = ned[i, 0], ned[i, 1], ned[i, 2]
+            e = self.lc.ned2ecef(n)
+            o[i, 0], o[i, 1], o[i, 2] = e.x, e.y, e.z
+        return out
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def geodetic2ned_batch(self, const double[:, ::1] geodetic):
+        assert self.lc
+        cdef Py_ssize_t i
+        cdef Geodetic g
+        cdef NED n
+        out = np.empty((geodetic.shape[0], 3))
+        cdef double[:, ::1] o = out
+        for i in range(geodetic.shape[0]):
+            g.lat, g.lon, g.alt = geodetic[i, 0], geodetic[i, 1], geodetic[i, 2]
+            n = self.lc.geodetic2ned(g)
+            o[i, 0], o[i, 1], o[i, 2] = n.n, n.e, n.d
+        return out
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def ned2geodetic_batch(self, const double[:, ::1] ned):
+        assert self.lc
+        cdef Py_ssize_t i
+        cdef NED n
+        cdef Geodetic g
+        out = np.empty((ned.shape[0], 3))
+        cdef double[:, ::1] o = out
+        for i in range(ned.shape[0]):
+            n.n, n.e, n.d = ned[i, 0], ned[i, 1], ned[i, 2]
+            g = self.lc.ned2geodetic(n)
+            o[i, 0], o[i, 1], o[i, 2] = g.lat, g.lon, g.alt
+        return out
+
     def __dealloc__(self):
         del self.lc
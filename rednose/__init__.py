@@ -55,4 +55,11 @@ class KalmanFilter:
     if R is None:
       R = self.get_R(kind, len(data))
 
-    self.filter.predict_and_update_batch(t, kind, data, R)
+    return self.filter.predict_and_update_batch(t, kind, data, R)
+
+  def rts_smooth(self, estimates):
+    return self.filter.rts_smooth(estimates)
+
+  def smooth_log(self, observations):
+    """Filters a whole log of (t, kind, data) observations offline and smooths the estimates"""
+    return self.filter.smooth_log(observations, observe=self.predict_and_observe)
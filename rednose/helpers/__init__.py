@@ -1,9 +1,21 @@
 import os
+import hashlib
 import platform
+import stat
+import tempfile
 from cffi import FFI
 
 TEMPLATE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'templates'))
 
+# generated code is reused when the symbolic model and the generator didn't change,
+# set to an empty string to always regenerate. Kept next to the scons cache on device,
+# in the build tree otherwise
+if os.path.isdir('/data'):
+  DEFAULT_CACHE_DIR = '/data/rednose_cache'
+else:
+  DEFAULT_CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.cache'))
+CACHE_DIR = os.environ.get('REDNOSE_CACHE_DIR', DEFAULT_CACHE_DIR)
+
 
 def write_code(folder, name, code, header):
   if not os.path.exists(folder):
@@ -13,6 +25,65 @@ def write_code(folder, name, code, header):
   open(os.path.join(folder, f"{name}.h"), 'w').write(header)
 
 
+def code_hash(sources, model):
+  """Content hash of the generator source files and the repr of the symbolic model"""
+  h = hashlib.sha256()
+  for fn in sources:
+    with open(fn, 'rb') as f:
+      h.update(f.read())
+  h.update(model.encode())
+  return h.hexdigest()
+
+
+def cache_dir():
+  """CACHE_DIR, created owner-only. None when caching is off or the directory
+  can't be trusted: a symlink, not ours or writable by others"""
+  if not CACHE_DIR:
+    return None
+
+  try:
+    os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+    st = os.lstat(CACHE_DIR)
+  except OSError:
+    return None
+  if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+    return None
+  return CACHE_DIR
+
+
+def load_cached_code(folder, name, key):
+  """Writes previously generated code for key to folder, returns False if there is none"""
+  cache = cache_dir()
+  if cache is None:
+    return False
+
+  try:
+    with open(os.path.join(cache, f"{key}.cpp")) as f:
+      code = f.read()
+    with open(os.path.join(cache, f"{key}.h")) as f:
+      header = f.read()
+  except OSError:
+    return False
+
+  write_code(folder, name, code, header)
+  return True
+
+
+def cache_code(key, code, header):
+  cache = cache_dir()
+  if cache is None:
+    return
+
+  try:
+    # header last, a cache entry only counts once both files are complete
+    for ext, content in (("cpp", code), ("h", header)):
+      with tempfile.NamedTemporaryFile('w', dir=cache, delete=False) as f:
+        f.write(content)
+      os.replace(f.name, os.path.join(cache, f"{key}.{ext}"))
+  except OSError:
+    pass
+
+
 def load_code(folder, name):
   shared_ext = "dylib" if platform.system() == "Darwin" else "so"
   shared_fn = os.path.join(folder, f"lib{name}.{shared_ext}")
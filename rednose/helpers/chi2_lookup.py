@@ -1,7 +1,10 @@
 import os
+from functools import lru_cache
 
 import numpy as np
 
+PPF_P = np.arange(.01, .99, .01)
+
 
 def gen_chi2_ppf_lookup(max_dim=200):
   from scipy.stats import chi2
@@ -12,10 +15,13 @@ def gen_chi2_ppf_lookup(max_dim=200):
   np.save('chi2_lookup_table', table)
 
 
+@lru_cache(maxsize=None)
+def chi2_table():
+  return np.load(os.path.dirname(os.path.realpath(__file__)) + '/chi2_lookup_table.npy')
+
+
 def chi2_ppf(p, dim):
-  table = np.load(os.path.dirname(os.path.realpath(__file__)) + '/chi2_lookup_table.npy')
-  result = np.interp(p, np.arange(.01, .99, .01), table[dim])
-  return result
+  return np.interp(p, PPF_P, chi2_table()[dim])
 
 
 if __name__ == "__main__":
@@ -1,15 +1,20 @@
 import os
-from bisect import bisect_right
+import math
+from multiprocessing import Pool
 
 import numpy as np
 import sympy as sp
 from numpy import dot
 
+from rednose.helpers import sympy_helpers, chi2_lookup
 from rednose.helpers.sympy_helpers import sympy_into_c
-from rednose.helpers import (TEMPLATE_DIR, load_code, write_code)
+from rednose.helpers import (TEMPLATE_DIR, load_code, write_code, code_hash, load_cached_code, cache_code)
 from rednose.helpers.chi2_lookup import chi2_ppf
 
 
+REWIND_TO_KEEP = 512
+
+
 def solve(a, b):
   if a.shape[0] == 1 and a.shape[1] == 1:
     return b / a[0][0]
@@ -25,13 +30,61 @@ def null(H, eps=1e-12):
   return np.transpose(null_space)
 
 
+# everything the generated code depends on besides the symbolic model
+GEN_CODE_SOURCES = [
+  os.path.realpath(__file__),
+  os.path.realpath(sympy_helpers.__file__),
+  os.path.join(os.path.dirname(os.path.realpath(chi2_lookup.__file__)), 'chi2_lookup_table.npy'),
+  os.path.join(TEMPLATE_DIR, "ekf_c.c"),
+]
+
+
+def jacobian(expr, wrt, zero_syms=None, required_sym=None):
+  J = expr.jacobian(wrt)
+  if zero_syms is not None:
+    for sym in zero_syms:
+      J = J.subs(sym, 0)
+  assert required_sym is None or required_sym in J.free_symbols
+  return J
+
+
+def gen_c_unit(unit):
+  """Returns the C header and code of a group of sympy functions. Runs in a worker
+  process, expressions given as a tuple of jacobian() arguments are linearized there."""
+  functions, global_vars = unit
+  sympy_functions = []
+  for name, expr, args in functions:
+    if isinstance(expr, tuple):
+      expr = jacobian(*expr)
+    sympy_functions.append((name, expr, args))
+  return sympy_into_c(sympy_functions, global_vars)
+
+
+def gen_c(units, global_vars, processes=None):
+  units = [(functions, global_vars) for functions in units]
+  processes = min(len(units), processes or os.cpu_count() or 1)
+  if processes > 1:
+    with Pool(processes) as pool:
+      parts = pool.map(gen_c_unit, units)
+  else:
+    parts = [gen_c_unit(unit) for unit in units]
+  return "\n".join(header for header, _ in parts), "".join(code for _, code in parts)
+
+
 def gen_code(folder, name, f_sym, dt_sym, x_sym, obs_eqs, dim_x, dim_err, eskf_params=None, msckf_params=None,  # pylint: disable=dangerous-default-value
-             maha_test_kinds=[], global_vars=None):
+             maha_test_kinds=[], global_vars=None, extra_routines=None):
   # optional state transition matrix, H modifier
   # and err_function if an error-state kalman filter (ESKF)
   # is desired. Best described in "Quaternion kinematics
   # for the error-state Kalman filter" by Joan Sola
 
+  # skip sympy entirely if this model was generated before
+  model = sp.srepr((sp.__version__, name, f_sym, dt_sym, x_sym, obs_eqs, dim_x, dim_err, eskf_params, msckf_params,
+                    maha_test_kinds, global_vars, extra_routines))
+  key = code_hash(GEN_CODE_SOURCES, model)
+  if load_cached_code(folder, name, key):
+    return
+
   if eskf_params:
     err_eqs = eskf_params[0]
     inv_err_eqs = eskf_params[1]
@@ -71,21 +124,9 @@ def gen_code(folder, name, f_sym, dt_sym, x_sym, obs_eqs, dim_x, dim_err, eskf_p
     dim_augment_err = 0
     N = 0
 
-  # linearize with jacobians
-  F_sym = f_err_sym.jacobian(x_err_sym)
-
-  if eskf_params:
-    for sym in x_err_sym:
-      F_sym = F_sym.subs(sym, 0)
-
-  assert dt_sym in F_sym.free_symbols
-
-  for i in range(len(obs_eqs)):
-    obs_eqs[i].append(obs_eqs[i][0].jacobian(x_sym))
-    if msckf and obs_eqs[i][1] in feature_track_kinds:
-      obs_eqs[i].append(obs_eqs[i][0].jacobian(obs_eqs[i][2]))
-    else:
-      obs_eqs[i].append(None)
+  # linearize with jacobians, the process model and every
+  # observation kind are generated in their own process
+  F_sym = (f_err_sym, x_err_sym, x_err_sym if eskf_params else None, dt_sym)
 
   # collect sympy functions
   sympy_functions = []
@@ -99,17 +140,22 @@ def gen_code(folder, name, f_sym, dt_sym, x_sym, obs_eqs, dim_x, dim_err, eskf_p
 
   # state propagation function
   sympy_functions.append(('f_fun', f_sym, [x_sym, dt_sym]))
-  sympy_functions.append(('F_fun', F_sym, [x_sym, dt_sym]))
+  units = [sympy_functions, [('F_fun', F_sym, [x_sym, dt_sym])]]
 
   # observation functions
-  for h_sym, kind, ea_sym, H_sym, He_sym in obs_eqs:
-    sympy_functions.append(('h_%d' % kind, h_sym, [x_sym, ea_sym]))
-    sympy_functions.append(('H_%d' % kind, H_sym, [x_sym, ea_sym]))
+  for h_sym, kind, ea_sym in obs_eqs:
+    unit = [('h_%d' % kind, h_sym, [x_sym, ea_sym]),
+            ('H_%d' % kind, (h_sym, x_sym), [x_sym, ea_sym])]
     if msckf and kind in feature_track_kinds:
-      sympy_functions.append(('He_%d' % kind, He_sym, [x_sym, ea_sym]))
+      unit.append(('He_%d' % kind, (h_sym, ea_sym), [x_sym, ea_sym]))
+    units.append(unit)
+
+  # other functions of the model the user wants in C, (name, expr, args) like above
+  if extra_routines:
+    units.append(list(extra_routines))
 
   # Generate and wrap all th c code
-  header, code = sympy_into_c(sympy_functions, global_vars)
+  header, code = gen_c(units, global_vars)
   extra_header = "#define DIM %d\n" % dim_x
   extra_header += "#define EDIM %d\n" % dim_err
   extra_header += "#define MEDIM %d\n" % dim_main_err
@@ -119,7 +165,7 @@ def gen_code(folder, name, f_sym, dt_sym, x_sym, obs_eqs, dim_x, dim_err, eskf_p
 
   extra_post = ""
 
-  for h_sym, kind, ea_sym, H_sym, He_sym in obs_eqs:
+  for h_sym, kind, ea_sym in obs_eqs:
     if msckf and kind in feature_track_kinds:
       He_str = 'He_%d' % kind
       # ea_dim = ea_sym.shape[0]
@@ -136,6 +182,15 @@ def gen_code(folder, name, f_sym, dt_sym, x_sym, obs_eqs, dim_x, dim_err, eskf_p
     extra_header += "\nconst static double MAHA_THRESH_%d = %f;" % (kind, maha_thresh)
     extra_header += "\nvoid update_%d(double *, double *, double *, double *, double *);" % kind
 
+    # stacked update of a whole batch, not for feature tracks that need the null space projection
+    if not (msckf and kind in feature_track_kinds):
+      extra_post += """
+        void update_batch_%d(double *in_x, double *in_P, int n, double *in_z, double *in_R, double *in_ea, int ea_dim) {
+          update_batch<%d,%d>(in_x, in_P, h_%d, H_%d, n, in_z, in_R, in_ea, ea_dim, MAHA_THRESH_%d);
+        }
+      """ % (kind, h_sym.shape[0], maha_test, kind, kind, kind)
+      extra_header += "\nvoid update_batch_%d(double *, double *, int, double *, double *, double *, int);" % kind
+
   code += '\nextern "C"{\n' + extra_header + "\n}\n"
   code += "\n" + open(os.path.join(TEMPLATE_DIR, "ekf_c.c")).read()
   code += '\nextern "C"{\n' + extra_post + "\n}\n"
@@ -153,6 +208,77 @@ def gen_code(folder, name, f_sym, dt_sym, x_sym, obs_eqs, dim_x, dim_err, eskf_p
   header += "\n" + extra_header
 
   write_code(folder, name, code, header)
+  cache_code(key, code, header)
+
+
+class RewindBuffer():
+  """Fixed capacity circular buffer of filter checkpoints. States and covariances are copied
+  into preallocated slots, the oldest checkpoint is overwritten once the buffer is full."""
+  def __init__(self, capacity, dim_x, dim_err):
+    self.capacity = capacity
+    self.t = np.zeros(capacity, dtype=np.float64)
+    self.x = np.zeros((capacity, dim_x, 1), dtype=np.float64)
+    self.P = np.zeros((capacity, dim_err, dim_err), dtype=np.float64)
+    self.obs = [None] * capacity
+    self.start = 0
+    self.count = 0
+
+  def __len__(self):
+    return self.count
+
+  def clear(self):
+    self.obs = [None] * self.capacity
+    self.start = 0
+    self.count = 0
+
+  def slot(self, i):
+    return (self.start + i) % self.capacity
+
+  def oldest_t(self):
+    return float(self.t[self.start])
+
+  def newest_t(self):
+    return float(self.t[self.slot(self.count - 1)])
+
+  def push(self, t, x, P, obs):
+    if self.count < self.capacity:
+      i = self.slot(self.count)
+      self.count += 1
+    else:
+      i = self.start
+      self.start = self.slot(1)
+    self.t[i] = t
+    self.x[i] = x
+    self.P[i] = P
+    self.obs[i] = obs
+
+  def bisect_right(self, t):
+    lo, hi = 0, self.count
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if t < self.t[self.slot(mid)]:
+        hi = mid
+      else:
+        lo = mid + 1
+    return lo
+
+  def rewind(self, t, x, P):
+    """Restores the last checkpoint at or before t into x and P, drops the later
+    checkpoints and returns their time and observations for fast forwarding"""
+    idx = self.bisect_right(t)
+    assert 0 < idx < self.count  # must be true, or rewind wouldn't be called
+
+    i = self.slot(idx - 1)
+    x[:] = self.x[i]
+    P[:] = self.P[i]
+
+    ret = []
+    for j in range(idx, self.count):
+      k = self.slot(j)
+      ret.append(self.obs[k])
+      self.obs[k] = None
+    self.count = idx
+    return float(self.t[i]), ret
 
 
 class EKF_sym():
@@ -185,12 +311,11 @@ class EKF_sym():
 
     # rewind stuff
     self.max_rewind_age = max_rewind_age
-    self.rewind_t = []
-    self.rewind_states = []
-    self.rewind_obscache = []
+    self.rewinder = RewindBuffer(REWIND_TO_KEEP, self.dim_x, self.dim_err)
     self.init_state(x_initial, P_initial, None)
 
     ffi, lib = load_code(folder, name)
+    self.ffi, self.lib = ffi, lib
     kinds, self.feature_track_kinds = [], []
     for func in dir(lib):
       if func[:2] == 'h_':
@@ -273,6 +398,27 @@ class EKF_sym():
     for kind in kinds:
       self._updates[kind] = fun_wrapper("update_%d" % kind, kind)
 
+    # wrap the C++ batch update functions
+    def batch_fun_wrapper(f):
+      f = eval("lib.%s" % f, {"lib": lib})  # pylint: disable=eval-used
+
+      def _update_batch_blas(x, P, z, R, extra_args):
+        f(ffi.cast("double *", x.ctypes.data),
+          ffi.cast("double *", P.ctypes.data),
+          ffi.cast("int", z.shape[0]),
+          ffi.cast("double *", z.ctypes.data),
+          ffi.cast("double *", R.ctypes.data),
+          ffi.cast("double *", extra_args.ctypes.data),
+          ffi.cast("int", extra_args.shape[1]))
+        return x, P, z
+      return _update_batch_blas
+
+    self._batch_updates = {}
+    for kind in kinds:
+      # code generated before batch updates existed doesn't have them
+      if hasattr(lib, "update_batch_%d" % kind):
+        self._batch_updates[kind] = batch_fun_wrapper("update_batch_%d" % kind)
+
     def _update_blas(x, P, kind, z, R, extra_args=[]):  # pylint: disable=dangerous-default-value
         return self._updates[kind](x, P, z, R, extra_args)
 
@@ -282,19 +428,24 @@ class EKF_sym():
     self._update = _update_blas
     # self._update = self._update_python
 
+  def extra_routine(self, name):
+    """Wraps a function generated with gen_code(extra_routines=...), it takes
+    the contiguous float64 input arrays followed by the output array"""
+    func, ffi = getattr(self.lib, name), self.ffi
+
+    def ret(*arrays):
+      func(*[ffi.cast("double *", a.ctypes.data) for a in arrays])
+    return ret
+
   def init_state(self, state, covs, filter_time):
     self.x = np.array(state.reshape((-1, 1))).astype(np.float64)
     self.P = np.array(covs).astype(np.float64)
     self.filter_time = filter_time
     self.augment_times = [0] * self.N
-    self.rewind_obscache = []
-    self.rewind_t = []
-    self.rewind_states = []
+    self.reset_rewind()
 
   def reset_rewind(self):
-    self.rewind_obscache = []
-    self.rewind_t = []
-    self.rewind_states = []
+    self.rewinder.clear()
 
   def augment(self):
     # TODO this is not a generalized way of doing this and implies that the augmented states
@@ -331,38 +482,14 @@ class EKF_sym():
     return self.P
 
   def rewind(self, t):
-    # find where we are rewinding to
-    idx = bisect_right(self.rewind_t, t)
-    assert self.rewind_t[idx - 1] <= t
-    assert self.rewind_t[idx] > t    # must be true, or rewind wouldn't be called
-
-    # set the state to the time right before that
-    self.filter_time = self.rewind_t[idx - 1]
-    self.x[:] = self.rewind_states[idx - 1][0]
-    self.P[:] = self.rewind_states[idx - 1][1]
-
+    # set the state to the time right before t and
     # return the observations we rewound over for fast forwarding
-    ret = self.rewind_obscache[idx:]
-
-    # throw away the old future
-    # TODO: is this making a copy?
-    self.rewind_t = self.rewind_t[:idx]
-    self.rewind_states = self.rewind_states[:idx]
-    self.rewind_obscache = self.rewind_obscache[:idx]
-
+    self.filter_time, ret = self.rewinder.rewind(t, self.x, self.P)
     return ret
 
   def checkpoint(self, obs):
-    # push to rewinder
-    self.rewind_t.append(self.filter_time)
-    self.rewind_states.append((np.copy(self.x), np.copy(self.P)))
-    self.rewind_obscache.append(obs)
-
-    # only keep a certain number around
-    REWIND_TO_KEEP = 512
-    self.rewind_t = self.rewind_t[-REWIND_TO_KEEP:]
-    self.rewind_states = self.rewind_states[-REWIND_TO_KEEP:]
-    self.rewind_obscache = self.rewind_obscache[-REWIND_TO_KEEP:]
+    # push to rewinder, only the last REWIND_TO_KEEP are kept around
+    self.rewinder.push(self.filter_time, self.x, self.P, obs)
 
   def predict(self, t):
     # initialize time
@@ -380,7 +507,7 @@ class EKF_sym():
 
     # rewind
     if self.filter_time is not None and t < self.filter_time:
-      if len(self.rewind_t) == 0 or t < self.rewind_t[0] or t < self.rewind_t[-1] - self.max_rewind_age:
+      if len(self.rewinder) == 0 or t < self.rewinder.oldest_t() or t < self.rewinder.newest_t() - self.max_rewind_age:
         print("observation too old at %.3f with filter at %.3f, ignoring" % (t, self.filter_time))
         return None
       rewound = self.rewind(t)
@@ -426,15 +553,26 @@ class EKF_sym():
     xk_km1, Pk_km1 = np.copy(self.x).flatten(), np.copy(self.P)
 
     # update batch
-    y = []
-    for i in range(len(z)):
-      # these are from the user, so we canonicalize them
-      z_i = np.array(z[i], dtype=np.float64, order='F')
-      R_i = np.array(R[i], dtype=np.float64, order='F')
-      extra_args_i = np.array(extra_args[i], dtype=np.float64, order='F')
-      # update
-      self.x, self.P, y_i = self._update(self.x, self.P, kind, z_i, R_i, extra_args=extra_args_i)
-      y.append(y_i)
+    if len(z) > 1 and kind in self._batch_updates:
+      # all observations in one stacked update, the C code writes the residuals into z_b
+      z_b = np.array(z, dtype=np.float64, order='C').reshape((len(z), -1))
+      R_b = np.array(R, dtype=np.float64, order='C')
+      if all(len(ea) == 0 for ea in extra_args):
+        extra_args_b = np.zeros((len(z), 0), dtype=np.float64)
+      else:
+        extra_args_b = np.array(extra_args, dtype=np.float64, order='C').reshape((len(z), -1))
+      self.x, self.P, z_b = self._batch_updates[kind](self.x, self.P, z_b, R_b, extra_args_b)
+      y = list(z_b)
+    else:
+      y = []
+      for i in range(len(z)):
+        # these are from the user, so we canonicalize them
+        z_i = np.array(z[i], dtype=np.float64, order='F')
+        R_i = np.array(R[i], dtype=np.float64, order='F')
+        extra_args_i = np.array(extra_args[i], dtype=np.float64, order='F')
+        # update
+        self.x, self.P, y_i = self._update(self.x, self.P, kind, z_i, R_i, extra_args=extra_args_i)
+        y.append(y_i)
     xk_k, Pk_k = np.copy(self.x).flatten(), np.copy(self.P)
 
     if augment:
@@ -571,36 +709,77 @@ class EKF_sym():
     If the kalman state is augmented with
     old states only the main state is smoothed
     '''
-    xk_n = estimates[-1][0]
-    Pk_n = estimates[-1][2]
-    Fk_1 = np.zeros(Pk_n.shape, dtype=np.float64)
-
-    states_smoothed = [xk_n]
-    covs_smoothed = [Pk_n]
-    for k in range(len(estimates) - 2, -1, -1):
-      xk1_n = xk_n
+    n = len(estimates)
+    d1 = self.dim_main
+    d2 = self.dim_main_err
+
+    xs = np.array([e[1] for e in estimates], dtype=np.float64)
+    Ps = np.array([e[3] for e in estimates], dtype=np.float64)
+    xs[-1] = estimates[-1][0]
+    Ps[-1] = estimates[-1][2]
+    if n < 2:
+      return xs, Ps
+
+    # filter outputs the backward pass needs, stacked
+    xk1_k = np.array([e[0] for e in estimates[1:]], dtype=np.float64)
+    Pk1_k = np.array([e[2][:d2, :d2] for e in estimates[1:]], dtype=np.float64)
+    Pk_k = Ps[:-1, :d2, :d2].copy()
+    dts = np.diff([e[4] for e in estimates])
+
+    Fk_1 = np.zeros((n - 1, self.dim_err, self.dim_err), dtype=np.float64)
+    delta_x = np.zeros((self.dim_err, 1), dtype=np.float64)
+    x_new = np.zeros((self.dim_x, 1), dtype=np.float64)
+
+    # the generated functions are called on rows of the stacked arrays directly
+    ffi, lib = self.ffi, self.lib
+    xs_p = ffi.cast("double *", xs.ctypes.data)
+    xk1_k_p = ffi.cast("double *", xk1_k.ctypes.data)
+    Fk_1_p = ffi.cast("double *", Fk_1.ctypes.data)
+    delta_x_p = ffi.cast("double *", delta_x.ctypes.data)
+    x_new_p = ffi.cast("double *", x_new.ctypes.data)
+    dim_x, dim_F = self.dim_x, self.dim_err**2
+
+    for k, dt in enumerate(dts.tolist()):
+      lib.F_fun(xs_p + k * dim_x, dt, Fk_1_p + k * dim_F)
+
+    # smoother gains don't depend on the smoothed estimates, solve them all at once
+    Fk_1 = Fk_1[:, :d2, :d2]
+    Cs = np.linalg.solve(Pk1_k, Fk_1 @ Pk_k.transpose(0, 2, 1)).transpose(0, 2, 1)
+    CsT = Cs.transpose(0, 2, 1)
+
+    for k in range(n - 2, -1, -1):
       if norm_quats:
-        xk1_n[3:7] /= np.linalg.norm(xk1_n[3:7])
-      Pk1_n = Pk_n
-
-      xk1_k, _, Pk1_k, _, t2, _, _, _, _ = estimates[k + 1]
-      _, xk_k, _, Pk_k, t1, _, _, _, _ = estimates[k]
-      dt = t2 - t1
-      self.F(xk_k, dt, Fk_1)
-
-      d1 = self.dim_main
-      d2 = self.dim_main_err
-      Ck = np.linalg.solve(Pk1_k[:d2, :d2], Fk_1[:d2, :d2].dot(Pk_k[:d2, :d2].T)).T
-      xk_n = xk_k
-      delta_x = np.zeros((Pk_n.shape[0], 1), dtype=np.float64)
-      self.inv_err_function(xk1_k, xk1_n, delta_x)
-      delta_x[:d2] = Ck.dot(delta_x[:d2])
-      x_new = np.zeros((xk_n.shape[0], 1), dtype=np.float64)
-      self.err_function(xk_k, delta_x, x_new)
-      xk_n[:d1] = x_new[:d1, 0]
-      Pk_n = Pk_k
-      Pk_n[:d2, :d2] = Pk_k[:d2, :d2] + Ck.dot(Pk1_n[:d2, :d2] - Pk1_k[:d2, :d2]).dot(Ck.T)
-      states_smoothed.append(xk_n)
-      covs_smoothed.append(Pk_n)
-
-    return np.flipud(np.vstack(states_smoothed)), np.stack(covs_smoothed, 0)[::-1]
+        q = xs[k + 1, 3:7]
+        q /= math.sqrt(q.dot(q))
+
+      lib.inv_err_fun(xk1_k_p + k * dim_x, xs_p + (k + 1) * dim_x, delta_x_p)
+      delta_x[:d2] = Cs[k].dot(delta_x[:d2])
+      lib.err_fun(xs_p + k * dim_x, delta_x_p, x_new_p)
+      xs[k, :d1] = x_new[:d1, 0]
+      Ps[k, :d2, :d2] = Pk_k[k] + Cs[k].dot(Ps[k + 1, :d2, :d2] - Pk1_k[k]).dot(CsT[k])
+
+    return xs, Ps
+
+  def smooth_log(self, observations, norm_quats=False, observe=None):
+    '''
+    Runs the forward filter over a whole log of observations
+    and smooths the estimates
+
+    Args:
+      observations: iterable of argument tuples for observe
+      observe: update function, predict_and_update_batch by default
+
+    Returns:
+      estimates, smoothed states [n,dim_x], smoothed covariances [n,dim_err,dim_err]
+    '''
+    if observe is None:
+      observe = self.predict_and_update_batch
+
+    estimates = []
+    for obs in observations:
+      r = observe(*obs)
+      if r is not None:
+        estimates.append(r)
+
+    xs, Ps = self.rts_smooth(estimates, norm_quats=norm_quats)
+    return estimates, xs, Ps
@@ -121,3 +121,77 @@ void update(double *in_x, double *in_P, Hfun h_fun, Hfun H_fun, Hfun Hea_fun, do
 }
 
 
+// all n observations of a batch stacked into a single update,
+// linearized around the same state. extra_args are n rows of ea_dim
+template <int ZDIM, bool MAHA_TEST>
+void update_batch(double *in_x, double *in_P, Hfun h_fun, Hfun H_fun, int n, double *in_z, double *in_R, double *in_ea, int ea_dim, double MAHA_THRESHOLD) {
+  typedef Eigen::Matrix<double, ZDIM, ZDIM, Eigen::RowMajor> ZZM;
+  typedef Eigen::Matrix<double, ZDIM, DIM, Eigen::RowMajor> ZDM;
+  typedef Eigen::Matrix<double, Eigen::Dynamic, EDIM, Eigen::RowMajor> XEM;
+  typedef Eigen::Matrix<double, Eigen::Dynamic, 1> X1M;
+  typedef Eigen::Matrix<double, Eigen::Dynamic, Eigen::Dynamic, Eigen::RowMajor> XXM;
+
+  double in_hx[ZDIM] = {0};
+  double in_H[ZDIM * DIM] = {0};
+  double in_H_mod[EDIM * DIM] = {0};
+  double delta_x[EDIM] = {0};
+  double x_new[DIM] = {0};
+
+  EEM P(in_P);
+
+  // get modified H
+  H_mod_fun(in_x, in_H_mod);
+  DEM H_mod(in_H_mod);
+
+  // stack y, H and a block diagonal R
+  X1M y(n * ZDIM);
+  XEM H_err(n * ZDIM, EDIM);
+  XXM R = XXM::Zero(n * ZDIM, n * ZDIM);
+  for (int i = 0; i < n; i++) {
+    h_fun(in_x, in_ea + i * ea_dim, in_hx);
+    H_fun(in_x, in_ea + i * ea_dim, in_H);
+    Eigen::Matrix<double, ZDIM, 1> z(in_z + i * ZDIM);
+    Eigen::Matrix<double, ZDIM, 1> hx(in_hx);
+    ZDM H(in_H);
+    ZZM R_i(in_R + i * ZDIM * ZDIM);
+
+    y.segment(i * ZDIM, ZDIM) = z - hx;
+    H_err.block(i * ZDIM, 0, ZDIM, EDIM) = H * H_mod;
+    R.block(i * ZDIM, i * ZDIM, ZDIM, ZDIM) = R_i;
+  }
+
+  XXM S = (H_err * P) * H_err.transpose();
+
+  // Do mahalobis distance test per observation
+  if (MAHA_TEST){
+    for (int i = 0; i < n; i++) {
+      ZZM R_i = R.block(i * ZDIM, i * ZDIM, ZDIM, ZDIM);
+      Eigen::Matrix<double, ZDIM, 1> y_i = y.segment(i * ZDIM, ZDIM);
+      ZZM a = (S.block(i * ZDIM, i * ZDIM, ZDIM, ZDIM) + R_i).inverse();
+      double maha_dist = y_i.dot(a * y_i);
+      if (maha_dist > MAHA_THRESHOLD){
+        R.block(i * ZDIM, i * ZDIM, ZDIM, ZDIM) = 1.0e16 * R_i;
+      }
+    }
+  }
+
+  // kalman gains and I_KH
+  S = S + R;
+  XEM KT = S.fullPivLu().solve(H_err * P.transpose());
+  EEM I_KH = Eigen::Matrix<double, EDIM, EDIM>::Identity() - (KT.transpose() * H_err);
+
+  // update state by injecting dx
+  Eigen::Matrix<double, EDIM, 1> dx(delta_x);
+  dx  = (KT.transpose() * y);
+  memcpy(delta_x, dx.data(), EDIM * sizeof(double));
+  err_fun(in_x, delta_x, x_new);
+  Eigen::Matrix<double, DIM, 1> x(x_new);
+
+  // update cov
+  P = ((I_KH * P) * I_KH.transpose()) + ((KT.transpose() * R) * KT);
+
+  // copy out state
+  memcpy(in_x, x.data(), DIM * sizeof(double));
+  memcpy(in_P, P.data(), EDIM * EDIM * sizeof(double));
+  memcpy(in_z, y.data(), y.rows() * sizeof(double));
+}
@@ -0,0 +1,60 @@
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import sympy as sp
+
+from rednose import KalmanFilter
+from rednose.helpers.ekf_sym import gen_code
+
+
+class ObservationKind():
+  POSITION = 1
+  RANGE = 2
+
+
+class KinematicKalman(KalmanFilter):
+  """Small constant velocity model in 2D for testing the generated filter code"""
+  name = 'kinematic'
+
+  initial_x = np.array([0., 0., 1., 0.])
+  initial_P_diag = np.array([1., 1., 1., 1.])
+  Q = np.diag([0.01, 0.01, 0.1, 0.1])
+
+  obs_noise = {ObservationKind.POSITION: np.diag([0.5**2, 0.5**2]),
+               ObservationKind.RANGE: np.diag([0.3**2])}
+
+  @staticmethod
+  def generate_code(generated_dir):
+    dim_state = KinematicKalman.initial_x.shape[0]
+    state_sym = sp.MatrixSymbol('state', dim_state, 1)
+    state = sp.Matrix(state_sym)
+    x, y, vx, vy = state
+
+    dt = sp.Symbol('dt')
+    state_dot = sp.Matrix([vx, vy, 0, 0])
+    f_sym = state + dt * state_dot
+
+    # range to an anchor given as extra args
+    anchor = sp.MatrixSymbol('anchor', 2, 1)
+    obs_eqs = [
+      [sp.Matrix([x, y]), ObservationKind.POSITION, None],
+      [sp.Matrix([sp.sqrt((x - anchor[0])**2 + (y - anchor[1])**2)]), ObservationKind.RANGE, anchor],
+    ]
+    # speed and its jacobian generated next to the filter
+    speed = sp.Matrix([sp.sqrt(vx**2 + vy**2)])
+    extra_routines = [('speed', speed, [state_sym]), ('H_speed', (speed, state_sym), [state_sym])]
+    gen_code(generated_dir, KinematicKalman.name, f_sym, dt, state_sym, obs_eqs, dim_state, dim_state,
+             maha_test_kinds=[ObservationKind.POSITION], extra_routines=extra_routines)
+
+
+def build(generated_dir):
+  """Generates and compiles the filter like the SConscripts do, returns False without a compiler"""
+  if shutil.which('g++') is None:
+    return False
+  KinematicKalman.generate_code(generated_dir)
+  name = KinematicKalman.name
+  subprocess.check_call(['g++', '-O2', '-shared', '-fPIC', '-o', os.path.join(generated_dir, f'lib{name}.so'),
+                         os.path.join(generated_dir, f'{name}.cpp')])
+  return True
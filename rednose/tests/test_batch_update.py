@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+import tempfile
+import unittest
+import numpy as np
+
+from rednose.helpers.chi2_lookup import chi2_ppf, chi2_table
+from rednose.tests.kinematic_kf import KinematicKalman, ObservationKind, build
+
+
+class TestBatchUpdate(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.generated_dir = tempfile.mkdtemp()
+    if not build(cls.generated_dir):
+      raise unittest.SkipTest("no compiler for the generated code")
+
+  def setUp(self):
+    self.rng = np.random.RandomState(0)
+
+  def sequential(self, kf):
+    # same filter with the batch kernels disabled
+    kf.filter._batch_updates = {}
+    return kf
+
+  def test_linear_batch_matches_sequential(self):
+    fused, seq = KinematicKalman(self.generated_dir), self.sequential(KinematicKalman(self.generated_dir))
+    for i in range(100):
+      # small noise, so no observation fails the mahalanobis test
+      z = self.rng.normal(0., 0.1, (5, 2)) + [i * 0.1, 0.]
+      R = fused.get_R(ObservationKind.POSITION, 5)
+      R[1:] *= self.rng.uniform(0.5, 2., (4, 1, 1))
+      r_fused = fused.filter.predict_and_update_batch(i * 0.1, ObservationKind.POSITION, z, R, [[]] * 5)
+      r_seq = seq.filter.predict_and_update_batch(i * 0.1, ObservationKind.POSITION, z, R, [[]] * 5)
+      np.testing.assert_allclose(fused.x, seq.x, rtol=1e-9, atol=1e-9)
+      np.testing.assert_allclose(fused.P, seq.P, rtol=1e-9, atol=1e-12)
+      # residuals are against the predicted state
+      np.testing.assert_allclose(r_fused[6][0], r_seq[6][0], rtol=1e-9)
+
+  def test_nonlinear_batch_close_to_sequential(self):
+    fused, seq = KinematicKalman(self.generated_dir), self.sequential(KinematicKalman(self.generated_dir))
+    anchors = [[10., 0.], [0., 10.], [-10., 0.], [0., -10.]]
+    for i in range(100):
+      t = i * 0.1
+      z = np.linalg.norm(np.array(anchors) - [t, 0.], axis=1)[:, None] + self.rng.normal(0., 0.3, (4, 1))
+      R = fused.get_R(ObservationKind.RANGE, 4)
+      fused.filter.predict_and_update_batch(t, ObservationKind.RANGE, z, R, anchors)
+      seq.filter.predict_and_update_batch(t, ObservationKind.RANGE, z, R, anchors)
+    np.testing.assert_allclose(fused.x, seq.x, atol=0.05)
+
+  def test_maha_gating(self):
+    kf = KinematicKalman(self.generated_dir)
+    kf.predict_and_observe(0., ObservationKind.POSITION, np.zeros((1, 2)))
+    x = kf.x.copy()
+
+    # an outlier in the batch is ignored, the other observations are used
+    z = np.array([[0., 0.1], [100., 100.], [0.1, 0.]])
+    kf.filter.predict_and_update_batch(0., ObservationKind.POSITION, z, kf.get_R(ObservationKind.POSITION, 3), [[]] * 3)
+    self.assertLess(np.max(np.abs(kf.x[:2] - x[:2])), 0.1)
+
+  def test_chi2_cached(self):
+    self.assertAlmostEqual(chi2_ppf(0.95, 2), 5.991, places=2)
+    chi2_ppf(0.95, 3)
+    # the table is loaded once
+    self.assertEqual(chi2_table.cache_info().currsize, 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import rednose.helpers
+from rednose.helpers import ekf_sym
+from rednose.tests.kinematic_kf import KinematicKalman, build
+
+
+def read(folder):
+  with open(os.path.join(folder, 'kinematic.cpp')) as f, open(os.path.join(folder, 'kinematic.h')) as g:
+    return f.read(), g.read()
+
+
+class TestGenCode(unittest.TestCase):
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+    patcher = mock.patch.object(rednose.helpers, 'CACHE_DIR', self.cache_dir)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_cached(self):
+    first, second = tempfile.mkdtemp(), tempfile.mkdtemp()
+    KinematicKalman.generate_code(first)
+    self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    with mock.patch.object(ekf_sym, 'gen_c', side_effect=AssertionError("sympy code generation ran")):
+      KinematicKalman.generate_code(second)
+    self.assertEqual(read(first), read(second))
+
+  def test_untrusted_cache(self):
+    os.chmod(self.cache_dir, 0o777)
+    KinematicKalman.generate_code(tempfile.mkdtemp())
+    self.assertEqual(os.listdir(self.cache_dir), [])
+
+    # created owner-only
+    cache_dir = os.path.join(self.cache_dir, 'new')
+    with mock.patch.object(rednose.helpers, 'CACHE_DIR', cache_dir):
+      self.assertEqual(rednose.helpers.cache_dir(), cache_dir)
+    self.assertEqual(os.stat(cache_dir).st_mode & 0o777, 0o700)
+
+  def test_parallel_matches_serial(self):
+    parallel, serial = tempfile.mkdtemp(), tempfile.mkdtemp()
+    KinematicKalman.generate_code(parallel)
+    with mock.patch.object(rednose.helpers, 'CACHE_DIR', ''):
+      with mock.patch.object(ekf_sym, 'Pool', side_effect=AssertionError("not serial")), mock.patch('os.cpu_count', return_value=1):
+        KinematicKalman.generate_code(serial)
+    self.assertEqual(read(parallel), read(serial))
+
+  def test_key_changes(self):
+    KinematicKalman.generate_code(tempfile.mkdtemp())
+    with mock.patch.object(ekf_sym.sp, '__version__', '0.0'):
+      KinematicKalman.generate_code(tempfile.mkdtemp())
+    self.assertEqual(len(os.listdir(self.cache_dir)), 4)
+
+  def test_extra_routines(self):
+    generated_dir = tempfile.mkdtemp()
+    if not build(generated_dir):
+      raise unittest.SkipTest("no compiler")
+    kf = KinematicKalman(generated_dir)
+    speed, H_speed = kf.filter.extra_routine('speed'), kf.filter.extra_routine('H_speed')
+
+    x = np.array([1., 2., 3., -4.])
+    out, H = np.zeros(1), np.zeros((1, 4))
+    speed(x, out)
+    H_speed(x, H)
+    np.testing.assert_allclose(out, [5.])
+    np.testing.assert_allclose(H, [[0., 0., 3. / 5., -4. / 5.]])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+import tracemalloc
+import unittest
+from bisect import bisect_right
+import numpy as np
+
+from rednose.helpers.ekf_sym import RewindBuffer, REWIND_TO_KEEP
+
+DIM_X, DIM_ERR = 23, 22
+
+
+class ListRewinder():
+  """The list based checkpointing RewindBuffer replaced"""
+  def __init__(self):
+    self.rewind_t, self.rewind_states, self.rewind_obscache = [], [], []
+
+  def push(self, t, x, P, obs):
+    self.rewind_t.append(t)
+    self.rewind_states.append((np.copy(x), np.copy(P)))
+    self.rewind_obscache.append(obs)
+    self.rewind_t = self.rewind_t[-REWIND_TO_KEEP:]
+    self.rewind_states = self.rewind_states[-REWIND_TO_KEEP:]
+    self.rewind_obscache = self.rewind_obscache[-REWIND_TO_KEEP:]
+
+  def rewind(self, t, x, P):
+    idx = bisect_right(self.rewind_t, t)
+    x[:] = self.rewind_states[idx - 1][0]
+    P[:] = self.rewind_states[idx - 1][1]
+    ret = self.rewind_obscache[idx:]
+    filter_time = self.rewind_t[idx - 1]
+    self.rewind_t = self.rewind_t[:idx]
+    self.rewind_states = self.rewind_states[:idx]
+    self.rewind_obscache = self.rewind_obscache[:idx]
+    return filter_time, ret
+
+
+def replay(rewinder, n, x, P, t=0.):
+  """Checkpoints n observations at 100Hz after t, every 10th one arrives 30ms late"""
+  out = []
+  for i in range(n):
+    t += 0.01
+    if i % 10 == 9:
+      filter_time, rewound = rewinder.rewind(t - 0.03, x, P)
+      out.append((filter_time, [r[0] for r in rewound]))
+      for obs in rewound:
+        rewinder.push(obs[0], x, P, obs)
+    x[0, 0] = t
+    P[0, 0] = t
+    rewinder.push(t, x, P, (t,))
+  return out
+
+
+class TestRewindBuffer(unittest.TestCase):
+  def test_matches_lists(self):
+    x, P = np.zeros((DIM_X, 1)), np.zeros((DIM_ERR, DIM_ERR))
+    x_old, P_old = np.zeros((DIM_X, 1)), np.zeros((DIM_ERR, DIM_ERR))
+    new = replay(RewindBuffer(REWIND_TO_KEEP, DIM_X, DIM_ERR), 2000, x, P)
+    old = replay(ListRewinder(), 2000, x_old, P_old)
+    self.assertEqual(new, old)
+    np.testing.assert_equal(x, x_old)
+    np.testing.assert_equal(P, P_old)
+
+  def test_wraps_around(self):
+    rewinder = RewindBuffer(8, 1, 1)
+    for i in range(20):
+      rewinder.push(float(i), np.array([[i]]), np.array([[i]]), i)
+    self.assertEqual(len(rewinder), 8)
+    self.assertEqual((rewinder.oldest_t(), rewinder.newest_t()), (12., 19.))
+
+    x, P = np.zeros((1, 1)), np.zeros((1, 1))
+    self.assertEqual(rewinder.rewind(15.5, x, P), (15., [16, 17, 18, 19]))
+    self.assertEqual((x[0, 0], P[0, 0], len(rewinder)), (15., 15., 4))
+
+  def test_no_allocation_growth(self):
+    rewinder = RewindBuffer(REWIND_TO_KEEP, DIM_X, DIM_ERR)
+    x, P = np.zeros((DIM_X, 1)), np.zeros((DIM_ERR, DIM_ERR))
+    replay(rewinder, 2 * REWIND_TO_KEEP, x, P)
+
+    tracemalloc.start()
+    replay(rewinder, 2 * REWIND_TO_KEEP, x, P, t=100.)
+    before = tracemalloc.get_traced_memory()[0]
+    replay(rewinder, 10 * REWIND_TO_KEEP, x, P, t=200.)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # only the returned replay log grows, not the checkpoints
+    self.assertLess(after - before, 10 * REWIND_TO_KEEP * 200)
+
+
+if __name__ == "__main__":
+  unittest.main()
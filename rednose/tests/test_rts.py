@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import copy
+import tempfile
+import unittest
+import numpy as np
+
+from rednose.tests.kinematic_kf import KinematicKalman, ObservationKind, build
+
+
+def rts_smooth_loop(ekf, estimates, norm_quats=False):
+  """Per step rts smoother rts_smooth replaced"""
+  xk_n = estimates[-1][0]
+  Pk_n = estimates[-1][2]
+  Fk_1 = np.zeros(Pk_n.shape, dtype=np.float64)
+
+  states_smoothed = [xk_n]
+  covs_smoothed = [Pk_n]
+  for k in range(len(estimates) - 2, -1, -1):
+    xk1_n = xk_n
+    if norm_quats:
+      xk1_n[3:7] /= np.linalg.norm(xk1_n[3:7])
+    Pk1_n = Pk_n
+
+    xk1_k, _, Pk1_k, _, t2, _, _, _, _ = estimates[k + 1]
+    _, xk_k, _, Pk_k, t1, _, _, _, _ = estimates[k]
+    dt = t2 - t1
+    ekf.F(xk_k, dt, Fk_1)
+
+    d1 = ekf.dim_main
+    d2 = ekf.dim_main_err
+    Ck = np.linalg.solve(Pk1_k[:d2, :d2], Fk_1[:d2, :d2].dot(Pk_k[:d2, :d2].T)).T
+    xk_n = xk_k
+    delta_x = np.zeros((Pk_n.shape[0], 1), dtype=np.float64)
+    ekf.inv_err_function(xk1_k, xk1_n, delta_x)
+    delta_x[:d2] = Ck.dot(delta_x[:d2])
+    x_new = np.zeros((xk_n.shape[0], 1), dtype=np.float64)
+    ekf.err_function(xk_k, delta_x, x_new)
+    xk_n[:d1] = x_new[:d1, 0]
+    Pk_n = Pk_k
+    Pk_n[:d2, :d2] = Pk_k[:d2, :d2] + Ck.dot(Pk1_n[:d2, :d2] - Pk1_k[:d2, :d2]).dot(Ck.T)
+    states_smoothed.append(xk_n)
+    covs_smoothed.append(Pk_n)
+
+  return np.flipud(np.vstack(states_smoothed)), np.stack(covs_smoothed, 0)[::-1]
+
+
+def trajectory(n, rng):
+  """Position observations at 20Hz of a target driving in a circle"""
+  observations, truth = [], []
+  for i in range(n):
+    t = i * 0.05
+    pos = np.array([10. * np.sin(0.1 * t), 10. * (1. - np.cos(0.1 * t))])
+    truth.append(pos)
+    observations.append((t, ObservationKind.POSITION, (pos + rng.normal(0., 0.5, 2))[None]))
+  return observations, np.array(truth)
+
+
+class TestRTSSmoother(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.generated_dir = tempfile.mkdtemp()
+    if not build(cls.generated_dir):
+      raise unittest.SkipTest("no compiler for the generated code")
+
+  def setUp(self):
+    self.rng = np.random.RandomState(0)
+
+  def test_matches_loop(self):
+    kf = KinematicKalman(self.generated_dir)
+    observations, _ = trajectory(500, self.rng)
+    estimates, xs, Ps = kf.smooth_log(observations)
+
+    xs_loop, Ps_loop = rts_smooth_loop(kf.filter, copy.deepcopy(estimates))
+    np.testing.assert_allclose(xs, xs_loop, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(Ps, Ps_loop, rtol=1e-9, atol=1e-12)
+
+  def test_smoothing_helps(self):
+    kf = KinematicKalman(self.generated_dir)
+    observations, truth = trajectory(500, self.rng)
+    estimates, xs, _ = kf.smooth_log(observations)
+    err_filter = np.linalg.norm(np.array([e[1][:2] for e in estimates]) - truth, axis=1)
+    err_smooth = np.linalg.norm(xs[:, :2] - truth, axis=1)
+    self.assertLess(np.mean(err_smooth[50:-50]), np.mean(err_filter[50:-50]))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,22 +1,23 @@
 #!/usr/bin/env python3
+import asyncio
 import base64
 import hashlib
 import io
 import json
 import os
-import queue
 import random
 import select
 import socket
+import sqlite3
 import threading
 import time
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from typing import Any
 
-import requests
 from jsonrpc import JSONRPCResponseManager, dispatcher
-from websocket import ABNF, WebSocketTimeoutException, create_connection
+from websocket import ABNF, WebSocketConnectionClosedException, WebSocketTimeoutException, create_connection
 
 import cereal.messaging as messaging
 from cereal.services import service_list
@@ -26,80 +27,268 @@ from common.params import Params
 from common.realtime import sec_since_boot
 from selfdrive.hardware import HARDWARE
 from selfdrive.loggerd.config import ROOT
+from selfdrive.loggerd.directory_index import MAX_PAGE_SIZE, DirectoryIndex
+from selfdrive.loggerd.upload_engine import UploadCancelled, UploadEngine
+from selfdrive.loggerd.upload_state import STATUS_PENDING, STATUS_UPLOADED, STATUS_UPLOADING, UploadState
 from selfdrive.swaglog import cloudlog
 
 ATHENA_HOST = os.getenv('ATHENA_HOST', 'wss://athena.comma.ai')
 HANDLER_THREADS = int(os.getenv('HANDLER_THREADS', "4"))
+UPLOAD_THREADS = int(os.getenv('UPLOAD_THREADS', "2"))
+PING_INTERVAL = 30.
+SUBSCRIBER_CACHE_SIZE = int(os.getenv('SUBSCRIBER_CACHE_SIZE', "8"))
+MESSAGE_MAX_AGE = 1.  # seconds, for services without a fixed rate
 LOCAL_PORT_WHITELIST = set([8022])
 
 dispatcher["echo"] = lambda s: s
-payload_queue: Any = queue.Queue()
-response_queue: Any = queue.Queue()
-upload_queue: Any = queue.Queue()
-cancelled_uploads: Any = set()
 UploadItem = namedtuple('UploadItem', ['path', 'url', 'headers', 'created_at', 'id'])
-
-
-def handle_long_poll(ws):
+upload_engine = UploadEngine()
+upload_state: Any = None
+directory_index: Any = None
+UPLOAD_STATUS_NAMES = {STATUS_PENDING: "pending", STATUS_UPLOADING: "uploading", STATUS_UPLOADED: "uploaded"}
+
+
+class UploadPool():
+  """Uploads requested over RPC, sent by a number of workers on the event loop while
+  connected. RPC methods run on the handler threads, so adding, cancelling and listing
+  are thread safe."""
+  def __init__(self, engine, workers=UPLOAD_THREADS):
+    self.engine = engine
+    self.workers = workers
+    self.lock = threading.Lock()
+    self.pending = OrderedDict()  # id -> UploadItem
+    self.current = {}  # id -> (UploadItem, cancel event)
+    self.progress = {}  # id -> (bytes sent, total bytes)
+    self.loop = None
+    self.ready = None
+
+  def put(self, item):
+    with self.lock:
+      self.pending[item.id] = item
+      self.notify()
+
+  def notify(self):
+    if self.loop is not None:
+      self.loop.call_soon_threadsafe(self.ready.set)
+
+  def cancel(self, upload_id):
+    with self.lock:
+      if self.pending.pop(upload_id, None) is not None:
+        return True
+      if upload_id in self.current:
+        self.current[upload_id][1].set()
+        return True
+    return False
+
+  def items(self):
+    with self.lock:
+      current = [(item, True) for item, _ in self.current.values()]
+      pending = [(item, False) for item in self.pending.values()]
+      progress = dict(self.progress)
+    ret = []
+    for item, is_current in current + pending:
+      sent, total = progress.get(item.id, (0, None))
+      ret.append({**item._asdict(), 'current': is_current, 'bytes_sent': sent, 'size': total})
+    return ret
+
+  def take(self):
+    with self.lock:
+      if not self.pending:
+        return None, None
+      _, item = self.pending.popitem(last=False)
+      cancel = threading.Event()
+      self.current[item.id] = (item, cancel)
+      return item, cancel
+
+  def done(self, item, requeue=False):
+    with self.lock:
+      del self.current[item.id]
+      self.progress.pop(item.id, None)
+      if requeue:
+        # connection lost, sent again first thing once back
+        self.pending[item.id] = item
+        self.pending.move_to_end(item.id, last=False)
+        self.notify()
+
+  def stopped(self, item, future):
+    """The transfer of an upload cut off by a disconnect is over, the item is kept unless
+    it finished anyway"""
+    self.done(item, requeue=future.cancelled() or isinstance(future.exception(), UploadCancelled))
+
+  def set_progress(self, upload_id, sent, total):
+    with self.lock:
+      self.progress[upload_id] = (sent, total)
+
+  async def worker(self, executor):
+    while True:
+      item, cancel = self.take()
+      if item is None:
+        self.ready.clear()
+        item, cancel = self.take()
+        if item is None:
+          await self.ready.wait()
+          continue
+
+      self.set_progress(item.id, 0, None)
+      progress = partial(self.set_progress, item.id)
+      future = executor.submit(self.engine.upload, item.path, item.url, item.headers, cancel, progress)
+      try:
+        await asyncio.wrap_future(future)
+      except asyncio.CancelledError:
+        # disconnected, stop the transfer. the item is put back once the transfer thread is
+        # done with it, so a quick reconnect can't send it twice at once
+        cancel.set()
+        future.add_done_callback(partial(self.stopped, item))
+        raise
+      except UploadCancelled:
+        pass
+      except Exception:
+        cloudlog.exception("athena.upload_handler.exception")
+      self.done(item)
+
+  async def run(self):
+    with self.lock:
+      self.loop = asyncio.get_running_loop()
+      self.ready = asyncio.Event()
+    executor = ThreadPoolExecutor(max_workers=self.workers)
+    try:
+      await asyncio.gather(*[self.worker(executor) for _ in range(self.workers)])
+    finally:
+      with self.lock:
+        self.loop = None
+      executor.shutdown(wait=False)
+
+
+upload_pool = UploadPool(upload_engine)
+
+
+class WebSocket():
+  """A websocket-client connection used from the event loop. Frames are received on a
+  thread of its own blocked on the socket, so nothing is polled while idle."""
+  def __init__(self, ws):
+    self.ws = ws
+    self.recv_executor = ThreadPoolExecutor(max_workers=1)
+    self.send_executor = ThreadPoolExecutor(max_workers=1)
+    self.pong = None
+
+  async def recv(self):
+    """The next text or binary message, control frames are handled on the way"""
+    loop = asyncio.get_running_loop()
+    while True:
+      opcode, data = await loop.run_in_executor(self.recv_executor, partial(self.ws.recv_data, control_frame=True))
+      if opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY):
+        return data
+      elif opcode == ABNF.OPCODE_PONG:
+        if self.pong is not None:
+          self.pong.set()
+      elif opcode == ABNF.OPCODE_CLOSE:
+        raise WebSocketConnectionClosedException("closed by the server")
+
+  async def send(self, data):
+    await asyncio.get_running_loop().run_in_executor(self.send_executor, self.ws.send, data)
+
+  async def ping(self, timeout):
+    self.pong = asyncio.Event()
+    await asyncio.get_running_loop().run_in_executor(self.send_executor, self.ws.ping)
+    await asyncio.wait_for(self.pong.wait(), timeout=timeout)
+
+  def close(self):
+    # wakes up the receiving thread
+    self.ws.abort()
+    self.recv_executor.shutdown()
+    self.send_executor.shutdown()
+    self.ws.shutdown()
+
+
+async def handle_long_poll(ws):
+  """Serves one websocket connection until it closes: every RPC request is run on the
+  handler threads and answered as soon as it's done, uploads run alongside"""
   end_event = threading.Event()
+  dispatcher["startLocalProxy"] = partial(startLocalProxy, end_event)
+  executor = ThreadPoolExecutor(max_workers=HANDLER_THREADS)
 
-  threads = [
-    threading.Thread(target=ws_recv, args=(ws, end_event)),
-    threading.Thread(target=ws_send, args=(ws, end_event)),
-    threading.Thread(target=upload_handler, args=(end_event,))
-  ] + [
-    threading.Thread(target=jsonrpc_handler, args=(end_event,))
-    for x in range(HANDLER_THREADS)
-  ]
-
-  for thread in threads:
-    thread.start()
+  tasks = [asyncio.ensure_future(t) for t in (ws_recv(ws, executor), ws_ping(ws), upload_pool.run())]
   try:
-    while not end_event.is_set():
-      time.sleep(0.1)
-  except (KeyboardInterrupt, SystemExit):
-    end_event.set()
-    raise
+    done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for t in done:
+      if not t.cancelled() and t.exception() is not None and not isinstance(t.exception(), WebSocketConnectionClosedException):
+        cloudlog.error("athenad.handle_long_poll.exception %r" % t.exception())
   finally:
-    for thread in threads:
-      thread.join()
-
-
-def jsonrpc_handler(end_event):
-  dispatcher["startLocalProxy"] = partial(startLocalProxy, end_event)
-  while not end_event.is_set():
-    try:
-      data = payload_queue.get(timeout=1)
-      response = JSONRPCResponseManager.handle(data, dispatcher)
-      response_queue.put_nowait(response)
-    except queue.Empty:
-      pass
-    except Exception as e:
-      cloudlog.exception("athena jsonrpc handler failed")
-      response_queue.put_nowait(json.dumps({"error": str(e)}))
-
-
-def upload_handler(end_event):
-  while not end_event.is_set():
-    try:
-      item = upload_queue.get(timeout=1)
-      if item.id in cancelled_uploads:
-        cancelled_uploads.remove(item.id)
-        continue
-      _do_upload(item)
-    except queue.Empty:
-      pass
-    except Exception:
-      cloudlog.exception("athena.upload_handler.exception")
+    end_event.set()
+    for t in tasks:
+      t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    executor.shutdown(wait=False)
 
 
-def _do_upload(upload_item):
-  with open(upload_item.path, "rb") as f:
-    size = os.fstat(f.fileno()).st_size
-    return requests.put(upload_item.url,
-                        data=f,
-                        headers={**upload_item.headers, 'Content-Length': str(size)},
-                        timeout=10)
+async def jsonrpc_handler(ws, executor, data):
+  loop = asyncio.get_running_loop()
+  try:
+    response = await loop.run_in_executor(executor, JSONRPCResponseManager.handle, data, dispatcher)
+    if response is None:
+      # notification, nothing to answer
+      return
+    response = response.json
+  except Exception as e:
+    cloudlog.exception("athena jsonrpc handler failed")
+    response = json.dumps({"error": str(e)})
+  try:
+    await ws.send(response)
+  except (WebSocketConnectionClosedException, OSError):
+    pass
+
+
+class CachedSubscriber():
+  """Conflated subscriber kept open between getMessage calls, with the latest message
+  and its dict"""
+  def __init__(self, service):
+    self.sock = messaging.sub_sock(service, conflate=True)
+    self.lock = threading.Lock()
+    self.msg = None
+    self.dict = None
+
+    # a message is fresh until two periods of the service went by
+    frequency = service_list[service].frequency
+    self.max_age = 2. / frequency if frequency > 0 else MESSAGE_MAX_AGE
+
+  def fresh(self):
+    return self.msg is not None and sec_since_boot() - self.msg.logMonoTime / 1e9 < self.max_age
+
+  def get(self, timeout):
+    with self.lock:
+      msg = messaging.recv_one_or_none(self.sock)
+      if msg is None and not self.fresh():
+        self.sock.setTimeout(timeout)
+        msg = messaging.recv_one(self.sock)
+        if msg is None:
+          raise TimeoutError
+      if msg is not None:
+        self.msg, self.dict = msg, None
+
+      if self.dict is None:
+        self.dict = self.msg.to_dict()
+      return self.dict
+
+
+class SubscriberCache():
+  """The subscribers of the services asked for most recently"""
+  def __init__(self, size=SUBSCRIBER_CACHE_SIZE):
+    self.size = size
+    self.lock = threading.Lock()
+    self.subscribers = OrderedDict()
+
+  def get(self, service):
+    with self.lock:
+      sub = self.subscribers.get(service)
+      if sub is None:
+        sub = self.subscribers[service] = CachedSubscriber(service)
+        while len(self.subscribers) > self.size:
+          self.subscribers.popitem(last=False)
+      self.subscribers.move_to_end(service)
+      return sub
+
+
+subscriber_cache = SubscriberCache()
 
 
 # security: user should be able to request any message from their car
@@ -108,19 +297,47 @@ def getMessage(service=None, timeout=1000):
   if service is None or service not in service_list:
     raise Exception("invalid service")
 
-  socket = messaging.sub_sock(service, timeout=timeout)
-  ret = messaging.recv_one(socket)
+  return subscriber_cache.get(service).get(timeout)
+
+
+def get_directory_index():
+  global directory_index
+  if directory_index is None:
+    directory_index = DirectoryIndex(ROOT)
+  return directory_index
 
-  if ret is None:
-    raise TimeoutError
 
-  return ret.to_dict()
+def get_upload_statuses(keys):
+  global upload_state
+  try:
+    if upload_state is None:
+      upload_state = UploadState()
+    return upload_state.statuses(keys)
+  except sqlite3.Error:
+    cloudlog.exception("athena.listDataDirectory.state_failed")
+    return None
 
 
 @dispatcher.add_method
-def listDataDirectory():
-  files = [os.path.relpath(os.path.join(dp, f), ROOT) for dp, dn, fn in os.walk(ROOT) for f in fn]
-  return files
+def listDataDirectory(prefix=''):
+  return [key for key, _ in get_directory_index().list(prefix)]
+
+
+@dispatcher.add_method
+def listDataDirectoryPage(prefix='', cursor=None, limit=MAX_PAGE_SIZE):
+  """A page of the files under ROOT whose path starts with prefix, with sizes and upload
+  status. cursor is the one returned with the previous page, None on the last page"""
+  limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+  files = get_directory_index().list(prefix, after=cursor, limit=limit + 1)
+  more = len(files) > limit
+  files = files[:limit]
+
+  statuses = get_upload_statuses([key for key, _ in files])
+  page = []
+  for key, size in files:
+    status = None if statuses is None else UPLOAD_STATUS_NAMES[statuses.get(key, STATUS_PENDING)]
+    page.append({"fn": key, "size": size, "upload_status": status})
+  return {"files": page, "cursor": files[-1][0] if more else None}
 
 
 @dispatcher.add_method
@@ -151,23 +368,20 @@ def uploadFileToUrl(fn, url, headers):
   upload_id = hashlib.sha1(str(item).encode()).hexdigest()
   item = item._replace(id=upload_id)
 
-  upload_queue.put_nowait(item)
+  upload_pool.put(item)
 
   return {"enqueued": 1, "item": item._asdict()}
 
 
 @dispatcher.add_method
 def listUploadQueue():
-  return [item._asdict() for item in list(upload_queue.queue)]
+  return upload_pool.items()
 
 
 @dispatcher.add_method
 def cancelUpload(upload_id):
-  upload_ids = set(item.id for item in list(upload_queue.queue))
-  if upload_id not in upload_ids:
+  if not upload_pool.cancel(upload_id):
     return 404
-
-  cancelled_uploads.add(upload_id)
   return {"success": 1}
 
 
@@ -281,64 +495,65 @@ def ws_proxy_send(ws, local_sock, signal_sock, end_event):
       end_event.set()
 
 
-def ws_recv(ws, end_event):
-  while not end_event.is_set():
-    try:
-      opcode, data = ws.recv_data(control_frame=True)
-      if opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY):
-        if opcode == ABNF.OPCODE_TEXT:
-          data = data.decode("utf-8")
-        payload_queue.put_nowait(data)
-      elif opcode == ABNF.OPCODE_PING:
-        Params().put("LastAthenaPingTime", str(int(sec_since_boot() * 1e9)))
-    except WebSocketTimeoutException:
-      pass
-    except Exception:
-      cloudlog.exception("athenad.ws_recv.exception")
-      end_event.set()
+async def ws_recv(ws, executor):
+  tasks = set()
+  try:
+    while True:
+      data = await ws.recv()
+      t = asyncio.ensure_future(jsonrpc_handler(ws, executor, data))
+      tasks.add(t)
+      t.add_done_callback(tasks.discard)
+  finally:
+    for t in tasks:
+      t.cancel()
 
 
-def ws_send(ws, end_event):
-  while not end_event.is_set():
-    try:
-      response = response_queue.get(timeout=1)
-      ws.send(response.json)
-    except queue.Empty:
-      pass
-    except Exception:
-      cloudlog.exception("athenad.ws_send.exception")
-      end_event.set()
+async def ws_ping(ws):
+  while True:
+    await ws.ping(timeout=PING_INTERVAL)
+    Params().put("LastAthenaPingTime", str(int(sec_since_boot() * 1e9)))
+    await asyncio.sleep(PING_INTERVAL)
 
 
 def backoff(retries):
   return random.randrange(0, min(128, int(2 ** retries)))
 
 
-def main():
+async def main_async():
   params = Params()
   dongle_id = params.get("DongleId").decode('utf-8')
   ws_uri = ATHENA_HOST + "/ws/v2/" + dongle_id
 
   api = Api(dongle_id)
 
+  loop = asyncio.get_running_loop()
   conn_retries = 0
   while 1:
     try:
-      ws = create_connection(ws_uri,
-                             cookie="jwt=" + api.get_token(),
-                             enable_multithread=True)
+      ws = await loop.run_in_executor(None, partial(create_connection, ws_uri, cookie="jwt=" + api.get_token(),
+                                                    enable_multithread=True))
       cloudlog.event("athenad.main.connected_ws", ws_uri=ws_uri)
-      ws.settimeout(1)
       conn_retries = 0
-      handle_long_poll(ws)
-    except (KeyboardInterrupt, SystemExit):
+      ws = WebSocket(ws)
+      try:
+        await handle_long_poll(ws)
+      finally:
+        ws.close()
+    except (KeyboardInterrupt, SystemExit, asyncio.CancelledError):
       break
     except Exception:
       cloudlog.exception("athenad.main.exception")
       conn_retries += 1
       params.delete("LastAthenaPingTime")
 
-    time.sleep(backoff(conn_retries))
+    await asyncio.sleep(backoff(conn_retries))
+
+
+def main():
+  try:
+    asyncio.run(main_async())
+  except KeyboardInterrupt:
+    pass
 
 
 if __name__ == "__main__":
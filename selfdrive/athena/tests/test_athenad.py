@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import websocket
+
+import cereal.messaging as messaging
+from selfdrive.athena import athenad
+from selfdrive.loggerd.upload_engine import UploadCancelled, UploadEngine
+from selfdrive.loggerd.upload_state import UploadState
+
+
+class UploadHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, *args):
+    pass
+
+  def do_PUT(self):
+    with self.server.lock:
+      self.server.in_flight += 1
+      self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+    body = self.rfile.read(int(self.headers['Content-Length']))
+    time.sleep(self.server.delay)
+    with self.server.lock:
+      self.server.in_flight -= 1
+      self.server.uploads[self.path] = body
+    self.send_response(201)
+    self.send_header('Content-Length', '0')
+    self.end_headers()
+
+
+class TestAthenad(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.http = ThreadingHTTPServer(('127.0.0.1', 0), UploadHandler)
+    cls.http.daemon_threads = True
+    cls.http.lock = threading.Lock()
+    threading.Thread(target=cls.http.serve_forever, daemon=True).start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.http.shutdown()
+    cls.http.server_close()
+
+  def setUp(self):
+    self.http.uploads, self.http.in_flight, self.http.max_in_flight, self.http.delay = {}, 0, 0, 0
+
+    self.root = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.root)
+    db = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, db)
+    for p in (mock.patch.object(athenad, 'ROOT', self.root),
+              mock.patch.object(athenad, 'upload_pool', athenad.UploadPool(UploadEngine(state_dir=None), workers=2)),
+              mock.patch.object(athenad, 'directory_index', None),
+              mock.patch.object(athenad, 'upload_state', UploadState(os.path.join(db, 'upload_state.db'), self.root)),
+              mock.patch.object(athenad, 'Params')):
+      p.start()
+      self.addCleanup(p.stop)
+
+  def make_file(self, name, size):
+    with open(os.path.join(self.root, name), 'wb') as f:
+      f.write(os.urandom(size))
+
+  def run_athena(self, scenario):
+    """Runs handle_long_poll on one end of a connection, scenario drives the other end
+    from a thread"""
+    client, server = ws_pair()
+    result = {}
+
+    def serve():
+      try:
+        result['ret'] = scenario(RPC(server))
+      except Exception as e:
+        result['exception'] = e
+      finally:
+        server.close(timeout=1)
+    t = threading.Thread(target=serve)
+    t.start()
+
+    ws = athenad.WebSocket(client)
+    try:
+      asyncio.run(asyncio.wait_for(athenad.handle_long_poll(ws), timeout=30))
+    finally:
+      ws.close()
+      t.join()
+    if 'exception' in result:
+      raise result['exception']
+    return result.get('ret')
+
+  def test_rpc(self):
+    def slow(t):
+      time.sleep(t)
+      return t
+    athenad.dispatcher["slow"] = slow
+    self.addCleanup(athenad.dispatcher.method_map.pop, "slow")
+
+    def scenario(rpc):
+      self.assertEqual(rpc.call("echo", s="hi"), "hi")
+
+      # answered as they finish, not in order
+      t = time.monotonic()
+      slow_id = rpc.send("slow", t=0.5)
+      fast_id = rpc.send("slow", t=0.1)
+      first = rpc.recv()
+      second = rpc.recv()
+      self.assertEqual([first['id'], second['id']], [fast_id, slow_id])
+      self.assertLess(time.monotonic() - t, 0.9)
+
+      # unknown methods get an error, the connection stays up
+      self.assertIn('error', rpc.call_raw("nope"))
+      self.assertEqual(rpc.call("echo", s="still here"), "still here")
+    self.run_athena(scenario)
+
+  def test_uploads(self):
+    self.http.delay = 0.5
+    for i in range(3):
+      self.make_file(f"f{i}", 1000)
+    url = f"http://127.0.0.1:{self.http.server_address[1]}/"
+
+    def scenario(rpc):
+      ids = []
+      for i in range(3):
+        resp = rpc.call("uploadFileToUrl", fn=f"f{i}", url=url + f"f{i}", headers={})
+        ids.append(resp['item']['id'])
+      self.assertEqual(rpc.call("uploadFileToUrl", fn="missing", url=url, headers={}), 404)
+
+      time.sleep(0.2)
+      queue = rpc.call("listUploadQueue")
+      self.assertEqual(sorted(item['id'] for item in queue), sorted(ids))
+      self.assertEqual(sum(item['current'] for item in queue), 2)
+
+      # the one waiting is cancelled
+      waiting = [item['id'] for item in queue if not item['current']]
+      self.assertEqual(rpc.call("cancelUpload", upload_id=waiting[0]), {"success": 1})
+      while rpc.call("listUploadQueue"):
+        time.sleep(0.1)
+      self.assertEqual(rpc.call("cancelUpload", upload_id=waiting[0]), 404)
+    self.run_athena(scenario)
+
+    self.assertEqual(len(self.http.uploads), 2)
+    self.assertEqual(self.http.max_in_flight, 2)
+
+  def test_progress(self):
+    size = 2 * 1024 * 1024
+    self.make_file("fcamera.hevc", size)
+    athenad.upload_pool.engine = UploadEngine(state_dir=None, max_rate=size // 2)
+    url = f"http://127.0.0.1:{self.http.server_address[1]}/fcamera.hevc"
+
+    def scenario(rpc):
+      rpc.call("uploadFileToUrl", fn="fcamera.hevc", url=url, headers={})
+      progress = []
+      while True:
+        queue = rpc.call("listUploadQueue")
+        if not queue:
+          break
+        progress.append(queue[0]['bytes_sent'])
+        time.sleep(0.2)
+      return progress
+
+    progress = self.run_athena(scenario)
+    self.assertEqual(progress, sorted(progress))
+    self.assertTrue(any(0 < p < size for p in progress))
+    self.assertEqual(len(self.http.uploads['/fcamera.hevc']), size)
+
+  def test_list_data_directory(self):
+    for i in range(5):
+      os.mkdir(os.path.join(self.root, f"2020-01-01--10-00-00--{i}"))
+      for name in ("qlog.bz2", "rlog.bz2"):
+        self.make_file(f"2020-01-01--10-00-00--{i}/{name}", 10 + i)
+    athenad.upload_state.set_uploaded("2020-01-01--10-00-00--1/qlog.bz2", 11)
+    athenad.upload_state.start_upload("2020-01-01--10-00-00--1/rlog.bz2", 11)
+    athenad.directory_index = None
+
+    files, cursor = [], None
+    while True:
+      page = athenad.listDataDirectoryPage("2020-01-01--10-00-00--", cursor, limit=3)
+      files += page['files']
+      cursor = page['cursor']
+      if cursor is None:
+        break
+    self.assertEqual(len(files), 10)
+    self.assertEqual([f['fn'] for f in files], athenad.listDataDirectory("2020-01-01--10-00-00--"))
+    self.assertEqual(files[2], {"fn": "2020-01-01--10-00-00--1/qlog.bz2", "size": 11, "upload_status": "uploaded"})
+    self.assertEqual(files[3]['upload_status'], "uploading")
+    self.assertEqual(files[4]['upload_status'], "pending")
+
+    # the legacy call still lists everything
+    self.make_file("boot", 1)
+    self.assertEqual(len(athenad.listDataDirectory()), 10 + 1)
+    self.assertEqual(athenad.listDataDirectoryPage("2020-01-01--10-00-00--4/q")['files'][0]['size'], 14)
+
+  def test_idle(self):
+    def scenario(rpc):
+      t = time.process_time()
+      time.sleep(2)
+      return time.process_time() - t
+    # nothing is polled while nothing happens
+    self.assertLess(self.run_athena(scenario), 0.1)
+
+
+class SlowCancelEngine():
+  """Notices a cancel only once released"""
+  def __init__(self):
+    self.started = threading.Event()
+    self.release = threading.Event()
+    self.calls = 0
+
+  def upload(self, path, url, headers, cancel, progress):
+    self.calls += 1
+    self.started.set()
+    self.release.wait()
+    if cancel.is_set():
+      raise UploadCancelled
+
+
+class TestUploadPool(unittest.TestCase):
+  def test_requeue_after_transfer(self):
+    engine = SlowCancelEngine()
+    self.addCleanup(engine.release.set)
+    pool = athenad.UploadPool(engine, workers=1)
+    item = athenad.UploadItem(path="f", url="u", headers={}, created_at=0, id="a")
+    pool.put(item)
+
+    async def disconnect():
+      task = asyncio.ensure_future(pool.run())
+      await asyncio.get_running_loop().run_in_executor(None, engine.started.wait)
+      task.cancel()
+      await asyncio.gather(task, return_exceptions=True)
+    asyncio.run(disconnect())
+
+    # the transfer is still going, it isn't up for taking again yet
+    self.assertEqual([i['id'] for i in pool.items()], ["a"])
+    self.assertEqual(pool.take(), (None, None))
+    engine.release.set()
+    for _ in range(100):
+      if pool.pending:
+        break
+      time.sleep(0.01)
+    self.assertEqual(list(pool.pending), ["a"])
+    self.assertEqual(pool.current, {})
+    self.assertEqual(engine.calls, 1)
+
+
+class TestGetMessage(unittest.TestCase):
+  def setUp(self):
+    p = mock.patch.object(athenad, 'subscriber_cache', athenad.SubscriberCache(size=2))
+    p.start()
+    self.addCleanup(p.stop)
+    self.socks = {}
+
+  def publish(self, service, until):
+    # sent until stopped, the subscriber may connect late
+    if service not in self.socks:
+      self.socks[service] = messaging.pub_sock(service)
+    def send():
+      while not until.is_set():
+        msg = messaging.new_message(service)
+        self.socks[service].send(msg.to_bytes())
+        time.sleep(0.01)
+    t = threading.Thread(target=send)
+    t.start()
+    return t
+
+  def get_published(self, service):
+    done = threading.Event()
+    t = self.publish(service, done)
+    try:
+      return athenad.getMessage(service, timeout=1000)
+    finally:
+      done.set()
+      t.join()
+
+  def test_cached(self):
+    # thermal is a 2 Hz service, a message is fresh for a second
+    first = self.get_published('thermal')
+    self.assertIn('thermal', first)
+
+    t = time.monotonic()
+    self.assertIs(athenad.getMessage('thermal', timeout=1000), first)
+    self.assertLess(time.monotonic() - t, 0.1)
+
+    time.sleep(1.1)
+    with self.assertRaises(TimeoutError):
+      athenad.getMessage('thermal', timeout=100)
+    second = self.get_published('thermal')
+    self.assertIsNot(second, first)
+    self.assertGreater(second['logMonoTime'], first['logMonoTime'])
+
+  def test_lru(self):
+    for service in ('thermal', 'carState', 'liveLocationKalman'):
+      self.get_published(service)
+    self.get_published('thermal')
+    self.assertEqual(list(athenad.subscriber_cache.subscribers), ['liveLocationKalman', 'thermal'])
+
+  def test_invalid(self):
+    with self.assertRaises(Exception):
+      athenad.getMessage('notaservice')
+    self.assertEqual(len(athenad.subscriber_cache.subscribers), 0)
+
+
+def ws_pair():
+  """Two connected websocket-client ends, without the HTTP handshake"""
+  ends = []
+  for sock in socket.socketpair():
+    ws = websocket.WebSocket(enable_multithread=True)
+    ws.sock, ws.connected = sock, True
+    ends.append(ws)
+  return ends
+
+
+class RPC():
+  def __init__(self, ws):
+    self.ws = ws
+    self.id = 0
+
+  def send(self, method, **params):
+    self.id += 1
+    self.ws.send(json.dumps({"jsonrpc": "2.0", "method": method, "params": params, "id": self.id}))
+    return self.id
+
+  def recv(self):
+    return json.loads(self.ws.recv())
+
+  def call_raw(self, method, **params):
+    self.send(method, **params)
+    return self.recv()
+
+  def call(self, method, **params):
+    resp = self.call_raw(method, **params)
+    if 'error' in resp:
+      raise Exception(resp['error'])
+    return resp['result']
+
+
+if __name__ == "__main__":
+  unittest.main()
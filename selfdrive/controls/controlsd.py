@@ -3,7 +3,7 @@ import os
 from cereal import car, log
 from common.numpy_fast import clip
 from common.realtime import sec_since_boot, config_realtime_process, Priority, Ratekeeper, DT_CTRL
-from common.profiler import Profiler
+from common.profiler import StageTimer
 from common.params import Params, put_nonblocking
 import cereal.messaging as messaging
 from selfdrive.car.hyundai.scc_smoother import CruiseState, SccSmoother
@@ -22,13 +22,18 @@ from selfdrive.controls.lib.vehicle_model import VehicleModel
 from selfdrive.controls.lib.planner import LON_MPC_STEP
 from selfdrive.locationd.calibrationd import Calibration
 from selfdrive.hardware import HARDWARE
-from selfdrive.ntune import ntune_get
+from selfdrive.ntune import ntune_common
 
 LDW_MIN_SPEED = 31 * CV.MPH_TO_MS
 LANE_DEPARTURE_THRESHOLD = 0.1
 STEER_ANGLE_SATURATION_TIMEOUT = 1.0 / DT_CTRL
 STEER_ANGLE_SATURATION_THRESHOLD = 2.5  # Degrees
 
+# stages of a controlsd step, in execution order, timed on every step
+TIMING_STAGES = ['canRecv', 'carInterface', 'sample', 'updateEvents', 'stateTransition', 'stateControl',
+                 'longControl', 'latControl', 'alerts', 'carController', 'publish']
+TIMING_WINDOW = int(1. / DT_CTRL)  # publish percentiles over the last second, once per second
+
 SIMULATION = "SIMULATION" in os.environ
 NOSENSOR = "NOSENSOR" in os.environ
 
@@ -50,7 +55,7 @@ class Controls:
     self.pm = pm
     if self.pm is None:
       self.pm = messaging.PubMaster(['sendcan', 'controlsState', 'carState',
-                                     'carControl', 'carEvents', 'carParams'])
+                                     'carControl', 'carEvents', 'carParams', 'controlsTiming'])
 
     self.sm = sm
     if self.sm is None:
@@ -150,7 +155,8 @@ class Controls:
 
     # controlsd is driven by can recv, expected at 100Hz
     self.rk = Ratekeeper(100, print_delay_threshold=None)
-    self.prof = Profiler(False)  # off by default
+    # waiting for CAN isn't part of the loop's budget
+    self.timer = StageTimer(TIMING_STAGES, TIMING_WINDOW, ignore=['canRecv'])
 
   def update_events(self, CS):
     """Compute carEvents from carState"""
@@ -258,7 +264,9 @@ class Controls:
 
     # Update carState from CAN
     can_strs = messaging.drain_sock_raw(self.can_sock, wait_for_one=True)
+    self.timer.checkpoint('canRecv')
     CS = self.CI.update(self.CC, can_strs)
+    self.timer.checkpoint('carInterface')
 
     self.sm.update(0)
 
@@ -281,6 +289,7 @@ class Controls:
 
     self.distance_traveled += CS.vEgo * DT_CTRL
 
+    self.timer.checkpoint('sample')
     return CS
 
   def state_transition(self, CS):
@@ -394,10 +403,13 @@ class Controls:
     #actuators.gas, actuators.brake = self.LoC.update(self.active, CS, v_acc_sol, plan.vTargetFuture, a_acc_sol, self.CP)
 
     # scc smoother
+    self.timer.checkpoint('stateControl')
     actuators.gas, actuators.brake = self.LoC.update(self.active and CS.cruiseState.speed > 1., CS, v_acc_sol, plan.vTargetFuture, a_acc_sol, self.CP)
+    self.timer.checkpoint('longControl')
 
     # Steering PID loop and lateral MPC
     actuators.steer, actuators.steerAngle, lac_log = self.LaC.update(self.active, CS, self.CP, path_plan)
+    self.timer.checkpoint('latControl')
 
     # Check for difference between desired angle and angle for angle based control
     angle_control_saturated = self.CP.steerControlType == car.CarParams.SteerControlType.angle and \
@@ -418,6 +430,7 @@ class Controls:
       #if left_deviation or right_deviation:
       #  self.events.add(EventName.steerSaturated)
 
+    self.timer.checkpoint('stateControl')
     return actuators, v_acc_sol, a_acc_sol, lac_log
 
   def publish_logs(self, CS, start_time, actuators, v_acc, a_acc, lac_log):
@@ -459,7 +472,7 @@ class Controls:
       l_lane_change_prob = meta.desirePrediction[Desire.laneChangeLeft - 1]
       r_lane_change_prob = meta.desirePrediction[Desire.laneChangeRight - 1]
 
-      cameraOffset = ntune_get("cameraOffset")
+      cameraOffset = ntune_common().cameraOffset
 
       l_lane_close = left_lane_visible and (self.sm['pathPlan'].lPoly[3] < (1.08 - cameraOffset))
       r_lane_close = right_lane_visible and (self.sm['pathPlan'].rPoly[3] > -(1.08 + cameraOffset))
@@ -475,11 +488,13 @@ class Controls:
     self.AM.add_many(self.sm.frame, alerts, self.enabled)
     self.AM.process_alerts(self.sm.frame, clear_event)
     CC.hudControl.visualAlert = self.AM.visual_alert
+    self.timer.checkpoint('alerts')
 
     if not self.read_only:
       # send car controls over can
       can_sends = self.CI.apply(CC, self)
       self.pm.send('sendcan', can_list_to_can_capnp(can_sends, msgtype='sendcan', valid=CS.canValid))
+      self.timer.checkpoint('carController')
 
     force_decel = (self.sm['dMonitoringState'].awarenessStatus < 0.) or \
                     (self.state == State.softDisabling)
@@ -568,35 +583,52 @@ class Controls:
     # copy CarControl to pass to CarInterface on the next iteration
     self.CC = CC
 
+  def publish_timing(self):
+    """Send stage timing percentiles over the last TIMING_WINDOW steps"""
+
+    summary = self.timer.summary()
+    dat = messaging.new_message('controlsTiming')
+    dat.controlsTiming.window = min(self.timer.count, TIMING_WINDOW)
+    dat.controlsTiming.overruns = self.timer.overruns(DT_CTRL)
+    stages = dat.controlsTiming.init('stages', len(summary))
+    for stage, (name, p50, p90, p99, mx) in zip(stages, summary):
+      stage.name = name
+      stage.p50 = float(p50 * 1000.)
+      stage.p90 = float(p90 * 1000.)
+      stage.p99 = float(p99 * 1000.)
+      stage.max = float(mx * 1000.)
+    self.pm.send('controlsTiming', dat)
+
   def step(self):
     start_time = sec_since_boot()
-    self.prof.checkpoint("Ratekeeper", ignore=True)
+    self.timer.start()
 
     # Sample data from sockets and get a carState
     CS = self.data_sample()
-    self.prof.checkpoint("Sample")
 
     self.update_events(CS)
+    self.timer.checkpoint('updateEvents')
 
     if not self.read_only:
       # Update control state
       self.state_transition(CS)
-      self.prof.checkpoint("State transition")
+      self.timer.checkpoint('stateTransition')
 
     # Compute actuators (runs PID loops and lateral MPC)
     actuators, v_acc, a_acc, lac_log = self.state_control(CS)
 
-    self.prof.checkpoint("State Control")
-
     # Publish data
     self.publish_logs(CS, start_time, actuators, v_acc, a_acc, lac_log)
-    self.prof.checkpoint("Sent")
+    self.timer.checkpoint('publish')
+    self.timer.finish()
+
+    if self.timer.count % TIMING_WINDOW == 0:
+      self.publish_timing()
 
   def controlsd_thread(self):
     while True:
       self.step()
       self.rk.monitor_time()
-      self.prof.display()
 
 def main(sm=None, pm=None, logcan=None):
   controls = Controls(sm, pm, logcan)
@@ -1,7 +1,8 @@
 import os
 import copy
 import json
-from typing import List, Optional
+import heapq
+from typing import Dict, List, Optional, Tuple
 
 from cereal import car, log
 from common.basedir import BASEDIR
@@ -26,10 +27,30 @@ def set_offroad_alert(alert: str, show_alert: bool, extra_text: Optional[str] =
     Params().delete(alert)
 
 
+class ActiveAlert:
+  """An alert in the active store. Refreshing an alert that is already active only
+  moves its start and end time, the entry in the priority heap stays where it is."""
+  __slots__ = ('alert_type', 'alert', 'start_time', 'end_time', 'seq')
+
+  def __init__(self, alert: Alert, start_time: float, seq: int):
+    self.alert_type = alert.alert_type
+    self.seq = seq
+    self.refresh(alert, start_time)
+
+  def refresh(self, alert: Alert, start_time: float) -> None:
+    self.alert = alert
+    self.start_time = start_time
+    self.end_time = start_time + max(alert.duration_sound, alert.duration_hud_alert, alert.duration_text)
+
+
 class AlertManager:
 
   def __init__(self):
-    self.activealerts: List[Alert] = []
+    # active alerts keyed by alert_type, and a max-heap on (priority, activation time) over them
+    self.active_alerts: Dict[str, ActiveAlert] = {}
+    self.alert_heap: List[Tuple[int, float, int, ActiveAlert]] = []
+    self.alert_seq = 0
+    self.current_alert: Optional[ActiveAlert] = None
     self.clear_current_alert()
 
   def clear_current_alert(self) -> None:
@@ -42,44 +63,72 @@ class AlertManager:
     self.audible_alert = car.CarControl.HUDControl.AudibleAlert.none
     self.alert_rate: float = 0.
 
+  def _is_valid(self, active: ActiveAlert) -> bool:
+    return self.active_alerts.get(active.alert_type) is active
+
   def add_many(self, frame: int, alerts: List[Alert], enabled: bool = True) -> None:
+    cur_time = frame * DT_CTRL
+
     for alert in alerts:
-      added_alert = copy.copy(alert)
-      added_alert.start_time = frame * DT_CTRL
+      active = self.active_alerts.get(alert.alert_type)
+
+      # still active, just extend its deadline
+      if active is not None and active.end_time > cur_time:
+        active.refresh(alert, cur_time)
+        continue
 
       # if new alert is higher priority, log it
-      if not len(self.activealerts) or added_alert.alert_priority > self.activealerts[0].alert_priority:
-        cloudlog.event('alert_add', alert_type=added_alert.alert_type, enabled=enabled)
+      if self.current_alert is None or alert.alert_priority > self.current_alert.alert.alert_priority:
+        cloudlog.event('alert_add', alert_type=alert.alert_type, enabled=enabled)
 
-      self.activealerts.append(added_alert)
+      self.alert_seq += 1
+      active = ActiveAlert(alert, cur_time, self.alert_seq)
+      self.active_alerts[alert.alert_type] = active
+      heapq.heappush(self.alert_heap, (-alert.alert_priority, -cur_time, active.seq, active))
 
   def process_alerts(self, frame: int, clear_event_type=None) -> None:
     cur_time = frame * DT_CTRL
 
-    # first get rid of all the expired alerts
-    self.activealerts = [a for a in self.activealerts if a.event_type != clear_event_type and
-                         a.start_time + max(a.duration_sound, a.duration_hud_alert, a.duration_text) > cur_time]
-
-    # sort by priority first and then by start_time
-    self.activealerts.sort(key=lambda k: (k.alert_priority, k.start_time), reverse=True)
+    if clear_event_type is not None:
+      for alert_type in [k for k, a in self.active_alerts.items() if a.alert.event_type == clear_event_type]:
+        del self.active_alerts[alert_type]
+
+    # drop expired, cleared and replaced alerts from the top of the heap
+    while len(self.alert_heap):
+      active = self.alert_heap[0][-1]
+      if not self._is_valid(active):
+        heapq.heappop(self.alert_heap)
+      elif active.end_time <= cur_time:
+        heapq.heappop(self.alert_heap)
+        del self.active_alerts[active.alert_type]
+      else:
+        break
+
+    # expired and replaced alerts below the top are only popped once they surface, keep the heap compact
+    if len(self.alert_heap) > 2 * len(self.active_alerts) + 16:
+      self.alert_heap = [e for e in self.alert_heap if self._is_valid(e[-1])]
+      heapq.heapify(self.alert_heap)
+
+    current_alert = self.alert_heap[0][-1] if len(self.alert_heap) else None
+    self.current_alert = current_alert
 
     # start with assuming no alerts
     self.clear_current_alert()
 
-    if len(self.activealerts):
-      current_alert = self.activealerts[0]
+    if current_alert is not None:
+      alert, start_time = current_alert.alert, current_alert.start_time
 
-      self.alert_type = current_alert.alert_type
+      self.alert_type = alert.alert_type
 
-      if current_alert.start_time + current_alert.duration_sound > cur_time:
-        self.audible_alert = current_alert.audible_alert
+      if start_time + alert.duration_sound > cur_time:
+        self.audible_alert = alert.audible_alert
 
-      if current_alert.start_time + current_alert.duration_hud_alert > cur_time:
-        self.visual_alert = current_alert.visual_alert
+      if start_time + alert.duration_hud_alert > cur_time:
+        self.visual_alert = alert.visual_alert
 
-      if current_alert.start_time + current_alert.duration_text > cur_time:
-        self.alert_text_1 = current_alert.alert_text_1
-        self.alert_text_2 = current_alert.alert_text_2
-        self.alert_status = current_alert.alert_status
-        self.alert_size = current_alert.alert_size
-        self.alert_rate = current_alert.alert_rate
+      if start_time + alert.duration_text > cur_time:
+        self.alert_text_1 = alert.alert_text_1
+        self.alert_text_2 = alert.alert_text_2
+        self.alert_status = alert.alert_status
+        self.alert_size = alert.alert_size
+        self.alert_rate = alert.alert_rate
@@ -1,10 +1,13 @@
 from common.numpy_fast import interp
 import numpy as np
 from cereal import log
-from selfdrive.ntune import ntune_get
+from selfdrive.ntune import ntune_common
 
 CAMERA_OFFSET = 0.06  # m from center car to camera
 
+# lane width is checked at these times ahead
+T_CHECK = np.array([0.0, 1.5, 3.0])
+
 
 def compute_path_pinv(length=50):
   deg = 3
@@ -14,20 +17,28 @@ def compute_path_pinv(length=50):
   return pinv
 
 
-def model_polyfit(points, path_pinv):
-  return np.dot(path_pinv, [float(x) for x in points])
+def model_polyfit_batch(points, path_pinv):
+  """Fit every row of points (n, 50) with a single matrix multiply, returns (n, 4)"""
+  return np.dot(points, path_pinv.T)
 
 
 def eval_poly(poly, x):
   return poly[3] + poly[2]*x + poly[1]*x**2 + poly[0]*x**3
 
 
+def width_prob_mod(width_poly, v_ego):
+  x = T_CHECK * (v_ego + 7)
+  width_at_t = width_poly[3] + width_poly[2]*x + width_poly[1]*x**2 + width_poly[0]*x**3
+  # the mod is decreasing in width, so the widest point gives the minimum
+  return interp(float(np.max(width_at_t)), [4.0, 5.0], [1.0, 0.0])
+
+
 class LanePlanner:
   def __init__(self):
-    self.l_poly = [0., 0., 0., 0.]
-    self.r_poly = [0., 0., 0., 0.]
-    self.p_poly = [0., 0., 0., 0.]
-    self.d_poly = [0., 0., 0., 0.]
+    self.l_poly = np.zeros(4)
+    self.r_poly = np.zeros(4)
+    self.p_poly = np.zeros(4)
+    self.d_poly = np.zeros(4)
 
     self.lane_width_estimate = 3.7
     self.lane_width_certainty = 1.0
@@ -53,9 +64,9 @@ class LanePlanner:
       self.r_std = float(md.rightLane.std)
       self.p_poly = np.array(md.path.poly)
     else:
-      self.l_poly = model_polyfit(md.leftLane.points, self._path_pinv)  # left line
-      self.r_poly = model_polyfit(md.rightLane.points, self._path_pinv)  # right line
-      self.p_poly = model_polyfit(md.path.points, self._path_pinv)  # predicted path
+      # left line, right line and predicted path
+      points = np.array((md.leftLane.points, md.rightLane.points, md.path.points), dtype=np.float64)
+      self.l_poly, self.r_poly, self.p_poly = model_polyfit_batch(points, self._path_pinv)
     self.l_prob = md.leftLane.prob  # left line prob
     self.r_prob = md.rightLane.prob  # right line prob
 
@@ -66,7 +77,7 @@ class LanePlanner:
   def update_d_poly(self, v_ego):
     # only offset left and right lane lines; offsetting p_poly does not make sense
 
-    cameraOffset = ntune_get("cameraOffset")
+    cameraOffset = ntune_common().cameraOffset
 
     self.l_poly[3] += cameraOffset
     self.r_poly[3] += cameraOffset
@@ -75,11 +86,7 @@ class LanePlanner:
     # will be in a few seconds
     l_prob, r_prob = self.l_prob, self.r_prob
     width_poly = self.l_poly - self.r_poly
-    prob_mods = []
-    for t_check in [0.0, 1.5, 3.0]:
-      width_at_t = eval_poly(width_poly, t_check * (v_ego + 7))
-      prob_mods.append(interp(width_at_t, [4.0, 5.0], [1.0, 0.0]))
-    mod = min(prob_mods)
+    mod = width_prob_mod(width_poly, v_ego)
     l_prob *= mod
     r_prob *= mod
 
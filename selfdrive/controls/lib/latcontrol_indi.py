@@ -31,7 +31,11 @@ class LatControlINDI():
 
     self.K = K
     self.A_K = A - np.dot(K, C)
-    self.x = np.array([[0.], [0.], [0.]])
+
+    # the observer runs on plain floats, small numpy products cost far more than the math
+    self.K_rows = tuple(tuple(r) for r in self.K.tolist())
+    self.A_K_rows = tuple(tuple(r) for r in self.A_K.tolist())
+    self.x = [0., 0., 0.]
 
     self.enforce_rate_limit = CP.carName == "toyota"
 
@@ -47,6 +51,16 @@ class LatControlINDI():
     self.reset()
     self.tune = nTune(CP, self)
 
+  def update_observer(self, angle, rate):
+    """x = A_K x + K y, updated in place"""
+    x = self.x
+    x0, x1, x2 = x
+    (a00, a01, a02), (a10, a11, a12), (a20, a21, a22) = self.A_K_rows
+    (k00, k01), (k10, k11), (k20, k21) = self.K_rows
+    x[0] = a00 * x0 + a01 * x1 + a02 * x2 + k00 * angle + k01 * rate
+    x[1] = a10 * x0 + a11 * x1 + a12 * x2 + k10 * angle + k11 * rate
+    x[2] = a20 * x0 + a21 * x1 + a22 * x2 + k20 * angle + k21 * rate
+
   def reset(self):
     self.delayed_output = 0.
     self.output_steer = 0.
@@ -68,8 +82,7 @@ class LatControlINDI():
     self.tune.check()
 
     # Update Kalman filter
-    y = np.array([[math.radians(CS.steeringAngle)], [math.radians(CS.steeringRate)]])
-    self.x = np.dot(self.A_K, self.x) + np.dot(self.K, y)
+    self.update_observer(math.radians(CS.steeringAngle), math.radians(CS.steeringRate))
 
     indi_log = log.ControlsState.LateralINDIState.new_message()
     indi_log.steerAngle = math.degrees(self.x[0])
@@ -11,14 +11,12 @@ class LatControlLQR():
     self.scale = CP.lateralTuning.lqr.scale
     self.ki = CP.lateralTuning.lqr.ki
 
-    self.A = np.array(CP.lateralTuning.lqr.a).reshape((2, 2))
-    self.B = np.array(CP.lateralTuning.lqr.b).reshape((2, 1))
-    self.C = np.array(CP.lateralTuning.lqr.c).reshape((1, 2))
-    self.K = np.array(CP.lateralTuning.lqr.k).reshape((1, 2))
-    self.L = np.array(CP.lateralTuning.lqr.l).reshape((2, 1))
+    self.set_model(CP.lateralTuning.lqr.a, CP.lateralTuning.lqr.b, CP.lateralTuning.lqr.c,
+                   CP.lateralTuning.lqr.k, CP.lateralTuning.lqr.l)
     self.dc_gain = CP.lateralTuning.lqr.dcGain
 
-    self.x_hat = np.array([[0], [0]])
+    # observer state, kept as plain floats
+    self.x_hat = [0., 0.]
     self.i_unwind_rate = 0.3 * DT_CTRL
     self.i_rate = 1.0 * DT_CTRL
 
@@ -28,6 +26,31 @@ class LatControlLQR():
     self.reset()
     self.tune = nTune(CP, self)
 
+  def set_model(self, A, B, C, K, L):
+    """Observer and gain matrices, flattened row major. They are stored as floats,
+    for a 2 state observer scalar arithmetic is much cheaper than small numpy products."""
+    self.A = np.array(A, dtype=np.float64).reshape((2, 2))
+    self.B = np.array(B, dtype=np.float64).reshape((2, 1))
+    self.C = np.array(C, dtype=np.float64).reshape((1, 2))
+    self.K = np.array(K, dtype=np.float64).reshape((1, 2))
+    self.L = np.array(L, dtype=np.float64).reshape((2, 1))
+
+    (self.a00, self.a01), (self.a10, self.a11) = self.A.tolist()
+    self.b0, self.b1 = self.B[:, 0].tolist()
+    self.c0, self.c1 = self.C[0].tolist()
+    self.k0, self.k1 = self.K[0].tolist()
+    self.l0, self.l1 = self.L[:, 0].tolist()
+
+  def update_observer(self, steering_angle, steering_torque):
+    """Kalman filter update of x_hat in place, returns the estimated steering angle before the update"""
+    x = self.x_hat
+    x0, x1 = x
+    angle_steers_k = self.c0 * x0 + self.c1 * x1
+    e = steering_angle - angle_steers_k
+    x[0] = self.a00 * x0 + self.a01 * x1 + self.b0 * steering_torque + self.l0 * e
+    x[1] = self.a10 * x0 + self.a11 * x1 + self.b1 * steering_torque + self.l1 * e
+    return angle_steers_k
+
   def reset(self):
     self.i_lqr = 0.0
     self.output_steer = 0.0
@@ -59,9 +82,7 @@ class LatControlLQR():
     steering_angle -= path_plan.angleOffset
 
     # Update Kalman filter
-    angle_steers_k = float(self.C.dot(self.x_hat))
-    e = steering_angle - angle_steers_k
-    self.x_hat = self.A.dot(self.x_hat) + self.B.dot(CS.steeringTorqueEps / torque_scale) + self.L.dot(e)
+    angle_steers_k = self.update_observer(steering_angle, CS.steeringTorqueEps / torque_scale)
 
     if CS.vEgo < 0.3 or not active:
       lqr_log.active = False
@@ -71,7 +92,7 @@ class LatControlLQR():
       lqr_log.active = True
 
       # LQR
-      u_lqr = float(self.angle_steers_des / self.dc_gain - self.K.dot(self.x_hat))
+      u_lqr = float(self.angle_steers_des / self.dc_gain - (self.k0 * self.x_hat[0] + self.k1 * self.x_hat[1]))
       lqr_output = torque_scale * u_lqr / self.scale
 
       # Integrator
@@ -1,5 +1,4 @@
-from selfdrive.controls.lib.pid import PIController
-from selfdrive.controls.lib.drive_helpers import get_steer_max
+from selfdrive.controls.lib.pid import PIController, GainSchedule
 from cereal import car
 from cereal import log
 
@@ -10,6 +9,7 @@ class LatControlPID():
                             (CP.lateralTuning.pid.kiBP, CP.lateralTuning.pid.kiV),
                             k_f=CP.lateralTuning.pid.kf, pos_limit=1.0, neg_limit=-1.0,
                             sat_limit=CP.steerLimitTimer)
+    self.steer_max = GainSchedule(CP.steerMaxBP, CP.steerMaxV)
     self.angle_steers_des = 0.
 
   def reset(self):
@@ -27,7 +27,7 @@ class LatControlPID():
     else:
       self.angle_steers_des = path_plan.angleSteers  # get from MPC/PathPlanner
 
-      steers_max = get_steer_max(CP, CS.vEgo)
+      steers_max = self.steer_max(CS.vEgo)
       self.pid.pos_limit = steers_max
       self.pid.neg_limit = -steers_max
       steer_feedforward = self.angle_steers_des   # feedforward desired angle
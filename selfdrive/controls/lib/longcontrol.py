@@ -1,6 +1,6 @@
 from cereal import log
-from common.numpy_fast import clip, interp
-from selfdrive.controls.lib.pid import PIController
+from common.numpy_fast import clip
+from selfdrive.controls.lib.pid import PIController, GainSchedule
 
 LongCtrlState = log.ControlsState.LongControlState
 
@@ -58,6 +58,9 @@ class LongControl():
                             rate=RATE,
                             sat_limit=0.8,
                             convert=compute_gb)
+    self.gas_max = GainSchedule(CP.gasMaxBP, CP.gasMaxV)
+    self.brake_max = GainSchedule(CP.brakeMaxBP, CP.brakeMaxV)
+    self.deadzone = GainSchedule(CP.longitudinalTuning.deadzoneBP, CP.longitudinalTuning.deadzoneV)
     self.v_pid = 0.0
     self.last_output_gb = 0.0
 
@@ -69,8 +72,8 @@ class LongControl():
   def update(self, active, CS, v_target, v_target_future, a_target, CP):
     """Update longitudinal control. This updates the state machine and runs a PID loop"""
     # Actuation limits
-    gas_max = interp(CS.vEgo, CP.gasMaxBP, CP.gasMaxV)
-    brake_max = interp(CS.vEgo, CP.brakeMaxBP, CP.brakeMaxV)
+    gas_max = self.gas_max(CS.vEgo)
+    brake_max = self.brake_max(CS.vEgo)
 
     # Update state machine
     output_gb = self.last_output_gb
@@ -93,7 +96,7 @@ class LongControl():
       # Toyota starts braking more when it thinks you want to stop
       # Freeze the integrator so we don't accelerate to compensate, and don't allow positive acceleration
       prevent_overshoot = not CP.stoppingControl and CS.vEgo < 1.5 and v_target_future < 0.7
-      deadzone = interp(v_ego_pid, CP.longitudinalTuning.deadzoneBP, CP.longitudinalTuning.deadzoneV)
+      deadzone = self.deadzone(v_ego_pid)
 
       output_gb = self.pid.update(self.v_pid, v_ego_pid, speed=v_ego_pid, deadzone=deadzone, feedforward=a_target, freeze_integrator=prevent_overshoot)
 
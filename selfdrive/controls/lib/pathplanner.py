@@ -3,7 +3,7 @@ import math
 from common.numpy_fast import interp
 from common.realtime import sec_since_boot, DT_MDL
 from selfdrive.car.hyundai.values import CAR
-from selfdrive.ntune import ntune_get, ntune_isEnabled
+from selfdrive.ntune import ntune_common
 from selfdrive.swaglog import cloudlog
 from selfdrive.controls.lib.lateral_mpc import libmpc_py
 from selfdrive.controls.lib.drive_helpers import MPC_COST_LAT
@@ -23,6 +23,11 @@ LOG_MPC = os.environ.get('LOG_MPC', False)
 LANE_CHANGE_SPEED_MIN = 60 * CV.KPH_TO_MS
 LANE_CHANGE_TIME_MAX = 10.
 
+# lateral controllers output nothing below this speed, so the mpc isn't solved either
+MPC_MIN_SPEED = 0.3
+# when not active the solution is not used, only solve every n-th model frame to keep the validity check alive
+MPC_INACTIVE_DECIMATION = 4
+
 DESIRES = {
   LaneChangeDirection.none: {
     LaneChangeState.off: log.PathPlan.Desire.none,
@@ -56,10 +61,14 @@ class PathPlanner():
 
     self.last_cloudlog_t = 0
     #self.steer_rate_cost = CP.steerRateCost
-    self.steer_rate_cost_prev = ntune_get('steerRateCost')
+    self.steer_rate_cost_prev = ntune_common().steerRateCost
 
     self.setup_mpc()
     self.solution_invalid_cnt = 0
+    self.mpc_frame = 0
+    self.mpc_reinit_cnt = 0
+    self.mpc_solve_time = 0.
+    self.mpc_iterations = 0
     self.lane_change_enabled = Params().get('LaneChangeEnabled') == b'1'
     self.auto_lane_change_enabled = Params().get('AutoLaneChangeEnabled') == b'1'
     self.lane_change_state = LaneChangeState.off
@@ -94,13 +103,14 @@ class PathPlanner():
     active = sm['controlsState'].active
     angle_offset = sm['liveParameters'].angleOffset
 
-    steerRateCost = ntune_get('steerRateCost')
+    # one tuning snapshot per model frame
+    tune = ntune_common()
+    steerRateCost = tune.steerRateCost
 
+    # only the weights change, keep the solver warm
     if self.steer_rate_cost_prev != steerRateCost:
       self.steer_rate_cost_prev = steerRateCost
-
-      self.libmpc.init(MPC_COST_LAT.PATH, MPC_COST_LAT.LANE, MPC_COST_LAT.HEADING, steerRateCost)
-      self.cur_state[0].delta = math.radians(angle_steers - angle_offset) / VM.sR
+      self.libmpc.init_weights(MPC_COST_LAT.PATH, MPC_COST_LAT.LANE, MPC_COST_LAT.HEADING, steerRateCost)
 
     # Run MPC
     self.angle_steers_des_prev = self.angle_steers_des_mpc
@@ -111,10 +121,10 @@ class PathPlanner():
     if self.use_dynamic_sr:
       sr = interp(abs(self.angle_steers_des_mpc), [5., 15.], [11.8, 16.2])
     else:
-      if ntune_isEnabled('useLiveSteerRatio'):
+      if tune.useLiveSteerRatio > 0.5:
         sr = max(sm['liveParameters'].steerRatio, 0.1)
       else:
-        sr = max(ntune_get('steerRatio'), 0.1)
+        sr = max(tune.steerRatio, 0.1)
 
     VM.update_params(x, sr)
 
@@ -202,19 +212,31 @@ class PathPlanner():
 
     self.LP.update_d_poly(v_ego)
 
-    steerActuatorDelay = ntune_get('steerActuatorDelay')
+    steerActuatorDelay = tune.steerActuatorDelay
 
-    # account for actuation delay
-    self.cur_state = calc_states_after_delay(self.cur_state, v_ego, angle_steers - angle_offset, curvature_factor, VM.sR,
-                                             steerActuatorDelay)
+    # solve every frame while steering, decimated when inactive, not at all when stopped
+    self.mpc_frame += 1
+    if v_ego < MPC_MIN_SPEED:
+      run_mpc = False
+    elif active:
+      run_mpc = True
+    else:
+      run_mpc = self.mpc_frame % MPC_INACTIVE_DECIMATION == 0
 
-    v_ego_mpc = max(v_ego, 5.0)  # avoid mpc roughness due to low speed
-    self.libmpc.run_mpc(self.cur_state, self.mpc_solution,
-                        list(self.LP.l_poly), list(self.LP.r_poly), list(self.LP.d_poly),
-                        self.LP.l_prob, self.LP.r_prob, curvature_factor, v_ego_mpc, self.LP.lane_width)
+    if run_mpc:
+      # account for actuation delay
+      self.cur_state = calc_states_after_delay(self.cur_state, v_ego, angle_steers - angle_offset, curvature_factor, VM.sR,
+                                               steerActuatorDelay)
+
+      v_ego_mpc = max(v_ego, 5.0)  # avoid mpc roughness due to low speed
+      t_solve = sec_since_boot()
+      self.mpc_iterations = self.libmpc.run_mpc(self.cur_state, self.mpc_solution,
+                                                self.LP.l_poly.tolist(), self.LP.r_poly.tolist(), self.LP.d_poly.tolist(),
+                                                self.LP.l_prob, self.LP.r_prob, curvature_factor, v_ego_mpc, self.LP.lane_width)
+      self.mpc_solve_time = sec_since_boot() - t_solve
 
     # reset to current steer angle if not active or overriding
-    if active:
+    if active and run_mpc:
       delta_desired = self.mpc_solution[0].delta[1]
       rate_desired = math.degrees(self.mpc_solution[0].rate[0] * VM.sR)
     else:
@@ -225,30 +247,32 @@ class PathPlanner():
 
     self.angle_steers_des_mpc = float(math.degrees(delta_desired * VM.sR) + angle_offset)
 
-    #  Check for infeasable MPC solution
-    mpc_nans = any(math.isnan(x) for x in self.mpc_solution[0].delta)
-    t = sec_since_boot()
-    if mpc_nans:
-      self.libmpc.init(MPC_COST_LAT.PATH, MPC_COST_LAT.LANE, MPC_COST_LAT.HEADING, steerRateCost)
-      self.cur_state[0].delta = math.radians(angle_steers - angle_offset) / VM.sR
-
-      if t > self.last_cloudlog_t + 5.0:
-        self.last_cloudlog_t = t
-        cloudlog.warning("Lateral mpc - nan: True")
-
-    if self.mpc_solution[0].cost > 20000. or mpc_nans:   # TODO: find a better way to detect when MPC did not converge
-      self.solution_invalid_cnt += 1
-    else:
-      self.solution_invalid_cnt = 0
+    #  Check for infeasable MPC solution, the validity of skipped frames is carried over
+    if run_mpc:
+      mpc_nans = any(math.isnan(x) for x in self.mpc_solution[0].delta)
+      t = sec_since_boot()
+      if mpc_nans:
+        self.libmpc.init(MPC_COST_LAT.PATH, MPC_COST_LAT.LANE, MPC_COST_LAT.HEADING, steerRateCost)
+        self.cur_state[0].delta = math.radians(angle_steers - angle_offset) / VM.sR
+        self.mpc_reinit_cnt += 1
+
+        if t > self.last_cloudlog_t + 5.0:
+          self.last_cloudlog_t = t
+          cloudlog.warning("Lateral mpc - nan: True")
+
+      if self.mpc_solution[0].cost > 20000. or mpc_nans:   # TODO: find a better way to detect when MPC did not converge
+        self.solution_invalid_cnt += 1
+      else:
+        self.solution_invalid_cnt = 0
     plan_solution_valid = self.solution_invalid_cnt < 3
 
     plan_send = messaging.new_message('pathPlan')
     plan_send.valid = sm.all_alive_and_valid(service_list=['carState', 'controlsState', 'liveParameters', 'model'])
     plan_send.pathPlan.laneWidth = float(self.LP.lane_width)
-    plan_send.pathPlan.dPoly = [float(x) for x in self.LP.d_poly]
-    plan_send.pathPlan.lPoly = [float(x) for x in self.LP.l_poly]
+    plan_send.pathPlan.dPoly = self.LP.d_poly.tolist()
+    plan_send.pathPlan.lPoly = self.LP.l_poly.tolist()
     plan_send.pathPlan.lProb = float(self.LP.l_prob)
-    plan_send.pathPlan.rPoly = [float(x) for x in self.LP.r_poly]
+    plan_send.pathPlan.rPoly = self.LP.r_poly.tolist()
     plan_send.pathPlan.rProb = float(self.LP.r_prob)
 
     plan_send.pathPlan.angleSteers = float(self.angle_steers_des_mpc)
@@ -267,9 +291,14 @@ class PathPlanner():
     plan_send.pathPlan.steerRateCost = steerRateCost
     plan_send.pathPlan.steerActuatorDelay = steerActuatorDelay
 
+    plan_send.pathPlan.mpcSolveTime = float(self.mpc_solve_time * 1000.)
+    plan_send.pathPlan.mpcIterations = int(self.mpc_iterations)
+    plan_send.pathPlan.mpcReinitCount = self.mpc_reinit_cnt
+    plan_send.pathPlan.mpcSkipped = not run_mpc
+
     pm.send('pathPlan', plan_send)
 
-    if LOG_MPC:
+    if LOG_MPC and run_mpc:
       dat = messaging.new_message('liveMpc')
       dat.liveMpc.x = list(self.mpc_solution[0].x)
       dat.liveMpc.y = list(self.mpc_solution[0].y)
@@ -1,5 +1,6 @@
 import numpy as np
-from common.numpy_fast import clip, interp
+from bisect import bisect_left
+from common.numpy_fast import clip
 
 def apply_deadzone(error, deadzone):
   if error > deadzone:
@@ -10,10 +11,39 @@ def apply_deadzone(error, deadzone):
     error = 0.
   return error
 
+class GainSchedule():
+  """Breakpoint table compiled once into tuples. Evaluates exactly like
+  common.numpy_fast.interp, but with a binary search and a cache of the last lookup."""
+  def __init__(self, bp, v):
+    self.bp = tuple(bp)
+    self.v = tuple(v)
+    self.n = len(self.bp)
+    self.last_x = None
+    self.last_y = None
+
+  def __call__(self, x):
+    if x == self.last_x:
+      return self.last_y
+
+    bp, v = self.bp, self.v
+    hi = bisect_left(bp, x)
+    if hi == self.n:
+      y = v[-1]
+    elif hi == 0:
+      y = v[0]
+    else:
+      low = hi - 1
+      y = (x - bp[low]) * (v[hi] - v[low]) / (bp[hi] - bp[low]) + v[low]
+
+    self.last_x = x
+    self.last_y = y
+    return y
+
+
 class PIController():
   def __init__(self, k_p, k_i, k_f=1., pos_limit=None, neg_limit=None, rate=100, sat_limit=0.8, convert=None):
-    self._k_p = k_p  # proportional gain
-    self._k_i = k_i  # integral gain
+    self._k_p = GainSchedule(*k_p)  # proportional gain
+    self._k_i = GainSchedule(*k_i)  # integral gain
     self.k_f = k_f  # feedforward gain
 
     self.pos_limit = pos_limit
@@ -29,11 +59,11 @@ class PIController():
 
   @property
   def k_p(self):
-    return interp(self.speed, self._k_p[0], self._k_p[1])
+    return self._k_p(self.speed)
 
   @property
   def k_i(self):
-    return interp(self.speed, self._k_i[0], self._k_i[1])
+    return self._k_i(self.speed)
 
   def _check_saturation(self, control, check_saturation, error):
     saturated = (control < self.neg_limit) or (control > self.pos_limit)
@@ -59,13 +89,13 @@ class PIController():
     self.speed = speed
 
     error = float(apply_deadzone(setpoint - measurement, deadzone))
-    self.p = error * self.k_p
+    self.p = error * self._k_p(speed)
     self.f = feedforward * self.k_f
 
     if override:
       self.i -= self.i_unwind_rate * float(np.sign(self.i))
     else:
-      i = self.i + error * self.k_i * self.i_rate
+      i = self.i + error * self._k_i(speed) * self.i_rate
       control = self.p + self.f + i
 
       if self.convert is not None:
@@ -11,19 +11,26 @@ The system is defined by
 x_dot = A*x + B*u
 
 A depends on longitudinal speed, u [m/s], and vehicle parameters CP
+
+The steady state solutions are solved in closed form and cached per speed, the cache
+only depends on the stiffness factor since B scales with 1 / steer ratio.
 """
-from typing import Tuple
+from typing import Dict, Optional, Sequence, Tuple
 
 import numpy as np
-from numpy.linalg import solve
 
 from cereal import car
 
+CACHE_SIZE = 256  # speeds, cleared when full
+
+
 class VehicleModel:
-  def __init__(self, CP: car.CarParams):
+  def __init__(self, CP: car.CarParams, lut_speeds: Optional[Sequence[float]] = None):
     """
     Args:
       CP: Car Parameters
+      lut_speeds: Optional sorted speed breakpoints [m/s]. When given, solutions between the
+        first and last breakpoint are interpolated from a table instead of solved.
     """
     # for math readability, convert long names car params into short names
     self.m = CP.mass
@@ -35,13 +42,42 @@ class VehicleModel:
 
     self.cF_orig = CP.tireStiffnessFront
     self.cR_orig = CP.tireStiffnessRear
+
+    self.lut_speeds = None
+    if lut_speeds is not None:
+      # the kinematic model is used up to 0.1 m/s
+      lut_speeds = np.asarray(lut_speeds, dtype=np.float64)
+      self.lut_speeds = lut_speeds[lut_speeds > 0.1]
+    self.lut: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+
+    self.stiffness_factor = None
     self.update_params(1.0, CP.steerRatio)
 
   def update_params(self, stiffness_factor: float, steer_ratio: float) -> None:
     """Update the vehicle model with a new stiffness factor and steer ratio"""
+    self.sR = steer_ratio
+    if stiffness_factor == self.stiffness_factor:
+      return
+
+    self.stiffness_factor = stiffness_factor
     self.cF = stiffness_factor * self.cF_orig
     self.cR = stiffness_factor * self.cR_orig
-    self.sR = steer_ratio
+    self.slip_factor = calc_slip_factor(self)
+
+    # solutions for steer ratio 1, keyed on speed
+    self.ss_cache: Dict[float, Tuple[float, float]] = {}
+    self.cf_cache: Dict[float, float] = {}
+    self.lut = None
+
+  def build_lut(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Tabulates the curvature factor and the steady state solution over lut_speeds"""
+    u = self.lut_speeds
+    x0, x1 = dyn_ss_unit(u, self)
+    self.lut = ((1. - self.chi) / (1. - self.slip_factor * u**2) / self.l, x0, x1)
+    return self.lut
+
+  def in_lut(self, u: float) -> bool:
+    return self.lut_speeds is not None and len(self.lut_speeds) > 1 and self.lut_speeds[0] <= u <= self.lut_speeds[-1]
 
   def steady_state_sol(self, sa: float, u: float) -> np.ndarray:
     """Returns the steady state solution.
@@ -56,11 +92,23 @@ class VehicleModel:
     Returns:
       2x1 matrix with steady state solution (lateral speed, rotational speed)
     """
-    if u > 0.1:
-      return dyn_ss_sol(sa, u, self)
-    else:
+    if u <= 0.1:
       return kin_ss_sol(sa, u, self)
 
+    if self.in_lut(u):
+      lut = self.lut if self.lut is not None else self.build_lut()
+      x0, x1 = np.interp(u, self.lut_speeds, lut[1]), np.interp(u, self.lut_speeds, lut[2])
+    else:
+      x = self.ss_cache.get(u)
+      if x is None:
+        if len(self.ss_cache) >= CACHE_SIZE:
+          self.ss_cache.clear()
+        x = self.ss_cache[u] = dyn_ss_unit(u, self)
+      x0, x1 = x
+
+    k = sa / self.sR
+    return np.array([[x0 * k], [x1 * k]])
+
   def calc_curvature(self, sa: float, u: float) -> float:
     """Returns the curvature. Multiplied by the speed this will give the yaw rate.
 
@@ -83,8 +131,16 @@ class VehicleModel:
     Returns:
       Curvature factor [1/m]
     """
-    sf = calc_slip_factor(self)
-    return (1. - self.chi) / (1. - sf * u**2) / self.l
+    if self.in_lut(u):
+      lut = self.lut if self.lut is not None else self.build_lut()
+      return float(np.interp(u, self.lut_speeds, lut[0]))
+
+    cf = self.cf_cache.get(u)
+    if cf is None:
+      if len(self.cf_cache) >= CACHE_SIZE:
+        self.cf_cache.clear()
+      cf = self.cf_cache[u] = (1. - self.chi) / (1. - self.slip_factor * u**2) / self.l
+    return cf
 
   def get_steer_from_curvature(self, curv: float, u: float) -> float:
     """Calculates the required steering wheel angle for a given curvature
@@ -187,8 +243,30 @@ def dyn_ss_sol(sa: float, u: float, VM: VehicleModel) -> np.ndarray:
   Returns:
     2x1 matrix with steady state solution
   """
-  A, B = create_dyn_state_matrices(u, VM)
-  return -solve(A, B) * sa
+  x0, x1 = dyn_ss_unit(u, VM)
+  return np.array([[x0], [x1]]) * (sa / VM.sR)
+
+
+def dyn_ss_unit(u, VM: VehicleModel):
+  """Closed form of -A^{-1} B for steer ratio 1, the 2x2 inverse written out.
+  u can be a float or an array of speeds.
+
+  Args:
+    u: Speed [m/s]
+    VM: Vehicle model
+
+  Returns:
+    Lateral speed and rotational speed per rad of wheel angle
+  """
+  a00 = - (VM.cF + VM.cR) / (VM.m * u)
+  a01 = - (VM.cF * VM.aF - VM.cR * VM.aR) / (VM.m * u) - u
+  a10 = - (VM.cF * VM.aF - VM.cR * VM.aR) / (VM.j * u)
+  a11 = - (VM.cF * VM.aF**2 + VM.cR * VM.aR**2) / (VM.j * u)
+  b0 = (VM.cF + VM.chi * VM.cR) / VM.m
+  b1 = (VM.cF * VM.aF - VM.chi * VM.cR * VM.aR) / VM.j
+
+  det = a00 * a11 - a01 * a10
+  return (a01 * b1 - a11 * b0) / det, (a10 * b0 - a00 * b1) / det
 
 
 def calc_slip_factor(VM):
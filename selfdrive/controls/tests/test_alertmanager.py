@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+import unittest
+
+from common.realtime import DT_CTRL
+from selfdrive.controls.lib.alertmanager import AlertManager
+from selfdrive.controls.lib.events import Alert, AlertSize, AlertStatus, AudibleAlert, ET, Priority, VisualAlert
+
+
+def make_alert(alert_type, priority, duration=1., event_type=ET.WARNING):
+  alert = Alert(alert_type, "", AlertStatus.normal, AlertSize.small, priority,
+                VisualAlert.none, AudibleAlert.none, 0., 0., duration)
+  alert.alert_type = alert_type
+  alert.event_type = event_type
+  return alert
+
+
+def frames(seconds):
+  return int(round(seconds / DT_CTRL))
+
+
+class TestAlertManager(unittest.TestCase):
+  def current(self, AM, frame):
+    AM.process_alerts(frame)
+    return AM.alert_type
+
+  def test_priority(self):
+    AM = AlertManager()
+    AM.add_many(0, [make_alert("low", Priority.LOW), make_alert("highest", Priority.HIGHEST), make_alert("mid", Priority.MID)])
+    self.assertEqual(self.current(AM, 0), "highest")
+    self.assertEqual(AM.alert_text_1, "highest")
+
+    # a higher priority alert takes over while the others are still active
+    AM.add_many(10, [make_alert("high", Priority.HIGH, duration=3.)])
+    self.assertEqual(self.current(AM, 10), "highest")
+    self.assertEqual(self.current(AM, frames(1.)), "high")
+
+  def test_equal_priority(self):
+    AM = AlertManager()
+    AM.add_many(0, [make_alert("first", Priority.MID, duration=2.)])
+    AM.add_many(10, [make_alert("second", Priority.MID, duration=2.)])
+    self.assertEqual(self.current(AM, 10), "second")
+
+    # the most recently activated one wins, refreshing the other doesn't bring it back on top
+    AM.add_many(20, [make_alert("first", Priority.MID, duration=2.)])
+    self.assertEqual(self.current(AM, 20), "second")
+
+    # once the newer one expires the refreshed one is still there
+    self.assertEqual(self.current(AM, 10 + frames(2.)), "first")
+    self.assertEqual(self.current(AM, 20 + frames(2.)), "")
+
+  def test_expiry(self):
+    AM = AlertManager()
+    AM.add_many(0, [make_alert("short", Priority.HIGH, duration=0.5), make_alert("long", Priority.LOW, duration=2.)])
+    self.assertEqual(self.current(AM, frames(0.5) - 1), "short")
+    self.assertEqual(self.current(AM, frames(0.5)), "long")
+    self.assertEqual(self.current(AM, frames(2.)), "")
+    self.assertEqual(AM.alert_text_1, "")
+    self.assertEqual(AM.active_alerts, {})
+
+  def test_clear_event_type(self):
+    AM = AlertManager()
+    AM.add_many(0, [make_alert("warning", Priority.HIGH), make_alert("permanent", Priority.LOW, event_type=ET.PERMANENT)])
+    AM.process_alerts(1, clear_event_type=ET.WARNING)
+    self.assertEqual(AM.alert_type, "permanent")
+
+  def test_readd(self):
+    AM = AlertManager()
+    # added every frame, it stays active for its duration after the last one
+    for frame in range(50):
+      AM.add_many(frame, [make_alert("repeated", Priority.MID)])
+      self.assertEqual(self.current(AM, frame), "repeated")
+    self.assertEqual(self.current(AM, 49 + frames(1.) - 1), "repeated")
+    self.assertEqual(self.current(AM, 49 + frames(1.)), "")
+
+    # after it expired it's activated again, with its text shown from the start
+    frame = 100 + frames(1.)
+    AM.add_many(frame, [make_alert("repeated", Priority.MID)])
+    self.assertEqual(self.current(AM, frame), "repeated")
+    self.assertEqual(AM.alert_text_1, "repeated")
+    self.assertEqual(len(AM.active_alerts), 1)
+
+    # the heap doesn't grow with re-adds
+    for i in range(1000):
+      AM.add_many(frame + i, [make_alert("repeated", Priority.MID, duration=0.)])
+      AM.process_alerts(frame + i)
+    self.assertLess(len(AM.alert_heap), 20)
+
+  def test_flapping_below_persistent(self):
+    AM = AlertManager()
+    # a permanent alert stays on top while a lower one keeps expiring and coming back
+    for frame in range(10000):
+      alerts = [make_alert("permanent", Priority.HIGHEST)]
+      if frame % 3 == 0:
+        alerts.append(make_alert("flapping", Priority.LOW, duration=0.))
+      AM.add_many(frame, alerts)
+      self.assertEqual(self.current(AM, frame), "permanent")
+    self.assertLessEqual(len(AM.active_alerts), 2)
+    self.assertLessEqual(len(AM.alert_heap), 2 * len(AM.active_alerts) + 16)
+
+
+if __name__ == "__main__":
+  unittest.main()
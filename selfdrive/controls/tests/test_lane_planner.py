@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+import unittest
+from types import SimpleNamespace
+import numpy as np
+
+from common.numpy_fast import interp
+from selfdrive.controls.lib.lane_planner import LanePlanner, compute_path_pinv, eval_poly, width_prob_mod
+
+
+def random_model(rng):
+  # model outputs without polys, so the lane planner has to refit the points
+  x = np.arange(50.)
+  def lane(offset):
+    pts = offset + rng.uniform(-1e-3, 1e-3) * x**2 + rng.normal(0, 0.02, 50)
+    return SimpleNamespace(points=pts.tolist(), poly=[], std=float(rng.uniform(0.05, 0.4)), prob=float(rng.uniform(0, 1)))
+  return SimpleNamespace(leftLane=lane(rng.uniform(1.2, 2.5)), rightLane=lane(-rng.uniform(1.2, 2.5)), path=lane(0.),
+                         meta=SimpleNamespace(desireState=[]))
+
+
+def parse_model_old(md, path_pinv):
+  fit = lambda points: np.dot(path_pinv, [float(x) for x in points])
+  return fit(md.leftLane.points), fit(md.rightLane.points), fit(md.path.points)
+
+
+def prob_mod_old(width_poly, v_ego):
+  prob_mods = []
+  for t_check in [0.0, 1.5, 3.0]:
+    width_at_t = eval_poly(width_poly, t_check * (v_ego + 7))
+    prob_mods.append(interp(width_at_t, [4.0, 5.0], [1.0, 0.0]))
+  return min(prob_mods)
+
+
+class TestLanePlanner(unittest.TestCase):
+  def setUp(self):
+    self.rng = np.random.RandomState(0)
+    self.models = [random_model(self.rng) for _ in range(100)]
+    self.path_pinv = compute_path_pinv()
+
+  def test_batch_fit_matches(self):
+    LP = LanePlanner()
+    for md in self.models:
+      LP.parse_model(md)
+      for new, old in zip((LP.l_poly, LP.r_poly, LP.p_poly), parse_model_old(md, self.path_pinv)):
+        np.testing.assert_allclose(new, old, rtol=1e-9, atol=1e-12)
+
+  def test_width_prob_mod_matches(self):
+    for _ in range(1000):
+      width_poly = np.array([self.rng.normal(0, 1e-5), self.rng.normal(0, 1e-3), self.rng.normal(0, 0.02), self.rng.uniform(2.5, 5.5)])
+      v_ego = self.rng.uniform(0, 40)
+      self.assertAlmostEqual(width_prob_mod(width_poly, v_ego), prob_mod_old(width_poly, v_ego), places=9)
+
+
+if __name__ == "__main__":
+  unittest.main()
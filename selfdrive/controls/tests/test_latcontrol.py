@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+import unittest
+import tracemalloc
+from unittest import mock
+import numpy as np
+
+from cereal import car
+from selfdrive.controls.lib.latcontrol_lqr import LatControlLQR
+from selfdrive.controls.lib.latcontrol_indi import LatControlINDI
+
+
+def get_CP(tuning):
+  CP = car.CarParams.new_message()
+  CP.steerLimitTimer = 1.0
+  if tuning == 'lqr':
+    CP.lateralTuning.init('lqr')
+    CP.lateralTuning.lqr.scale = 1500.0
+    CP.lateralTuning.lqr.ki = 0.05
+    CP.lateralTuning.lqr.a = [0., 1., -0.22619643, 1.21822268]
+    CP.lateralTuning.lqr.b = [-1.92006585e-04, 3.95603032e-05]
+    CP.lateralTuning.lqr.c = [1., 0.]
+    CP.lateralTuning.lqr.k = [-110.73572306, 451.22718255]
+    CP.lateralTuning.lqr.l = [0.3233671, 0.3185757]
+    CP.lateralTuning.lqr.dcGain = 0.002237852961363602
+  else:
+    CP.lateralTuning.init('indi')
+    CP.lateralTuning.indi.innerLoopGain = 4.0
+    CP.lateralTuning.indi.outerLoopGain = 3.0
+    CP.lateralTuning.indi.timeConstant = 1.0
+    CP.lateralTuning.indi.actuatorEffectiveness = 1.0
+  return CP
+
+
+def peak_allocated(fn, n=10000):
+  for _ in range(100):
+    fn()
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  tracemalloc.reset_peak()
+  for _ in range(n):
+    fn()
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return peak - before
+
+
+def allocates(fn):
+  # anything above what the bare call loop needs was allocated by fn, even if freed again
+  return peak_allocated(fn) > peak_allocated(lambda: None)
+
+
+# the tuning files under /data are not touched by these tests
+@mock.patch('selfdrive.controls.lib.latcontrol_lqr.nTune', mock.MagicMock())
+@mock.patch('selfdrive.controls.lib.latcontrol_indi.nTune', mock.MagicMock())
+class TestLatControlObservers(unittest.TestCase):
+  def setUp(self):
+    self.rng = np.random.RandomState(0)
+
+  def test_lqr_observer_matches_numpy(self):
+    lqr = LatControlLQR(get_CP('lqr'))
+    x_hat = np.array([[0.], [0.]])
+    for _ in range(1000):
+      angle, torque = self.rng.uniform(-90, 90), self.rng.uniform(-1500, 1500)
+
+      angle_steers_k_ref = lqr.C.dot(x_hat).item()
+      x_hat = lqr.A.dot(x_hat) + lqr.B.dot(torque) + lqr.L.dot(angle - angle_steers_k_ref)
+
+      self.assertAlmostEqual(lqr.update_observer(angle, torque), angle_steers_k_ref, places=9)
+      np.testing.assert_allclose(lqr.x_hat, x_hat[:, 0], rtol=1e-9, atol=1e-9)
+
+  def test_indi_observer_matches_numpy(self):
+    indi = LatControlINDI(get_CP('indi'))
+    x = np.array([[0.], [0.], [0.]])
+    for _ in range(1000):
+      angle, rate = np.radians(self.rng.uniform(-90, 90)), np.radians(self.rng.uniform(-200, 200))
+
+      x = np.dot(indi.A_K, x) + np.dot(indi.K, np.array([[angle], [rate]]))
+      indi.update_observer(angle, rate)
+      np.testing.assert_allclose(indi.x, x[:, 0], rtol=1e-9, atol=1e-9)
+
+  def test_observers_do_not_allocate(self):
+    lqr = LatControlLQR(get_CP('lqr'))
+    indi = LatControlINDI(get_CP('indi'))
+    self.assertFalse(allocates(lambda: lqr.update_observer(1.5, 100.)))
+    self.assertFalse(allocates(lambda: indi.update_observer(0.02, 0.1)))
+    self.assertTrue(allocates(lambda: np.dot(indi.A_K, np.zeros((3, 1)))))
+
+
+if __name__ == "__main__":
+  unittest.main()
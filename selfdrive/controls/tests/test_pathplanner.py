@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from cereal import car
+from selfdrive.controls.lib import lane_planner, pathplanner
+from selfdrive.controls.lib.lateral_mpc import libmpc_py
+from selfdrive.controls.lib.pathplanner import MPC_INACTIVE_DECIMATION, MPC_MIN_SPEED, PathPlanner
+from selfdrive.controls.lib.vehicle_model import VehicleModel
+from selfdrive.controls.tests.test_vehicle_model import get_CP
+
+
+class FakeMPC():
+  """Stands in for libmpc, the solution it writes is set by the test"""
+  def __init__(self):
+    self.calls = []
+    self.delta = 0.01
+    self.cost = 1.
+
+  def count(self, name):
+    return sum(1 for c in self.calls if c[0] == name)
+
+  def init(self, *weights):
+    self.calls.append(('init',) + weights)
+
+  def init_weights(self, *weights):
+    self.calls.append(('init_weights',) + weights)
+
+  def run_mpc(self, cur_state, solution, *args):
+    self.calls.append(('run_mpc',))
+    for i in range(len(solution[0].delta)):
+      solution[0].delta[i] = self.delta
+    for i in range(len(solution[0].rate)):
+      solution[0].rate[i] = 0.
+    solution[0].cost = self.cost
+    return 5
+
+
+class FakeSubMaster(dict):
+  def all_alive_and_valid(self, service_list=None):
+    return True
+
+
+class FakePubMaster():
+  def __init__(self):
+    self.sent = []
+
+  def send(self, service, msg):
+    self.sent.append(msg)
+
+
+def lane(offset):
+  return SimpleNamespace(poly=[0., 0., 0., offset], points=[], std=0.1, prob=0.9)
+
+
+class TestPathPlanner(unittest.TestCase):
+  def setUp(self):
+    self.mpc = FakeMPC()
+    self.tune = SimpleNamespace(steerRateCost=0.5, useLiveSteerRatio=1., steerRatio=15., steerActuatorDelay=0.2, cameraOffset=0.)
+    for p in (mock.patch.object(libmpc_py, 'libmpc', self.mpc),
+              mock.patch.object(pathplanner, 'ntune_common', return_value=self.tune),
+              mock.patch.object(lane_planner, 'ntune_common', return_value=self.tune),
+              mock.patch.object(pathplanner, 'Params')):
+      p.start()
+      self.addCleanup(p.stop)
+
+    CP = get_CP()
+    CP.carName = "mock"
+    self.VM = VehicleModel(CP)
+    self.PP = PathPlanner(CP)
+    self.pm = FakePubMaster()
+
+  def update(self, v_ego=20., active=False):
+    sm = FakeSubMaster({
+      'carState': car.CarState.new_message(vEgo=v_ego, steeringAngle=1.),
+      'controlsState': SimpleNamespace(active=active),
+      'liveParameters': SimpleNamespace(angleOffset=0., stiffnessFactor=1., steerRatio=15., valid=True),
+      'model': SimpleNamespace(leftLane=lane(1.8), rightLane=lane(-1.8), path=lane(0.), meta=SimpleNamespace(desireState=[])),
+    })
+    self.PP.update(sm, self.pm, None, self.VM)
+    return self.pm.sent[-1].pathPlan
+
+  def test_decimation(self):
+    plans = [self.update(active=True) for _ in range(8)]
+    self.assertEqual(self.mpc.count('run_mpc'), 8)
+    self.assertFalse(any(p.mpcSkipped for p in plans))
+
+    plans = [self.update(active=False) for _ in range(4 * MPC_INACTIVE_DECIMATION)]
+    self.assertEqual(self.mpc.count('run_mpc'), 8 + 4)
+    self.assertEqual(sum(not p.mpcSkipped for p in plans), 4)
+
+    self.update(v_ego=MPC_MIN_SPEED / 2, active=True)
+    self.assertEqual(self.mpc.count('run_mpc'), 8 + 4)
+
+  def test_skipped_frames_carry_over(self):
+    self.mpc.cost = 1e6  # not converged
+    validity = []
+    for _ in range(6 * MPC_INACTIVE_DECIMATION):
+      plan = self.update(active=False)
+      validity.append((plan.mpcSkipped, plan.mpcSolutionValid))
+    # invalid from the third solve on, the frames skipped after it stay invalid
+    solved = [i for i, (skipped, _) in enumerate(validity) if not skipped]
+    self.assertTrue(all(valid for _, valid in validity[:solved[2]]))
+    self.assertFalse(any(valid for _, valid in validity[solved[2]:]))
+
+    # the solution is left as the last solve wrote it
+    self.mpc.delta = 0.02
+    while self.update(active=False).mpcSkipped:
+      pass
+    self.mpc.delta = 0.03
+    self.assertTrue(self.update(active=False).mpcSkipped)
+    self.assertEqual(self.PP.mpc_solution[0].delta[1], 0.02)
+
+    # a good solve makes it valid again
+    self.mpc.cost = 1.
+    while self.update(active=False).mpcSkipped:
+      pass
+    self.assertTrue(self.update(active=False).mpcSolutionValid)
+
+  def test_steer_rate_cost_change(self):
+    self.update(active=True)
+    self.assertEqual(self.mpc.count('init'), 1)
+    self.assertEqual(self.mpc.count('init_weights'), 0)
+
+    self.tune.steerRateCost = 0.8
+    plan = self.update(active=True)
+    self.update(active=True)
+    # the weights are updated once, the solver isn't reset
+    self.assertEqual([c for c in self.mpc.calls if c[0] == 'init_weights'], [('init_weights',) + self.mpc.calls[0][1:4] + (0.8,)])
+    self.assertEqual(self.mpc.count('init'), 1)
+    self.assertAlmostEqual(plan.steerRateCost, 0.8)
+
+
+if __name__ == "__main__":
+  unittest.main()
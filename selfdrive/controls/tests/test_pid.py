@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+import math
+import random
+import unittest
+
+from common.numpy_fast import interp
+from selfdrive.controls.lib.pid import GainSchedule
+
+# shapes of breakpoint tables used by the car interfaces
+TABLES = [
+  ([0.], [0.25]),
+  ([0., 35.], [3.6, 2.4]),
+  ([0., 5., 35.], [1.2, 0.8, 0.5]),
+  ([0., 10., 10., 40.], [0.1, 0.2, 0.5, 0.3]),
+  ([-1., 0., 5., 15., 35.], [0., 0.03, 0.05, 0.1, 0.2]),
+  ([0., 6.5, 6.5 + 1e-9, 30.], [2., 1., 0.5, 0.35]),
+]
+
+
+class TestGainSchedule(unittest.TestCase):
+  def assertSameFloat(self, a, b):
+    if math.isnan(b):
+      self.assertTrue(math.isnan(a))
+    else:
+      # bit for bit, not approximately
+      self.assertEqual(float(a).hex(), float(b).hex())
+
+  def test_equals_interp(self):
+    random.seed(0)
+    for bp, v in TABLES:
+      schedule = GainSchedule(bp, v)
+      xs = list(bp) + [bp[0] - 1., bp[-1] + 1., float('inf'), float('-inf'), -0.0]
+      xs += [random.uniform(bp[0] - 5., bp[-1] + 5.) for _ in range(2000)]
+      for x in xs:
+        self.assertSameFloat(schedule(x), interp(x, bp, v))
+
+  def test_cached_lookup(self):
+    schedule = GainSchedule([0., 35.], [3.6, 2.4])
+    self.assertEqual(schedule(10.), interp(10., [0., 35.], [3.6, 2.4]))
+    self.assertEqual(schedule(10.), interp(10., [0., 35.], [3.6, 2.4]))
+    self.assertEqual(schedule(20.), interp(20., [0., 35.], [3.6, 2.4]))
+    self.assertSameFloat(schedule(float('nan')), interp(float('nan'), [0., 35.], [3.6, 2.4]))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+import unittest
+import numpy as np
+from numpy.linalg import solve
+
+from cereal import car
+from selfdrive.controls.lib.vehicle_model import VehicleModel, create_dyn_state_matrices, calc_slip_factor
+
+
+def dyn_ss_sol_old(sa, u, VM):
+  A, B = create_dyn_state_matrices(u, VM)
+  return -solve(A, B) * sa
+
+
+def curvature_factor_old(VM, u):
+  sf = calc_slip_factor(VM)
+  return (1. - VM.chi) / (1. - sf * u**2) / VM.l
+
+
+def get_CP():
+  # honda civic
+  CP = car.CarParams.new_message()
+  CP.mass = 1326. + 136.
+  CP.wheelbase = 2.70
+  CP.centerToFront = CP.wheelbase * 0.4
+  CP.steerRatio = 15.38
+  CP.rotationalInertia = 2500. * CP.mass * CP.wheelbase**2 / (1500. * 2.70**2)
+  CP.tireStiffnessFront = 192150. * CP.mass / 1500. * (CP.wheelbase - CP.centerToFront) / CP.wheelbase / 0.52
+  CP.tireStiffnessRear = 202500. * CP.mass / 1500. * CP.centerToFront / CP.wheelbase / 0.48
+  return CP
+
+
+class TestVehicleModel(unittest.TestCase):
+  def setUp(self):
+    self.CP = get_CP()
+    self.rng = np.random.RandomState(0)
+
+  def test_matches_solver(self):
+    VM = VehicleModel(self.CP)
+    for _ in range(200):
+      VM.update_params(self.rng.uniform(0.5, 2.0), self.rng.uniform(10., 20.))
+      for u in self.rng.uniform(0.2, 40., 20).tolist() + [0.1 + 1e-9, 40.]:
+        sa = self.rng.uniform(-1., 1.)
+        np.testing.assert_allclose(VM.steady_state_sol(sa, u), dyn_ss_sol_old(sa, u, VM), rtol=1e-9, atol=1e-12)
+        self.assertAlmostEqual(VM.curvature_factor(u) / curvature_factor_old(VM, u), 1., places=9)
+
+  def test_cache_invalidated(self):
+    VM = VehicleModel(self.CP)
+    u, sa = 20., 0.1
+    VM.steady_state_sol(sa, u)
+    VM.curvature_factor(u)
+    VM.update_params(0.7, 13.)
+    np.testing.assert_allclose(VM.steady_state_sol(sa, u), dyn_ss_sol_old(sa, u, VM), rtol=1e-9)
+    self.assertAlmostEqual(VM.curvature_factor(u) / curvature_factor_old(VM, u), 1., places=9)
+
+  def test_lut(self):
+    VM = VehicleModel(self.CP, lut_speeds=np.arange(0., 40.01, 0.1))
+    VM.update_params(1.2, 15.)
+    for u in self.rng.uniform(0.2, 39.9, 1000):
+      sa = self.rng.uniform(-1., 1.)
+      np.testing.assert_allclose(VM.steady_state_sol(sa, u), dyn_ss_sol_old(sa, u, VM), rtol=1e-3, atol=1e-4)
+      self.assertAlmostEqual(VM.curvature_factor(u) / curvature_factor_old(VM, u), 1., places=5)
+    # outside of the table the closed form is used
+    np.testing.assert_allclose(VM.steady_state_sol(0.5, 45.), dyn_ss_sol_old(0.5, 45., VM), rtol=1e-9)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -6,7 +6,7 @@ import capnp
 from selfdrive.version import version, dirty, origin, branch
 
 from selfdrive.hardware import PC
-from selfdrive.swaglog import cloudlog
+from selfdrive.swaglog import cloudlog, log_handler
 
 if os.getenv("NOLOG") or os.getenv("NOCRASH") or PC:
   def capture_exception(*args, **kwargs):
@@ -35,7 +35,8 @@ else:
   def capture_exception(*args, **kwargs):
     exc_info = sys.exc_info()
     if not exc_info[0] is capnp.lib.capnp.KjException:
-      client.captureException(*args, **kwargs)
+      extra = dict(kwargs.pop('extra', {}), swaglog=log_handler.recent_records())
+      client.captureException(*args, extra=extra, **kwargs)
     cloudlog.error("crash", exc_info=kwargs.get('exc_info', 1))
 
   def bind_user(**kwargs):
@@ -40,12 +40,14 @@ if __name__ == "__main__":
 
     if sm.updated['logMessage']:
       t = sm.logMonoTime['logMessage']
-      try:
-        log = json.loads(sm['logMessage'])
-        if log['levelnum'] >= min_level:
-          print(f"[{t / 1e9:.6f}] {log['filename']}:{log.get('lineno', '')} - {log.get('funcname', '')}: {log['msg']}")
-      except json.decoder.JSONDecodeError:
-        print(f"[{t / 1e9:.6f}] decode error: {sm['logMessage']}")
+      # a batch of records, one per line
+      for line in sm['logMessage'].splitlines():
+        try:
+          log = json.loads(line)
+          if log['levelnum'] >= min_level:
+            print(f"[{t / 1e9:.6f}] {log['filename']}:{log.get('lineno', '')} - {log.get('funcname', '')}: {log['msg']}")
+        except json.decoder.JSONDecodeError:
+          print(f"[{t / 1e9:.6f}] decode error: {line}")
 
     if sm.updated['androidLog']:
       t = sm.logMonoTime['androidLog']
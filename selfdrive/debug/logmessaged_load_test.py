@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Floods logmessaged with records from many producer processes and reports what got through.
+It runs its own logmessaged on a temporary address but publishes logMessage, stop the running one first.
+
+  python selfdrive/debug/logmessaged_load_test.py --producers 16 --duration 10
+"""
+import argparse
+import json
+import multiprocessing
+import tempfile
+import threading
+import time
+
+import zmq
+
+import cereal.messaging as messaging
+from selfdrive.logmessaged import LogMessageForwarder
+
+# mostly debug and info, like a log storm
+LEVELS = [10] * 6 + [20] * 3 + [30, 40]
+
+
+def producer(addr, n, duration, rate, counts):
+  ctx = zmq.Context()
+  sock = ctx.socket(zmq.PUSH)
+  sock.setsockopt(zmq.LINGER, 100)
+  sock.connect(addr)
+
+  sent, dropped = [0] * 60, [0] * 60
+  i = 0
+  start = time.monotonic()
+  while time.monotonic() - start < duration:
+    levelnum = LEVELS[i % len(LEVELS)]
+    record = json.dumps({"msg": f"producer {n} record {i}", "levelnum": levelnum, "filename": "load", "lineno": n,
+                         "created": time.time()})
+    try:
+      sock.send(bytes([levelnum]) + record.encode('utf8'), zmq.NOBLOCK)
+      sent[levelnum] += 1
+    except zmq.error.Again:
+      dropped[levelnum] += 1
+    i += 1
+    if rate > 0:
+      time.sleep(max(0, start + i / rate - time.monotonic()))
+  sock.close()
+  ctx.term()
+  counts.put((sent, dropped))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--producers', type=int, default=8)
+  parser.add_argument('--duration', type=float, default=5.)
+  parser.add_argument('--rate', type=float, default=0., help="records per second per producer, 0 for as fast as possible")
+  parser.add_argument('--window', type=float, default=None, help="batch window in seconds")
+  parser.add_argument('--hwm', type=int, default=None, help="high water mark in records")
+  args = parser.parse_args()
+
+  addr = f"ipc://{tempfile.mkdtemp()}/logmessage"
+  kwargs = {k: v for k, v in (('window', args.window), ('high_water_mark', args.hwm)) if v is not None}
+  forwarder = LogMessageForwarder(messaging.pub_sock('logMessage'), addr=addr, **kwargs)
+  sub_sock = messaging.sub_sock('logMessage', timeout=100)
+
+  exit_event = threading.Event()
+  forwarder_thread = threading.Thread(target=forwarder.run, args=(exit_event,), daemon=True)
+  forwarder_thread.start()
+
+  counts = multiprocessing.Queue()
+  producers = [multiprocessing.Process(target=producer, args=(addr, n, args.duration, args.rate, counts))
+               for n in range(args.producers)]
+  start = time.monotonic()
+  for p in producers:
+    p.start()
+
+  published = [0] * 60
+  messages = 0
+
+  def count(msgs):
+    nonlocal messages
+    for msg in msgs:
+      messages += 1
+      for line in msg.logMessage.splitlines():
+        published[json.loads(line)['levelnum']] += 1
+
+  while any(p.is_alive() for p in producers):
+    count(messaging.drain_sock(sub_sock, wait_for_one=True))
+  # what's still in flight
+  end = time.monotonic() + 1
+  while time.monotonic() < end:
+    count(messaging.drain_sock(sub_sock, wait_for_one=True))
+  dt = time.monotonic() - start
+
+  exit_event.set()
+  forwarder_thread.join()
+  forwarder.close()
+
+  sent, producer_dropped = [0] * 60, [0] * 60
+  for _ in producers:
+    s, d = counts.get()
+    sent = [a + b for a, b in zip(sent, s)]
+    producer_dropped = [a + b for a, b in zip(producer_dropped, d)]
+  for p in producers:
+    p.join()
+
+  stats = forwarder.stats()
+  print(f"{args.producers} producers, {dt:.1f} s")
+  print(f"sent {sum(sent)}, dropped by producers {sum(producer_dropped)}")
+  print(f"received {stats['received']} ({stats['received'] / dt:.0f}/s), published {stats['published']} in {stats['batches']} batches"
+        f" ({stats['published'] / max(1, stats['batches']):.1f} per batch), {messages} logMessages seen")
+  print("level  sent  producer dropped  shed  published")
+  for levelnum in sorted(set(LEVELS)):
+    print(f"{levelnum:5d} {sent[levelnum]:5d} {producer_dropped[levelnum]:17d} {stats['dropped'].get(str(levelnum), 0):5d} {published[levelnum]:10d}")
+
+
+if __name__ == "__main__":
+  main()
@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import numpy as np
-import sympy as sp
 import cereal.messaging as messaging
 from cereal import log
 import common.transformations.coordinates as coord
@@ -17,9 +16,6 @@ from selfdrive.swaglog import cloudlog
 #from datetime import datetime
 #from laika.gps_time import GPSTime
 
-from sympy.utilities.lambdify import lambdify
-from rednose.helpers.sympy_helpers import euler_rotate
-
 SensorSource = log.SensorEventData.SensorSource
 
 
@@ -28,24 +24,26 @@ SENSOR_DECIMATION = 10
 POSENET_STD_HIST = 40
 
 
-def to_float(arr):
-  return [float(arr[0]), float(arr[1]), float(arr[2])]
-
-
-def get_H():
-  # this returns a function to eval the jacobian
-  # of the observation function of the local vel
-  roll = sp.Symbol('roll')
-  pitch = sp.Symbol('pitch')
-  yaw = sp.Symbol('yaw')
-  vx = sp.Symbol('vx')
-  vy = sp.Symbol('vy')
-  vz = sp.Symbol('vz')
-
-  h = euler_rotate(roll, pitch, yaw).T*(sp.Matrix([vx, vy, vz]))
-  H = h.jacobian(sp.Matrix([roll, pitch, yaw, vx, vy, vz]))
-  H_f = lambdify([roll, pitch, yaw, vx, vy, vz], H)
-  return H_f
+# orientation and velocity error states the device velocity jacobian is taken w.r.t.
+CONDENSED_IDXS = list(range(States.ECEF_ORIENTATION_ERR.start, States.ECEF_ORIENTATION_ERR.stop)) + \
+                 list(range(States.ECEF_VELOCITY_ERR.start, States.ECEF_VELOCITY_ERR.stop))
+
+# liveLocationKalman measurement fields, in the row order msg_from_state fills them
+MEASUREMENT_FIELDS = [
+  'positionGeodetic',
+  'positionECEF',
+  'velocityECEF',
+  'velocityNED',
+  'velocityDevice',
+  'accelerationDevice',
+  'orientationECEF',
+  'calibratedOrientationECEF',
+  'orientationNED',
+  'angularVelocityDevice',
+  'velocityCalibrated',
+  'angularVelocityCalibrated',
+  'accelerationCalibrated',
+]
 
 
 class Localizer():
@@ -61,7 +59,6 @@ class Localizer():
     self.device_from_calib = np.eye(3)
     self.calib_from_device = np.eye(3)
     self.calibrated = 0
-    self.H = get_H()
 
     self.posenet_invalid_count = 0
     self.posenet_speed = 0
@@ -79,73 +76,59 @@ class Localizer():
     predicted_std = np.sqrt(np.diagonal(predicted_cov))
 
     fix_ecef = predicted_state[States.ECEF_POS]
-    fix_ecef_std = predicted_std[States.ECEF_POS_ERR]
     vel_ecef = predicted_state[States.ECEF_VELOCITY]
-    vel_ecef_std = predicted_std[States.ECEF_VELOCITY_ERR]
     fix_pos_geo = coord.ecef2geodetic(fix_ecef)
-    #fix_pos_geo_std = np.abs(coord.ecef2geodetic(fix_ecef + fix_ecef_std) - fix_pos_geo)
     orientation_ecef = euler_from_quat(predicted_state[States.ECEF_ORIENTATION])
-    orientation_ecef_std = predicted_std[States.ECEF_ORIENTATION_ERR]
     device_from_ecef = rot_from_quat(predicted_state[States.ECEF_ORIENTATION]).T
     calibrated_orientation_ecef = euler_from_rot(calib_from_device.dot(device_from_ecef))
-
-    acc_calib = calib_from_device.dot(predicted_state[States.ACCELERATION])
-    acc_calib_std = np.sqrt(np.diagonal(calib_from_device.dot(
-      predicted_cov[States.ACCELERATION_ERR, States.ACCELERATION_ERR]).dot(
-        calib_from_device.T)))
-    ang_vel_calib = calib_from_device.dot(predicted_state[States.ANGULAR_VELOCITY])
-    ang_vel_calib_std = np.sqrt(np.diagonal(calib_from_device.dot(
-      predicted_cov[States.ANGULAR_VELOCITY_ERR, States.ANGULAR_VELOCITY_ERR]).dot(
-        calib_from_device.T)))
-
     vel_device = device_from_ecef.dot(vel_ecef)
-    device_from_ecef_eul = euler_from_quat(predicted_state[States.ECEF_ORIENTATION]).T
-    idxs = list(range(States.ECEF_ORIENTATION_ERR.start, States.ECEF_ORIENTATION_ERR.stop)) + \
-           list(range(States.ECEF_VELOCITY_ERR.start, States.ECEF_VELOCITY_ERR.stop))
-    condensed_cov = predicted_cov[idxs][:, idxs]
-    HH = H(*list(np.concatenate([device_from_ecef_eul, vel_ecef])))
+
+    # device velocity covariance from the generated jacobian
+    condensed_cov = predicted_cov[CONDENSED_IDXS][:, CONDENSED_IDXS]
+    HH = H(np.concatenate([orientation_ecef, vel_ecef]))
     vel_device_cov = HH.dot(condensed_cov).dot(HH.T)
-    vel_device_std = np.sqrt(np.diagonal(vel_device_cov))
 
-    vel_calib = calib_from_device.dot(vel_device)
-    vel_calib_std = np.sqrt(np.diagonal(calib_from_device.dot(
-      vel_device_cov).dot(calib_from_device.T)))
+    # velocity, angular velocity and acceleration rotated into the calibrated frame at once
+    device = np.empty((3, 3))
+    device[0] = vel_device
+    device[1] = predicted_state[States.ANGULAR_VELOCITY]
+    device[2] = predicted_state[States.ACCELERATION]
+    device_cov = np.empty((3, 3, 3))
+    device_cov[0] = vel_device_cov
+    device_cov[1] = predicted_cov[States.ANGULAR_VELOCITY_ERR, States.ANGULAR_VELOCITY_ERR]
+    device_cov[2] = predicted_cov[States.ACCELERATION_ERR, States.ACCELERATION_ERR]
+    calib = device.dot(calib_from_device.T)
+    calib_std = np.sqrt(np.diagonal(calib_from_device @ device_cov @ calib_from_device.T, axis1=1, axis2=2))
 
     orientation_ned = ned_euler_from_ecef(fix_ecef, orientation_ecef)
-    #orientation_ned_std = ned_euler_from_ecef(fix_ecef, orientation_ecef + orientation_ecef_std) - orientation_ned
-    ned_vel = converter.ecef2ned(fix_ecef + vel_ecef) - converter.ecef2ned(fix_ecef)
-    #ned_vel_std = self.converter.ecef2ned(fix_ecef + vel_ecef + vel_ecef_std) - self.converter.ecef2ned(fix_ecef + vel_ecef)
+    ned_vel = converter.ned_from_ecef_matrix.dot(vel_ecef)
+
+    # one row per measurement field, rows without a std are nan
+    values = np.empty((len(MEASUREMENT_FIELDS), 3))
+    stds = np.full((len(MEASUREMENT_FIELDS), 3), np.nan)
+    values[0] = fix_pos_geo
+    values[1], stds[1] = fix_ecef, predicted_std[States.ECEF_POS_ERR]
+    values[2], stds[2] = vel_ecef, predicted_std[States.ECEF_VELOCITY_ERR]
+    values[3] = ned_vel
+    values[4], stds[4] = vel_device, np.sqrt(np.diagonal(vel_device_cov))
+    values[5], stds[5] = predicted_state[States.ACCELERATION], predicted_std[States.ACCELERATION_ERR]
+    values[6], stds[6] = orientation_ecef, predicted_std[States.ECEF_ORIENTATION_ERR]
+    values[7] = calibrated_orientation_ecef
+    values[8] = orientation_ned
+    values[9], stds[9] = predicted_state[States.ANGULAR_VELOCITY], predicted_std[States.ANGULAR_VELOCITY_ERR]
+    values[10:13], stds[10:13] = calib, calib_std
 
     fix = messaging.log.LiveLocationKalman.new_message()
-
-    # write measurements to msg
-    measurements = [
-      # measurement field, value, std, valid
-      (fix.positionGeodetic, fix_pos_geo, np.nan*np.zeros(3), True),
-      (fix.positionECEF, fix_ecef, fix_ecef_std, True),
-      (fix.velocityECEF, vel_ecef, vel_ecef_std, True),
-      (fix.velocityNED, ned_vel, np.nan*np.zeros(3), True),
-      (fix.velocityDevice, vel_device, vel_device_std, True),
-      (fix.accelerationDevice, predicted_state[States.ACCELERATION], predicted_std[States.ACCELERATION_ERR], True),
-      (fix.orientationECEF, orientation_ecef, orientation_ecef_std, True),
-      (fix.calibratedOrientationECEF, calibrated_orientation_ecef, np.nan*np.zeros(3), True),
-      (fix.orientationNED, orientation_ned, np.nan*np.zeros(3), True),
-      (fix.angularVelocityDevice, predicted_state[States.ANGULAR_VELOCITY], predicted_std[States.ANGULAR_VELOCITY_ERR], True),
-      (fix.velocityCalibrated, vel_calib, vel_calib_std, True),
-      (fix.angularVelocityCalibrated, ang_vel_calib, ang_vel_calib_std, True),
-      (fix.accelerationCalibrated, acc_calib, acc_calib_std, True),
-    ]
-
-    for field, value, std, valid in measurements:
-      # TODO: can we write the lists faster?
-      field.value = to_float(value)
-      field.std = to_float(std)
-      field.valid = valid
+    for name, value, std in zip(MEASUREMENT_FIELDS, values.tolist(), stds.tolist()):
+      field = getattr(fix, name)
+      field.value = value
+      field.std = std
+      field.valid = True
 
     return fix
 
   def liveLocationMsg(self):
-    fix = self.msg_from_state(self.converter, self.calib_from_device, self.H, self.kf.x, self.kf.P)
+    fix = self.msg_from_state(self.converter, self.calib_from_device, self.kf.H_vel_device, self.kf.x, self.kf.P)
     # experimentally found these values, no false positives in 20k minutes of driving
     old_mean, new_mean = np.mean(self.posenet_stds[:POSENET_STD_HIST//2]), np.mean(self.posenet_stds[POSENET_STD_HIST//2:])
     std_spike = new_mean/old_mean > 4 and new_mean > 7
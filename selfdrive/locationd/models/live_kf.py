@@ -189,7 +189,14 @@ class LiveKalman():
                [h_phone_rot_sym, ObservationKind.CAMERA_ODO_ROTATION, None],
                [h_imu_frame_sym, ObservationKind.IMU_FRAME, None]]
 
-    gen_code(generated_dir, name, f_sym, dt, state_sym, obs_eqs, dim_state, dim_state_err, eskf_params)
+    # Jacobians of the derived quantities locationd publishes
+    ori_vel_sym = sp.MatrixSymbol('ori_vel', 6, 1)
+    ori_vel = sp.Matrix(ori_vel_sym)
+    h_vel_device = euler_rotate(*ori_vel[:3, 0]).T * ori_vel[3:, :]
+    extra_routines = [('H_vel_device', (h_vel_device, ori_vel_sym), [ori_vel_sym])]
+
+    gen_code(generated_dir, name, f_sym, dt, state_sym, obs_eqs, dim_state, dim_state_err, eskf_params,
+             extra_routines=extra_routines)
 
   def __init__(self, generated_dir):
     self.dim_state = self.initial_x.shape[0]
@@ -207,6 +214,7 @@ class LiveKalman():
 
     # init filter
     self.filter = EKF_sym(generated_dir, self.name, self.Q, self.initial_x, np.diag(self.initial_P_diag), self.dim_state, self.dim_state_err, max_rewind_age=0.2)
+    self._H_vel_device = self.filter.extra_routine('H_vel_device')
 
   @property
   def x(self):
@@ -220,9 +228,19 @@ class LiveKalman():
   def P(self):
     return self.filter.covs()
 
+  def H_vel_device(self, ori_vel):
+    """Jacobian of the device frame velocity w.r.t. the ECEF euler orientation and ECEF velocity"""
+    H = np.zeros((3, 6))
+    self._H_vel_device(np.ascontiguousarray(ori_vel, dtype=np.float64), H)
+    return H
+
   def rts_smooth(self, estimates):
     return self.filter.rts_smooth(estimates, norm_quats=True)
 
+  def smooth_log(self, observations):
+    """Filters a whole log of (t, kind, meas) observations offline and smooths the estimates"""
+    return self.filter.smooth_log(observations, norm_quats=True, observe=self.predict_and_observe)
+
   def init_state(self, state, covs_diag=None, covs=None, filter_time=None):
     if covs_diag is not None:
       P = np.diag(covs_diag)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import numpy as np
+import sympy as sp
+from sympy.utilities.lambdify import lambdify
+
+import common.transformations.coordinates as coord
+from common.transformations.orientation import euler_from_quat, euler_from_rot, ned_euler_from_ecef, \
+                                               quat_from_euler, rot_from_euler, rot_from_quat
+from rednose.helpers.sympy_helpers import euler_rotate
+from selfdrive.locationd.locationd import Localizer
+from selfdrive.locationd.models.live_kf import LiveKalman, States
+
+
+def get_H():
+  # the lambdified jacobian locationd used before it was generated with the filter
+  roll, pitch, yaw, vx, vy, vz = sp.symbols('roll pitch yaw vx vy vz')
+  h = euler_rotate(roll, pitch, yaw).T*(sp.Matrix([vx, vy, vz]))
+  H = h.jacobian(sp.Matrix([roll, pitch, yaw, vx, vy, vz]))
+  return lambdify([roll, pitch, yaw, vx, vy, vz], H)
+
+
+def old_measurements(converter, calib_from_device, H, predicted_state, predicted_cov):
+  """Field -> (value, std) the way msg_from_state computed them with numpy before"""
+  predicted_std = np.sqrt(np.diagonal(predicted_cov))
+  nan = np.nan*np.zeros(3)
+
+  fix_ecef = predicted_state[States.ECEF_POS]
+  vel_ecef = predicted_state[States.ECEF_VELOCITY]
+  orientation_ecef = euler_from_quat(predicted_state[States.ECEF_ORIENTATION])
+  device_from_ecef = rot_from_quat(predicted_state[States.ECEF_ORIENTATION]).T
+
+  def calibrated(value, cov):
+    return calib_from_device.dot(value), np.sqrt(np.diagonal(calib_from_device.dot(cov).dot(calib_from_device.T)))
+
+  vel_device = device_from_ecef.dot(vel_ecef)
+  idxs = list(range(States.ECEF_ORIENTATION_ERR.start, States.ECEF_ORIENTATION_ERR.stop)) + \
+         list(range(States.ECEF_VELOCITY_ERR.start, States.ECEF_VELOCITY_ERR.stop))
+  condensed_cov = predicted_cov[idxs][:, idxs]
+  HH = H(*list(np.concatenate([orientation_ecef, vel_ecef])))
+  vel_device_cov = HH.dot(condensed_cov).dot(HH.T)
+
+  return {
+    'positionGeodetic': (coord.ecef2geodetic(fix_ecef), nan),
+    'positionECEF': (fix_ecef, predicted_std[States.ECEF_POS_ERR]),
+    'velocityECEF': (vel_ecef, predicted_std[States.ECEF_VELOCITY_ERR]),
+    'velocityNED': (converter.ecef2ned(fix_ecef + vel_ecef) - converter.ecef2ned(fix_ecef), nan),
+    'velocityDevice': (vel_device, np.sqrt(np.diagonal(vel_device_cov))),
+    'accelerationDevice': (predicted_state[States.ACCELERATION], predicted_std[States.ACCELERATION_ERR]),
+    'orientationECEF': (orientation_ecef, predicted_std[States.ECEF_ORIENTATION_ERR]),
+    'calibratedOrientationECEF': (euler_from_rot(calib_from_device.dot(device_from_ecef)), nan),
+    'orientationNED': (ned_euler_from_ecef(fix_ecef, orientation_ecef), nan),
+    'angularVelocityDevice': (predicted_state[States.ANGULAR_VELOCITY], predicted_std[States.ANGULAR_VELOCITY_ERR]),
+    'velocityCalibrated': calibrated(vel_device, vel_device_cov),
+    'angularVelocityCalibrated': calibrated(predicted_state[States.ANGULAR_VELOCITY],
+                                            predicted_cov[States.ANGULAR_VELOCITY_ERR, States.ANGULAR_VELOCITY_ERR]),
+    'accelerationCalibrated': calibrated(predicted_state[States.ACCELERATION],
+                                         predicted_cov[States.ACCELERATION_ERR, States.ACCELERATION_ERR]),
+  }
+
+
+def random_state(rng):
+  state = LiveKalman.initial_x.astype(np.float64)
+  state[States.ECEF_POS] = coord.geodetic2ecef([rng.uniform(-80, 80), rng.uniform(-180, 180), rng.uniform(0, 1000)])
+  state[States.ECEF_ORIENTATION] = quat_from_euler(rng.uniform(-np.pi / 2, np.pi / 2, 3))
+  state[States.ECEF_VELOCITY] = rng.normal(0, 20, 3)
+  state[States.ANGULAR_VELOCITY] = rng.normal(0, 0.5, 3)
+  state[States.ACCELERATION] = rng.normal(0, 2, 3)
+
+  dim_err = LiveKalman.initial_P_diag.shape[0]
+  A = rng.normal(0, 0.1, (dim_err, dim_err))
+  return state, A.dot(A.T) + 1e-3 * np.eye(dim_err)
+
+
+class TestLocationd(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    if shutil.which('g++') is None:
+      raise unittest.SkipTest("no compiler")
+    cls.generated_dir = tempfile.mkdtemp()
+    LiveKalman.generate_code(cls.generated_dir)
+    subprocess.check_call(['g++', '-O2', '-shared', '-fPIC', '-o', os.path.join(cls.generated_dir, f'lib{LiveKalman.name}.so'),
+                           os.path.join(cls.generated_dir, f'{LiveKalman.name}.cpp')])
+    cls.kf = LiveKalman(cls.generated_dir)
+    cls.H = staticmethod(get_H())
+
+  @classmethod
+  def tearDownClass(cls):
+    shutil.rmtree(cls.generated_dir)
+
+  def test_H_vel_device(self):
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+      ori_vel = np.concatenate([rng.uniform(-np.pi, np.pi, 3), rng.normal(0, 20, 3)])
+      np.testing.assert_allclose(self.kf.H_vel_device(ori_vel), self.H(*ori_vel), rtol=1e-9, atol=1e-9)
+
+  def test_msg_from_state(self):
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+      state, cov = random_state(rng)
+      converter = coord.LocalCoord.from_ecef(state[States.ECEF_POS] + rng.normal(0, 100, 3))
+      calib_from_device = rot_from_euler(rng.uniform(-0.1, 0.1, 3))
+
+      fix = Localizer.msg_from_state(converter, calib_from_device, self.kf.H_vel_device, state, cov)
+      for name, (value, std) in old_measurements(converter, calib_from_device, self.H, state, cov).items():
+        field = getattr(fix, name)
+        self.assertTrue(field.valid)
+        np.testing.assert_allclose(list(field.value), value, rtol=1e-7, atol=1e-6, err_msg=name)
+        np.testing.assert_allclose(list(field.std), std, rtol=1e-7, atol=1e-9, err_msg=name)
+
+
+if __name__ == "__main__":
+  unittest.main()
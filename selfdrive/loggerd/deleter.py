@@ -1,38 +1,71 @@
 #!/usr/bin/env python3
 import os
-import shutil
+import sqlite3
 import threading
 from selfdrive.swaglog import cloudlog
-from selfdrive.loggerd.config import ROOT, get_available_bytes, get_available_percent
-from selfdrive.loggerd.uploader import listdir_by_creation
+from selfdrive.loggerd.config import ROOT
+from selfdrive.loggerd.eviction import SegmentIndex
+from selfdrive.loggerd.upload_state import UploadState
 
 MIN_BYTES = 5 * 1024 * 1024 * 1024
 MIN_PERCENT = 10
+# freed on top of what's missing, so there's room for the next few segments
+HEADROOM_BYTES = 512 * 1024 * 1024
+CHECK_INTERVAL = 1.
+
+
+def bytes_needed(root=ROOT):
+  """Bytes to free to get back above both floors, 0 when there's enough space"""
+  try:
+    statvfs = os.statvfs(root)
+  except OSError:
+    return 0
+  available = statvfs.f_bavail * statvfs.f_frsize
+  total = statvfs.f_blocks * statvfs.f_frsize
+  missing = max(MIN_BYTES - available, total * MIN_PERCENT // 100 - available)
+  return missing + HEADROOM_BYTES if missing > 0 else 0
 
 
 def deleter_thread(exit_event):
+  index = SegmentIndex(ROOT)
+  try:
+    state = UploadState()
+  except sqlite3.Error:
+    cloudlog.exception("deleter: upload state unavailable")
+    state = None
+
+  def is_uploaded(key):
+    try:
+      return state is not None and state.is_uploaded(key)
+    except sqlite3.Error:
+      return False
+
+  def on_delete(key):
+    cloudlog.info("deleting %s" % os.path.join(ROOT, key))
+    if state is not None:
+      try:
+        state.remove(key, autocommit=False)
+      except sqlite3.Error:
+        pass
+
   while not exit_event.is_set():
-    out_of_bytes = get_available_bytes(default=MIN_BYTES + 1) < MIN_BYTES
-    out_of_percent = get_available_percent(default=MIN_PERCENT + 1) < MIN_PERCENT
-
-    if out_of_percent or out_of_bytes:
-      # remove the earliest directory we can
-      dirs = listdir_by_creation(ROOT)
-      for delete_dir in dirs:
-        delete_path = os.path.join(ROOT, delete_dir)
-
-        if any(name.endswith(".lock") for name in os.listdir(delete_path)):
-          continue
-
-        try:
-          cloudlog.info("deleting %s" % delete_path)
-          shutil.rmtree(delete_path)
-          break
-        except OSError:
-          cloudlog.exception("issue deleting %s" % delete_path)
-      exit_event.wait(.1)
-    else:
-      exit_event.wait(30)
+    # only new segments and the ones being written are scanned, so it's ready when space runs out
+    index.refresh()
+    needed = bytes_needed()
+    if needed > 0:
+      files, planned = index.plan(needed, is_uploaded)
+      freed = index.evict(files, on_delete)
+      try:
+        if state is not None:
+          state.commit()
+      except sqlite3.Error:
+        cloudlog.exception("deleter: upload state commit failed")
+      cloudlog.event("deleter_evicted", needed=needed, planned=planned, freed=freed, files=len(files))
+      if freed == 0:
+        # nothing left that may be deleted
+        exit_event.wait(30)
+        continue
+    exit_event.wait(CHECK_INTERVAL)
 
 
 def main():
@@ -0,0 +1,187 @@
+import bisect
+import errno
+import os
+import threading
+from itertools import chain, islice, takewhile
+
+from common.inotify import (IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_IGNORED, IN_ISDIR, IN_MOVED_FROM, IN_MOVED_TO,
+                            IN_Q_OVERFLOW, Inotify)
+
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_CLOSE_WRITE
+
+MAX_PAGE_SIZE = 1000
+
+
+def file_size(path):
+  try:
+    return os.stat(path).st_size
+  except OSError:
+    return None
+
+
+class DirectoryIndex():
+  """Files under root and their sizes, two levels deep like the segment directories.
+
+  Root is scanned once, after that the index follows inotify events on root and on every
+  segment directory, applied when the index is next read. A size is read again when its
+  file is closed after writing. Without inotify, or when out of watches, every read
+  rescans root."""
+  def __init__(self, root):
+    self.root = root
+    self.lock = threading.Lock()
+    self.segments = {}  # segment -> {name: size}, '' for files directly in root
+    self.order = []  # sorted segment names
+
+    self.wds = {}  # watch descriptor -> segment, None for root
+    self.root_wd = None
+    try:
+      self.inotify = Inotify()
+    except OSError:
+      self.inotify = None
+
+    self.seed()
+
+  def seed(self):
+    self.segments, self.order = {}, []
+    if self.inotify is not None:
+      for wd in list(self.wds):
+        self.inotify.rm_watch(wd)
+      self.wds, self.root_wd = {}, None
+
+    if not os.path.isdir(self.root):
+      return
+    if self.inotify is not None:
+      self.root_wd = self.watch(self.root, None)
+
+    try:
+      entries = list(os.scandir(self.root))
+    except OSError:
+      entries = []
+    for entry in entries:
+      if entry.is_dir(follow_symlinks=False):
+        self.add_dir(entry.name)
+      else:
+        self.add_file('', entry.name)
+
+  def watch(self, path, segment):
+    if self.inotify is None:
+      return None
+    try:
+      wd = self.inotify.add_watch(path, WATCH_MASK)
+    except OSError as e:
+      if e.errno == errno.ENOSPC:
+        # out of watches, fall back to rescanning
+        self.close()
+      return None
+    self.wds[wd] = segment
+    return wd
+
+  def add_dir(self, segment):
+    path = os.path.join(self.root, segment)
+    # watched before listing it, so files created in between aren't missed
+    self.watch(path, segment)
+    files = self.files(segment)
+    try:
+      with os.scandir(path) as it:
+        for entry in it:
+          try:
+            files[entry.name] = entry.stat(follow_symlinks=False).st_size
+          except OSError:
+            pass
+    except OSError:
+      pass
+
+  def files(self, segment):
+    files = self.segments.get(segment)
+    if files is None:
+      files = self.segments[segment] = {}
+      bisect.insort(self.order, segment)
+    return files
+
+  def add_file(self, segment, name):
+    size = file_size(os.path.join(self.root, segment, name))
+    if size is not None:
+      self.files(segment)[name] = size
+
+  def remove_file(self, segment, name):
+    self.segments.get(segment, {}).pop(name, None)
+
+  def remove_dir(self, segment):
+    if self.segments.pop(segment, None) is not None:
+      del self.order[bisect.bisect_left(self.order, segment)]
+
+  def process_events(self):
+    while True:
+      events = self.inotify.read_events()
+      if not events:
+        return
+      for wd, mask, name in events:
+        if mask & IN_Q_OVERFLOW:
+          self.seed()
+          return
+        if mask & IN_IGNORED:
+          self.wds.pop(wd, None)
+          if wd == self.root_wd:
+            self.root_wd = None
+          continue
+        if wd not in self.wds:
+          continue
+
+        segment = self.wds[wd]
+        if segment is None and mask & IN_ISDIR:
+          if mask & (IN_CREATE | IN_MOVED_TO):
+            self.add_dir(name)
+          elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self.remove_dir(name)
+          continue
+
+        if mask & IN_ISDIR:
+          continue
+        segment = segment or ''
+        if mask & (IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE):
+          self.add_file(segment, name)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+          self.remove_file(segment, name)
+
+  def update(self):
+    if self.inotify is None or self.root_wd is None:
+      self.seed()
+    else:
+      self.process_events()
+
+  def segments_from(self, prefix, after):
+    """Segments that can have keys starting with prefix, from the one of after on"""
+    if '/' in prefix:
+      segment = prefix.split('/', 1)[0]
+      return [segment] if segment in self.segments and segment >= after else []
+    # files directly in root sort first
+    root = [''] if prefix and '' in self.segments and after == '' else []
+    i = bisect.bisect_left(self.order, max(prefix, after))
+    return chain(root, takewhile(lambda s: s.startswith(prefix), islice(self.order, i, None)))
+
+  def list(self, prefix='', after=None, limit=None):
+    """(key, size) of the files whose key starts with prefix, in segment and name order,
+    starting after the key after. At most limit of them"""
+    with self.lock:
+      self.update()
+      after_segment, after_name = os.path.split(after) if after is not None else ('', None)
+
+      out = []
+      for segment in self.segments_from(prefix, after_segment):
+        files = self.segments[segment]
+        for name in sorted(files):
+          if segment == after_segment and after_name is not None and name <= after_name:
+            continue
+          key = os.path.join(segment, name)
+          if not key.startswith(prefix):
+            continue
+          if limit is not None and len(out) >= limit:
+            return out
+          out.append((key, files[name]))
+      return out
+
+  def close(self):
+    if self.inotify is not None:
+      self.inotify.close()
+      self.inotify = None
+      self.wds, self.root_wd = {}, None
@@ -0,0 +1,168 @@
+import os
+import shutil
+import time
+from collections import namedtuple
+
+from common.xattr import getxattr
+from selfdrive.loggerd.upload_queue import get_directory_sort
+
+# set on a segment directory to keep it from being deleted
+PRESERVE_ATTR_NAME = 'user.preserve'
+PRESERVE_ATTR_VALUE = b'1'
+
+CAMERA_FILES = {"fcamera.hevc", "dcamera.hevc", "ecamera.hevc"}
+
+# a rule matches files by upload status and name, None matches any
+EvictionRule = namedtuple('EvictionRule', ['uploaded', 'names'])
+
+# files are evicted in the order of the first rule they match, oldest segment first within a rule
+# and largest file first within a segment. what is on the server already goes first, then the
+# large camera files, the logs last
+DEFAULT_POLICY = [
+  EvictionRule(uploaded=True, names=CAMERA_FILES),
+  EvictionRule(uploaded=True, names=None),
+  EvictionRule(uploaded=False, names=CAMERA_FILES),
+  EvictionRule(uploaded=False, names=None),
+]
+
+# a directory changed this soon after its scan may have changed within one mtime tick
+MTIME_SLACK_NS = 1000000000
+
+Candidate = namedtuple('Candidate', ['rank', 'dir_sort', 'segment', 'name', 'size'])
+
+
+def is_preserved(path):
+  try:
+    return getxattr(path, PRESERVE_ATTR_NAME) == PRESERVE_ATTR_VALUE
+  except OSError:
+    return False
+
+
+class Segment():
+  __slots__ = ('files', 'locked', 'preserved', 'mtime', 'scanned')
+
+  def __init__(self, files, locked, preserved, mtime, scanned):
+    self.files = files  # name -> bytes allocated on disk
+    self.locked = locked
+    self.preserved = preserved
+    self.mtime = mtime  # of the directory before the scan, ns
+    self.scanned = scanned  # ns
+
+  def stale(self, mtime):
+    return self.locked or mtime != self.mtime or self.scanned - self.mtime < MTIME_SLACK_NS
+
+
+class SegmentIndex():
+  def __init__(self, root, policy=DEFAULT_POLICY):
+    """Sizes of the files under root per segment, and the order to evict them in.
+
+    A segment's files are stat'ed once it's done. On refresh new segments, those still
+    being written and those with files added or removed since are scanned again."""
+    self.root = root
+    self.policy = policy
+    self.segments = {}
+
+  def scan_segment(self, segment, mtime):
+    path = os.path.join(self.root, segment)
+    files, locked = {}, False
+    scanned = time.time_ns()
+    try:
+      with os.scandir(path) as it:
+        for entry in it:
+          if entry.name.endswith('.lock'):
+            locked = True
+            continue
+          try:
+            files[entry.name] = entry.stat(follow_symlinks=False).st_blocks * 512
+          except OSError:
+            pass
+    except OSError:
+      return None
+    return Segment(files, locked, is_preserved(path), mtime, scanned)
+
+  def refresh(self):
+    try:
+      names = set(os.listdir(self.root))
+    except OSError:
+      names = set()
+
+    for segment in list(self.segments):
+      if segment not in names:
+        del self.segments[segment]
+    for segment in names:
+      try:
+        mtime = os.stat(os.path.join(self.root, segment)).st_mtime_ns
+      except OSError:
+        self.segments.pop(segment, None)
+        continue
+      s = self.segments.get(segment)
+      # a segment seen between its mkdir and the first lock looks done, it's
+      # looked at again once files show up
+      if s is None or s.stale(mtime):
+        s = self.scan_segment(segment, mtime)
+        if s is not None:
+          self.segments[segment] = s
+
+  def total_bytes(self):
+    return sum(sum(s.files.values()) for s in self.segments.values())
+
+  def rank(self, name, uploaded):
+    for i, rule in enumerate(self.policy):
+      if rule.uploaded is not None and rule.uploaded != uploaded:
+        continue
+      if rule.names is not None and name not in rule.names:
+        continue
+      return i
+    return None
+
+  def candidates(self, is_uploaded):
+    """Files that may be evicted, in eviction order"""
+    out = []
+    for segment, s in self.segments.items():
+      if s.locked or s.preserved:
+        continue
+      dir_sort = get_directory_sort(segment)
+      for name, size in s.files.items():
+        rank = self.rank(name, is_uploaded(os.path.join(segment, name)))
+        if rank is not None:
+          out.append(Candidate(rank, dir_sort, segment, name, size))
+    out.sort(key=lambda c: (c.rank, c.dir_sort, -c.size, c.name))
+    return out
+
+  def plan(self, needed, is_uploaded):
+    """The first files in eviction order that add up to needed bytes"""
+    files, freed = [], 0
+    for c in self.candidates(is_uploaded):
+      if freed >= needed:
+        break
+      files.append(c)
+      freed += c.size
+    return files, freed
+
+  def evict(self, files, on_delete=None):
+    """Deletes the planned files, segments left empty are removed. Returns bytes freed"""
+    freed = 0
+    for c in files:
+      s = self.segments.get(c.segment)
+      if s is None or c.name not in s.files:
+        continue
+      path = os.path.join(self.root, c.segment)
+      # marked while the plan was made
+      if s.preserved or is_preserved(path):
+        s.preserved = True
+        continue
+
+      try:
+        os.unlink(os.path.join(path, c.name))
+      except FileNotFoundError:
+        pass
+      except OSError:
+        continue
+      freed += s.files.pop(c.name)
+      if on_delete is not None:
+        on_delete(os.path.join(c.segment, c.name))
+
+      if not s.files:
+        shutil.rmtree(path, ignore_errors=True)
+        del self.segments[c.segment]
+    return freed
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from selfdrive.loggerd.directory_index import DirectoryIndex
+
+SEGMENT_FILES = ["rlog.bz2", "qlog.bz2", "fcamera.hevc"]
+
+
+def walk(root, prefix=''):
+  """The full walk the index replaced"""
+  files = []
+  for dp, _, fn in os.walk(root):
+    for f in fn:
+      fn = os.path.join(dp, f)
+      key = os.path.relpath(fn, root)
+      if key.startswith(prefix):
+        files.append((key, os.path.getsize(fn)))
+  return sorted(files, key=lambda f: os.path.split(f[0]))
+
+
+class TestDirectoryIndex(unittest.TestCase):
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.root)
+
+  def index(self):
+    index = DirectoryIndex(self.root)
+    self.addCleanup(index.close)
+    return index
+
+  def write(self, key, size=16):
+    fn = os.path.join(self.root, key)
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    with open(fn, 'wb') as f:
+      f.write(b'\0' * size)
+
+  def make_segment(self, logname):
+    for name in SEGMENT_FILES:
+      self.write(os.path.join(logname, name))
+
+  def test_follows_changes(self):
+    for i in range(3):
+      self.make_segment(f"2020-01-01--10-00-00--{i}")
+    self.write("boot")
+    index = self.index()
+    self.assertEqual(index.list(), walk(self.root))
+
+    # written after it was created, sizes are read again once closed
+    self.write("2020-01-01--10-00-00--3/rlog.bz2", 10)
+    self.write("2020-01-01--10-00-00--3/rlog.bz2", 1000)
+    self.write("2020-01-01--10-00-00--0/qlog.bz2", 100)
+    os.unlink(os.path.join(self.root, "2020-01-01--10-00-00--1/fcamera.hevc"))
+    shutil.rmtree(os.path.join(self.root, "2020-01-01--10-00-00--2"))
+    os.rename(os.path.join(self.root, "boot"), os.path.join(self.root, "2020-01-01--10-00-00--0/boot"))
+    self.assertEqual(index.list(), walk(self.root))
+
+  def test_pages(self):
+    for i in range(12):
+      self.make_segment(f"2020-01-0{i % 3 + 1}--10-00-00--{i}")
+    self.write("boot")
+    index = self.index()
+
+    for prefix in ('', '2020-01-02', '2020-01-02--10-00-00--1', '2020-01-02--10-00-00--1/', '2020-01-03--10-00-00--2/q', 'b', 'x'):
+      for limit in (1, 2, 5, 1000):
+        files, after = [], None
+        while True:
+          page = index.list(prefix, after, limit)
+          self.assertLessEqual(len(page), limit)
+          files += page
+          if len(page) < limit:
+            break
+          after = page[-1][0]
+        self.assertEqual(files, walk(self.root, prefix), (prefix, limit))
+
+  def test_without_inotify(self):
+    index = self.index()
+    index.close()
+    self.make_segment("2020-01-01--10-00-00--0")
+    self.assertEqual(index.list(), walk(self.root))
+    os.unlink(os.path.join(self.root, "2020-01-01--10-00-00--0/rlog.bz2"))
+    self.assertEqual(index.list(), walk(self.root))
+
+  def test_randomized(self):
+    index = self.index()
+    segments = []
+    for n in range(300):
+      action = random.random()
+      if action < 0.4 or not segments:
+        segments.append(f"2020-01-01--10-00-00--{n}")
+        self.make_segment(segments[-1])
+      elif action < 0.6:
+        self.write(os.path.join(random.choice(segments), random.choice(SEGMENT_FILES)), random.randint(0, 100))
+      elif action < 0.8:
+        fn = os.path.join(self.root, random.choice(segments), random.choice(SEGMENT_FILES))
+        if os.path.exists(fn):
+          os.unlink(fn)
+      else:
+        shutil.rmtree(os.path.join(self.root, segments.pop(random.randrange(len(segments)))))
+      if n % 10 == 0:
+        self.assertEqual(index.list(), walk(self.root))
+    self.assertEqual(index.list(), walk(self.root))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from common.xattr import setxattr
+from selfdrive.loggerd.eviction import MTIME_SLACK_NS, PRESERVE_ATTR_NAME, PRESERVE_ATTR_VALUE, SegmentIndex
+
+MB = 1024 * 1024
+SIZES = {"fcamera.hevc": 8 * MB, "dcamera.hevc": 4 * MB, "rlog.bz2": 2 * MB, "qcamera.ts": MB // 2, "qlog.bz2": MB // 8}
+
+
+class TestEviction(unittest.TestCase):
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.root)
+    self.uploaded = set()
+    for route in ("2020-01-01--10-00-00", "2020-01-02--10-00-00"):
+      for seg in range(3):
+        self.make_segment(f"{route}--{seg}")
+
+  def make_segment(self, segment, locked=False):
+    path = os.path.join(self.root, segment)
+    os.mkdir(path)
+    for name, size in SIZES.items():
+      with open(os.path.join(path, name), 'wb') as f:
+        f.write(b'\1' * size)
+    if locked:
+      open(os.path.join(path, "rlog.bz2.lock"), 'w').close()
+
+  def index(self):
+    index = SegmentIndex(self.root)
+    index.refresh()
+    return index
+
+  def plan(self, index, needed):
+    files, freed = index.plan(needed, lambda key: key in self.uploaded)
+    return [os.path.join(c.segment, c.name) for c in files], freed
+
+  def test_sizes(self):
+    index = self.index()
+    self.assertGreaterEqual(index.total_bytes(), 6 * sum(SIZES.values()))
+    self.make_segment("2020-01-02--10-00-00--3", locked=True)
+    index.refresh()
+    self.assertTrue(index.segments["2020-01-02--10-00-00--3"].locked)
+    shutil.rmtree(os.path.join(self.root, "2020-01-01--10-00-00--0"))
+    index.refresh()
+    self.assertNotIn("2020-01-01--10-00-00--0", index.segments)
+
+  def test_new_segment(self):
+    index = self.index()
+    # seen before loggerd created its files
+    segment = "2020-01-02--10-00-00--3"
+    os.mkdir(os.path.join(self.root, segment))
+    index.refresh()
+    self.assertEqual(index.segments[segment].files, {})
+
+    # the directory changed, it's scanned again
+    index.segments[segment].scanned -= 2 * MTIME_SLACK_NS
+    with open(os.path.join(self.root, segment, "rlog.bz2"), 'wb') as f:
+      f.write(b'\1' * MB)
+    os.utime(os.path.join(self.root, segment), ns=(0, index.segments[segment].mtime + 1))
+    index.refresh()
+    self.assertEqual(list(index.segments[segment].files), ["rlog.bz2"])
+
+    # unchanged for a while, not scanned again
+    for s in index.segments.values():
+      s.scanned += 2 * MTIME_SLACK_NS
+    with mock.patch.object(index, 'scan_segment', side_effect=AssertionError("scanned")):
+      index.refresh()
+
+  def test_order(self):
+    self.uploaded = {"2020-01-02--10-00-00--1/fcamera.hevc", "2020-01-02--10-00-00--1/rlog.bz2"}
+    index = self.index()
+    keys, freed = self.plan(index, 1)
+    self.assertEqual(keys, ["2020-01-02--10-00-00--1/fcamera.hevc"])
+
+    keys, _ = self.plan(index, 8 * MB + 1)
+    self.assertEqual(keys, ["2020-01-02--10-00-00--1/fcamera.hevc", "2020-01-02--10-00-00--1/rlog.bz2"])
+
+    # then the camera files of the oldest segment not uploaded, largest first, all before any log
+    keys, _ = self.plan(index, 10 * MB + 1)
+    self.assertEqual(keys[2:], ["2020-01-01--10-00-00--0/fcamera.hevc"])
+    keys, _ = self.plan(index, 1000 * MB)
+    logs = [i for i, k in enumerate(keys) if not k.endswith('camera.hevc')]
+    cameras = [i for i, k in enumerate(keys) if k.endswith('camera.hevc')]
+    self.assertLess(max(cameras), min(logs[1:]))
+    self.assertEqual(keys[-1], "2020-01-02--10-00-00--2/qlog.bz2")
+    self.assertEqual(len(keys), 6 * len(SIZES))
+
+  def test_protected(self):
+    self.make_segment("2020-01-03--10-00-00--0", locked=True)
+    setxattr(os.path.join(self.root, "2020-01-01--10-00-00--0"), PRESERVE_ATTR_NAME, PRESERVE_ATTR_VALUE)
+    index = self.index()
+    keys, _ = self.plan(index, 1000 * MB)
+    self.assertFalse(any(k.startswith("2020-01-01--10-00-00--0/") or k.startswith("2020-01-03") for k in keys))
+
+    # preserved after the index saw it
+    setxattr(os.path.join(self.root, "2020-01-01--10-00-00--1"), PRESERVE_ATTR_NAME, PRESERVE_ATTR_VALUE)
+    files, _ = index.plan(1000 * MB, lambda key: False)
+    index.evict(files)
+    self.assertEqual(sorted(os.listdir(self.root)), ["2020-01-01--10-00-00--0", "2020-01-01--10-00-00--1", "2020-01-03--10-00-00--0"])
+
+  def test_one_pass(self):
+    index = self.index()
+    deleted = []
+    needed = 30 * MB
+    files, planned = index.plan(needed, lambda key: False)
+    freed = index.evict(files, deleted.append)
+    self.assertEqual(freed, planned)
+    self.assertGreaterEqual(freed, needed)
+    self.assertEqual(deleted, [os.path.join(c.segment, c.name) for c in files])
+    for key in deleted:
+      self.assertFalse(os.path.exists(os.path.join(self.root, key)))
+
+    # whole segments go once nothing is left in them
+    files, _ = index.plan(1000 * MB, lambda key: False)
+    index.evict(files)
+    self.assertEqual(os.listdir(self.root), [])
+    self.assertEqual(index.segments, {})
+
+
+if __name__ == "__main__":
+  unittest.main()
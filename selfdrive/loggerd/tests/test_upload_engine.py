@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from selfdrive.loggerd.upload_engine import UploadCancelled, UploadEngine
+
+CHUNK_SIZE = 64 * 1024
+
+
+class BlobHandler(BaseHTTPRequestHandler):
+  """Stand-in for Azure blob storage: plain PUTs, Put Block and Put Block List"""
+  protocol_version = 'HTTP/1.1'
+
+  def setup(self):
+    super().setup()
+    with self.server.lock:
+      self.server.connections += 1
+
+  def log_message(self, *args):
+    pass
+
+  def respond(self, status):
+    self.send_response(status)
+    self.send_header('Content-Length', '0')
+    self.end_headers()
+
+  def do_PUT(self):
+    u = urlsplit(self.path)
+    query = parse_qs(u.query)
+    size = int(self.headers['Content-Length'])
+
+    with self.server.lock:
+      self.server.requests.append((u.path, query.get('comp', [None])[0], query.get('blockid', [None])[0], query.get('sig', [None])[0]))
+      self.server.in_flight += 1
+      self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+      action = self.server.failures.pop(0) if self.server.failures else None
+    try:
+      if action == 'drop':
+        # connection lost halfway through the body
+        self.rfile.read(size // 2)
+        self.close_connection = True
+        return
+      body = self.rfile.read(size)
+      if len(body) < size:
+        # the client gave up on this request
+        self.close_connection = True
+        return
+      time.sleep(self.server.delay)
+      if action is not None:
+        self.respond(action)
+        return
+
+      with self.server.lock:
+        if 'comp' not in query:
+          self.server.blobs[u.path] = body
+          self.server.headers[u.path] = dict(self.headers)
+        elif query['comp'] == ['block']:
+          self.server.blocks.setdefault(u.path, {})[query['blockid'][0]] = body
+        elif query['comp'] == ['blocklist']:
+          blocks = self.server.blocks.pop(u.path, {})
+          ids = re.findall(r'<Latest>(.*?)</Latest>', body.decode())
+          if not all(i in blocks for i in ids):
+            self.respond(400)
+            return
+          self.server.blobs[u.path] = b''.join(blocks[i] for i in ids)
+      self.respond(201)
+    finally:
+      with self.server.lock:
+        self.server.in_flight -= 1
+
+
+class TestUploadEngine(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.server = ThreadingHTTPServer(('127.0.0.1', 0), BlobHandler)
+    cls.server.daemon_threads = True
+    cls.server.lock = threading.Lock()
+    threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+    cls.server.server_close()
+
+  def setUp(self):
+    s = self.server
+    s.blobs, s.blocks, s.headers, s.requests, s.failures = {}, {}, {}, [], []
+    s.connections, s.in_flight, s.max_in_flight, s.delay = 0, 0, 0, 0
+
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.state_dir = os.path.join(self.tmp, 'state')
+
+  def engine(self, **kwargs):
+    kwargs = {'chunk_size': CHUNK_SIZE, 'state_dir': self.state_dir, 'workers': 2, **kwargs}
+    e = UploadEngine(**kwargs)
+    self.addCleanup(e.close)
+    return e
+
+  def make_file(self, size, name='fcamera.hevc'):
+    fn = os.path.join(self.tmp, name)
+    with open(fn, 'wb') as f:
+      f.write(os.urandom(size))
+    with open(fn, 'rb') as f:
+      return fn, f.read()
+
+  def url(self, name):
+    return f"http://127.0.0.1:{self.server.server_address[1]}/container/{name}?sig=abc"
+
+  def block_requests(self, sig=None):
+    # requests of a cancelled engine can still come in late, they're told apart by signature
+    return [r for r in self.server.requests if r[1] == 'block' and sig in (None, r[3])]
+
+  def test_single_put(self):
+    fn, dat = self.make_file(1000, 'qlog.bz2')
+    progress = []
+    resp = self.engine().upload(fn, self.url('qlog.bz2'), {'x-ms-blob-type': 'BlockBlob'},
+                                progress=lambda *p: progress.append(p))
+    self.assertEqual(resp.status_code, 201)
+    self.assertEqual(self.server.blobs['/container/qlog.bz2'], dat)
+    self.assertEqual(self.server.headers['/container/qlog.bz2']['x-ms-blob-type'], 'BlockBlob')
+    self.assertEqual(progress, [(1000, 1000)])
+
+  def test_plain_url(self):
+    # not a block blob, the whole file in one PUT
+    fn, dat = self.make_file(5 * CHUNK_SIZE)
+    self.server.failures = [503]
+    resp = self.engine(retries=2).upload(fn, self.url('plain'), {})
+    self.assertEqual(resp.status_code, 201)
+    self.assertEqual(self.server.blobs['/container/plain'], dat)
+    self.assertEqual(len(self.server.requests), 2)
+
+  def test_chunked_with_failures(self):
+    fn, dat = self.make_file(10 * CHUNK_SIZE + 123)
+    self.server.failures = [None, 'drop', 503, None, 500, 'drop']
+    progress = []
+    resp = self.engine(retries=3).upload(fn, self.url('fcamera.hevc'), {'x-ms-blob-type': 'BlockBlob'},
+                                         progress=lambda *p: progress.append(p))
+    self.assertEqual(resp.status_code, 201)
+    self.assertEqual(self.server.blobs['/container/fcamera.hevc'], dat)
+    self.assertEqual(len(self.block_requests()), 11 + 4)
+    self.assertEqual(progress[-1], (len(dat), len(dat)))
+    # connections are reused, new ones only for the two that were dropped
+    self.assertLessEqual(self.server.connections, 2 + 2)
+    self.assertEqual(os.listdir(self.state_dir), [])
+
+  def test_resume(self):
+    fn, dat = self.make_file(8 * CHUNK_SIZE)
+    url, headers = self.url('rlog.bz2'), {'x-ms-blob-type': 'BlockBlob'}
+
+    # every request fails after the first three, the network went away
+    self.server.failures = [None] * 3 + [503] * 100
+    e = self.engine(workers=1, retries=0)
+    resp = e.upload(fn, url, headers)
+    self.assertEqual(resp.status_code, 503)
+    e.close()
+    self.assertEqual(len(os.listdir(self.state_dir)), 1)
+
+    # a new process with a newly signed url only sends the rest
+    self.server.failures, self.server.requests = [], []
+    resp = self.engine().upload(fn, url.replace('sig=abc', 'sig=def'), headers)
+    self.assertEqual(resp.status_code, 201)
+    self.assertEqual(self.server.blobs['/container/rlog.bz2'], dat)
+    self.assertEqual(len(self.block_requests(sig='def')), 8 - 3)
+    self.assertEqual(os.listdir(self.state_dir), [])
+
+  def test_expired_blocks(self):
+    fn, dat = self.make_file(8 * CHUNK_SIZE)
+    url, headers = self.url('x'), {'x-ms-blob-type': 'BlockBlob'}
+    self.server.failures = [None] * 3 + [503] * 100
+    e = self.engine(workers=1, retries=0)
+    e.upload(fn, url, headers)
+    e.close()
+
+    # the server dropped the uncommitted blocks, the block list fails and all of it is sent again
+    self.server.failures, self.server.blocks = [], {}
+    resp = self.engine().upload(fn, url.replace('sig=abc', 'sig=def'), headers)
+    self.assertEqual(resp.status_code, 201)
+    self.assertEqual(self.server.blobs['/container/x'], dat)
+    self.assertEqual(len(self.block_requests(sig='def')), (8 - 3) + 8)
+    self.assertEqual(os.listdir(self.state_dir), [])
+
+  def test_prune_state(self):
+    fn, _ = self.make_file(4 * CHUNK_SIZE)
+    other, _ = self.make_file(4 * CHUNK_SIZE, 'other')
+    headers = {'x-ms-blob-type': 'BlockBlob'}
+    for f in (fn, other):
+      self.server.failures = [None, 503]
+      e = self.engine(workers=1, retries=0)
+      e.upload(f, self.url(os.path.basename(f)), headers)
+      e.close()
+    self.assertEqual(len(os.listdir(self.state_dir)), 2)
+
+    os.unlink(other)
+    e = self.engine()
+    e.prune_state()
+    self.assertEqual(len(os.listdir(self.state_dir)), 1)
+    # changed since
+    with open(fn, 'ab') as f:
+      f.write(b'1')
+    e.prune_state()
+    self.assertEqual(os.listdir(self.state_dir), [])
+
+  def test_changed_file_starts_over(self):
+    fn, _ = self.make_file(4 * CHUNK_SIZE)
+    self.server.failures = [None, 503]
+    e = self.engine(workers=1, retries=0)
+    e.upload(fn, self.url('f'), {'x-ms-blob-type': 'BlockBlob'})
+    e.close()
+
+    fn, dat = self.make_file(4 * CHUNK_SIZE + 1)
+    self.server.requests = []
+    self.engine().upload(fn, self.url('f').replace('sig=abc', 'sig=def'), {'x-ms-blob-type': 'BlockBlob'})
+    self.assertEqual(self.server.blobs['/container/f'], dat)
+    self.assertEqual(len(self.block_requests(sig='def')), 5)
+
+  def test_parallel(self):
+    self.server.delay = 0.05
+    fn, dat = self.make_file(16 * CHUNK_SIZE)
+    e = self.engine(workers=4)
+    t = time.monotonic()
+    e.upload(fn, self.url('p'), {'x-ms-blob-type': 'BlockBlob'})
+    dt = time.monotonic() - t
+    self.assertEqual(self.server.blobs['/container/p'], dat)
+    self.assertGreaterEqual(self.server.max_in_flight, 2)
+    self.assertLess(dt, 16 * 0.05)
+
+  def test_rate_limit(self):
+    rate = 4 * CHUNK_SIZE
+    fn, dat = self.make_file(12 * CHUNK_SIZE)
+    e = self.engine(max_rate=rate, workers=3)
+    t = time.monotonic()
+    e.upload(fn, self.url('r'), {'x-ms-blob-type': 'BlockBlob'})
+    dt = time.monotonic() - t
+    self.assertEqual(self.server.blobs['/container/r'], dat)
+    # one second of burst, then the cap
+    self.assertGreater(dt, (len(dat) - rate) / rate * 0.9)
+
+  def test_cancel(self):
+    self.server.delay = 0.05
+    fn, _ = self.make_file(32 * CHUNK_SIZE)
+    cancel = threading.Event()
+    sent = []
+
+    def progress(n, total):
+      sent.append(n)
+      if len(sent) == 2:
+        cancel.set()
+
+    e = self.engine()
+    with self.assertRaises(UploadCancelled):
+      e.upload(fn, self.url('c'), {'x-ms-blob-type': 'BlockBlob'}, cancel=cancel, progress=progress)
+    e.close()
+    self.assertLess(len(self.block_requests()), 32)
+    self.assertNotIn('/container/c', self.server.blobs)
+
+
+if __name__ == "__main__":
+  unittest.main()
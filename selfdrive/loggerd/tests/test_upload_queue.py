@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from common.xattr import getxattr, setxattr
+from selfdrive.loggerd import upload_queue
+from selfdrive.loggerd.upload_queue import UploadQueue, get_directory_sort
+from selfdrive.loggerd.upload_state import UploadState
+
+UPLOAD_ATTR_NAME = 'user.upload'
+IMMEDIATE_PRIORITY = {"qlog.bz2": 0, "qcamera.ts": 1}
+HIGH_PRIORITY = {"rlog.bz2": 0, "fcamera.hevc": 1, "dcamera.hevc": 2, "ecamera.hevc": 3}
+SEGMENT_FILES = ["rlog.bz2", "qlog.bz2", "qcamera.ts", "fcamera.hevc", "dcamera.hevc", "extra.txt"]
+
+
+def is_uploaded(fn):
+  return getxattr(fn, UPLOAD_ATTR_NAME)
+
+
+def scan_next_file(root, with_raw):
+  """The full scan the queue replaced"""
+  def get_upload_sort(name):
+    if name in IMMEDIATE_PRIORITY:
+      return IMMEDIATE_PRIORITY[name]
+    if name in HIGH_PRIORITY:
+      return HIGH_PRIORITY[name] + 100
+    return 1000
+
+  upload_files = []
+  for logname in sorted(os.listdir(root), key=get_directory_sort):
+    names = os.listdir(os.path.join(root, logname))
+    if any(name.endswith(".lock") for name in names):
+      continue
+    for name in sorted(sorted(names), key=get_upload_sort):
+      fn = os.path.join(root, logname, name)
+      if not is_uploaded(fn):
+        upload_files.append((name, os.path.join(logname, name), fn))
+
+  for name, key, fn in upload_files:
+    if name in IMMEDIATE_PRIORITY:
+      return (key, fn)
+  if with_raw:
+    for name, key, fn in upload_files:
+      if name in HIGH_PRIORITY:
+        return (key, fn)
+    for name, key, fn in upload_files:
+      if not name.endswith('.lock') and not name.endswith(".tmp"):
+        return (key, fn)
+  return None
+
+
+def make_segment(root, logname, files=SEGMENT_FILES, locked=False):
+  path = os.path.join(root, logname)
+  os.mkdir(path)
+  if locked:
+    open(os.path.join(path, "rlog.bz2.lock"), 'w').close()
+  for name in files:
+    with open(os.path.join(path, name), 'wb') as f:
+      f.write(b'\0' * 16)
+
+
+def state_keys(state):
+  return sorted(os.path.join(segment, name) for segment, name in state.execute("SELECT segment, name FROM files"))
+
+
+class TestUploadQueue(unittest.TestCase):
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.root)
+
+  def queue(self):
+    q = UploadQueue(self.root, IMMEDIATE_PRIORITY, HIGH_PRIORITY, is_uploaded)
+    self.addCleanup(q.close)
+    return q
+
+  def upload(self, q, key, fn):
+    setxattr(fn, UPLOAD_ATTR_NAME, b'1')
+    q.mark_uploaded(key)
+
+  def check_drain(self, q):
+    # both orders agree until everything is uploaded
+    for with_raw in (False, True):
+      while True:
+        expected = scan_next_file(self.root, with_raw)
+        self.assertEqual(q.next_file(with_raw), expected)
+        if expected is None:
+          break
+        self.upload(q, *expected)
+
+  def test_order(self):
+    for i in range(3):
+      for seg in range(4):
+        make_segment(self.root, f"2020-01-0{i + 1}--10-00-00--{seg}")
+    # uploaded before the queue was started
+    setxattr(os.path.join(self.root, "2020-01-01--10-00-00--0", "qlog.bz2"), UPLOAD_ATTR_NAME, b'1')
+    make_segment(self.root, "2020-01-04--10-00-00--0", locked=True)
+    self.check_drain(self.queue())
+
+  def test_follows_changes(self):
+    make_segment(self.root, "2020-01-01--10-00-00--0")
+    make_segment(self.root, "2020-01-01--10-00-00--1")
+    q = self.queue()
+    self.assertEqual(q.next_file(False), scan_next_file(self.root, False))
+
+    # a segment being logged is skipped until its lock is removed
+    make_segment(self.root, "2020-01-01--10-00-00--2", locked=True)
+    make_segment(self.root, "2019-12-31--10-00-00--0", locked=True)
+    self.assertEqual(q.next_file(True), scan_next_file(self.root, True))
+
+    # the deleter removes the oldest segment, another process uploads a file
+    shutil.rmtree(os.path.join(self.root, "2020-01-01--10-00-00--0"))
+    setxattr(os.path.join(self.root, "2020-01-01--10-00-00--1", "qlog.bz2"), UPLOAD_ATTR_NAME, b'1')
+    self.assertEqual(q.next_file(False), scan_next_file(self.root, False))
+
+    os.unlink(os.path.join(self.root, "2019-12-31--10-00-00--0", "rlog.bz2.lock"))
+    os.unlink(os.path.join(self.root, "2020-01-01--10-00-00--2", "rlog.bz2.lock"))
+    open(os.path.join(self.root, "2020-01-01--10-00-00--2", "late.txt"), 'w').close()
+    self.check_drain(q)
+
+  def test_without_inotify(self):
+    make_segment(self.root, "2020-01-01--10-00-00--0")
+    with mock.patch.object(upload_queue, 'Inotify', side_effect=OSError):
+      q = self.queue()
+    self.assertIsNone(q.inotify)
+    make_segment(self.root, "2020-01-01--10-00-00--1", locked=True)
+    os.unlink(os.path.join(self.root, "2020-01-01--10-00-00--1", "rlog.bz2.lock"))
+    self.check_drain(q)
+
+  def test_randomized(self):
+    random.seed(0)
+    q = self.queue()
+    segments, n = [], 0
+    for i in range(200):
+      op = random.random()
+      if op < 0.3 or not segments:
+        logname = f"2020-01-01--10-00-00--{n}"
+        n += 1
+        make_segment(self.root, logname, random.sample(SEGMENT_FILES, 3), locked=random.random() < 0.5)
+        segments.append(logname)
+      elif op < 0.4:
+        logname = segments.pop(0)
+        shutil.rmtree(os.path.join(self.root, logname), ignore_errors=True)
+      elif op < 0.6:
+        lock = os.path.join(self.root, random.choice(segments), "rlog.bz2.lock")
+        if os.path.exists(lock):
+          os.unlink(lock)
+      else:
+        with_raw = random.random() < 0.5
+        expected = scan_next_file(self.root, with_raw)
+        self.assertEqual(q.next_file(with_raw), expected)
+        if expected is not None and random.random() < 0.8:
+          self.upload(q, *expected)
+
+  def test_state(self):
+    def on_disk():
+      return sorted(os.path.join(d, f) for d in os.listdir(self.root) for f in os.listdir(os.path.join(self.root, d))
+                    if not f.endswith('.lock'))
+
+    db = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, db)
+    state = UploadState(os.path.join(db, 'upload_state.db'), self.root)
+    self.addCleanup(state.close)
+    # a file the state has but which was deleted while the uploader wasn't running
+    state.add("2019-12-31--10-00-00--0/rlog.bz2")
+
+    make_segment(self.root, "2020-01-01--10-00-00--0")
+    q = UploadQueue(self.root, IMMEDIATE_PRIORITY, HIGH_PRIORITY, lambda fn: state.is_uploaded(os.path.relpath(fn, self.root)), state)
+    self.addCleanup(q.close)
+    self.assertEqual(state_keys(state), on_disk())
+
+    make_segment(self.root, "2020-01-01--10-00-00--1", locked=True)
+    os.unlink(os.path.join(self.root, "2020-01-01--10-00-00--1", "extra.txt"))
+    key, _ = q.next_file(True)
+    self.assertEqual(state_keys(state), on_disk())
+
+    state.set_uploaded(key)
+    q.mark_uploaded(key)
+    self.assertNotEqual(q.next_file(True)[0], key)
+    shutil.rmtree(os.path.join(self.root, "2020-01-01--10-00-00--0"))
+    q.next_file(True)
+    self.assertEqual(state_keys(state), on_disk())
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import tempfile
+import unittest
+
+from common.xattr import setxattr
+from selfdrive.loggerd.upload_state import STATUS_PENDING, STATUS_UPLOADED, STATUS_UPLOADING, UPLOAD_ATTR_NAME, UploadState
+
+
+def keys(state):
+  return sorted(os.path.join(segment, name) for segment, name in state.execute("SELECT segment, name FROM files"))
+
+
+class TestUploadState(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.root = os.path.join(self.tmp, 'realdata')
+    self.db = os.path.join(self.tmp, 'upload_state.db')
+    os.mkdir(self.root)
+
+  def state(self):
+    s = UploadState(self.db, self.root)
+    self.addCleanup(s.close)
+    return s
+
+  def make_file(self, key, size=10):
+    fn = os.path.join(self.root, key)
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    with open(fn, 'wb') as f:
+      f.write(b'\0' * size)
+    return fn
+
+  def test_migrate_xattrs(self):
+    setxattr(self.make_file("2020-01-01--10-00-00--0/qlog.bz2", 5), UPLOAD_ATTR_NAME, b'1')
+    self.make_file("2020-01-01--10-00-00--0/rlog.bz2")
+    self.make_file("2020-01-01--10-00-00--1/rlog.bz2.lock")
+    s = self.state()
+    self.assertTrue(s.is_uploaded("2020-01-01--10-00-00--0/qlog.bz2"))
+    self.assertEqual(s.get("2020-01-01--10-00-00--0/qlog.bz2")['bytes_sent'], 5)
+    self.assertFalse(s.is_uploaded("2020-01-01--10-00-00--0/rlog.bz2"))
+    self.assertEqual(keys(s), ["2020-01-01--10-00-00--0/qlog.bz2", "2020-01-01--10-00-00--0/rlog.bz2"])
+
+    # only once, later xattrs aren't looked at
+    s.set_uploaded("2020-01-01--10-00-00--0/qlog.bz2", 5)
+    s.remove("2020-01-01--10-00-00--0/rlog.bz2")
+    s.close()
+    self.assertEqual(keys(self.state()), ["2020-01-01--10-00-00--0/qlog.bz2"])
+
+  def test_upload_progress(self):
+    s = self.state()
+    key = "2020-01-01--10-00-00--0/fcamera.hevc"
+    s.add(key)
+    self.assertEqual(s.get(key)['status'], STATUS_PENDING)
+    s.start_upload(key, 100)
+    s.set_progress(key, 40)
+    self.assertEqual(s.get(key)['status'], STATUS_UPLOADING)
+    self.assertEqual(s.get(key)['bytes_sent'], 40)
+    s.upload_failed(key)
+    s.start_upload(key, 100)
+    s.set_uploaded(key, 100)
+    info = s.get(key)
+    self.assertEqual((info['status'], info['size'], info['bytes_sent'], info['attempts']), (STATUS_UPLOADED, 100, 100, 2))
+    self.assertIsNotNone(info['last_attempt'])
+
+    # another process sees it
+    other = UploadState(self.db, self.root)
+    self.addCleanup(other.close)
+    self.assertTrue(other.is_uploaded(key))
+
+  def test_sync(self):
+    s = self.state()
+    s.set_uploaded("2020-01-01--10-00-00--0/qlog.bz2", 10)
+    s.add("2020-01-01--10-00-00--0/rlog.bz2")
+    s.add("2020-01-01--10-00-00--1/rlog.bz2", autocommit=False)
+    s.commit()
+    s.sync({"2020-01-01--10-00-00--0": ["qlog.bz2"], "2020-01-02--10-00-00--0": ["qlog.bz2", "qcamera.ts"]})
+    self.assertTrue(s.is_uploaded("2020-01-01--10-00-00--0/qlog.bz2"))
+    self.assertEqual(keys(s), ["2020-01-01--10-00-00--0/qlog.bz2", "2020-01-02--10-00-00--0/qcamera.ts",
+                                      "2020-01-02--10-00-00--0/qlog.bz2"])
+    s.remove_segment("2020-01-02--10-00-00--0")
+    self.assertEqual(keys(s), ["2020-01-01--10-00-00--0/qlog.bz2"])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,350 @@
+import base64
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CHUNK_SIZE = 4 * 1024 * 1024
+READ_SIZE = 64 * 1024
+PROGRESS_INTERVAL = 0.5  # seconds between progress callbacks
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', "2"))
+UPLOAD_MAX_RATE = int(os.getenv('UPLOAD_MAX_RATE', "0"))  # bytes/s over all uploads, 0 is unlimited
+
+if os.environ.get('UPLOAD_STATE_DIR', False):
+  STATE_DIR = os.environ['UPLOAD_STATE_DIR']
+else:
+  STATE_DIR = '/data/upload_progress/'
+
+
+class UploadCancelled(Exception):
+  pass
+
+
+class RateLimiter():
+  """Token bucket shared by all transfers, allows a burst of one second"""
+  def __init__(self, rate):
+    self.rate = rate
+    self.tokens = rate
+    self.t = time.monotonic()
+    self.lock = threading.Lock()
+
+  def consume(self, n):
+    if not self.rate:
+      return
+    with self.lock:
+      t = time.monotonic()
+      self.tokens = min(self.rate, self.tokens + (t - self.t) * self.rate)
+      self.t = t
+      self.tokens -= n
+      wait = -self.tokens / self.rate
+    if wait > 0:
+      time.sleep(wait)
+
+
+class ChunkBody():
+  """Byte range of a file as a request body, read as it's sent"""
+  def __init__(self, transfer, offset, size, limiter):
+    self.transfer = transfer
+    self.offset = offset
+    self.size = size
+    self.limiter = limiter
+    self.f = None
+    self.left = size
+    self.sent = 0
+
+  def __len__(self):
+    return self.size
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def read(self, n=-1):
+    if self.transfer.cancelled():
+      raise UploadCancelled()
+    if self.f is None:
+      self.f = open(self.transfer.path, 'rb')
+      self.f.seek(self.offset)
+    n = self.left if n is None or n < 0 else min(n, self.left)
+    dat = self.f.read(min(n, READ_SIZE))
+    self.left -= len(dat)
+    self.sent += len(dat)
+    self.limiter.consume(len(dat))
+    self.transfer.add_sent(len(dat))
+    if not dat:
+      self.close()
+    return dat
+
+  def __iter__(self):
+    while True:
+      dat = self.read(READ_SIZE)
+      if not dat:
+        return
+      yield dat
+
+  def close(self):
+    if self.f is not None:
+      self.f.close()
+      self.f = None
+
+
+class Transfer():
+  """Progress of one file, the chunks done so far are kept in state_dir so an upload cut
+  off by a network drop or a restart carries on where it stopped"""
+  def __init__(self, engine, path, url, headers, cancel, progress):
+    self.engine = engine
+    self.path = path
+    self.url = url
+    self.headers = {k: v for k, v in headers.items() if k.lower() != 'content-length'}
+    self.cancel = cancel
+    self.stop = threading.Event()  # set when a chunk failed, the others aren't sent
+    self.progress = progress
+
+    st = os.stat(path)
+    self.mtime_ns = st.st_mtime_ns
+    self.size = st.st_size
+    self.chunk_size = engine.chunk_size
+    self.n_chunks = max(1, -(-self.size // self.chunk_size))
+
+    # the upload url is signed again for every attempt, the blob it points at stays the same
+    u = urlsplit(url)
+    key = f"{os.path.realpath(path)}:{st.st_size}:{st.st_mtime_ns}:{u.netloc}{u.path}"
+    self.state_fn = os.path.join(engine.state_dir, hashlib.sha1(key.encode()).hexdigest() + '.json') if engine.state_dir else None
+
+    self.lock = threading.Lock()
+    self.done = self.load_state()
+    self.sent = sum(self.chunk_len(i) for i in self.done)
+    self.last_progress = time.monotonic()
+
+  def cancelled(self):
+    return self.stop.is_set() or (self.cancel is not None and self.cancel.is_set())
+
+  def wait(self, timeout):
+    if self.cancel is not None:
+      self.cancel.wait(timeout)
+    else:
+      self.stop.wait(timeout)
+
+  def chunk_len(self, i):
+    return min(self.chunk_size, self.size - i * self.chunk_size)
+
+  def load_state(self):
+    try:
+      with open(self.state_fn) as f:
+        state = json.load(f)
+      if state['chunk_size'] == self.chunk_size:
+        return set(state['done'])
+    except (TypeError, OSError, ValueError, KeyError):
+      pass
+    return set()
+
+  def save_state(self):
+    if self.state_fn is None:
+      return
+    try:
+      os.makedirs(self.engine.state_dir, exist_ok=True)
+      with tempfile.NamedTemporaryFile('w', dir=self.engine.state_dir, suffix='.tmp', delete=False) as f:
+        json.dump({'chunk_size': self.chunk_size, 'done': sorted(self.done),
+                   'path': os.path.realpath(self.path), 'size': self.size, 'mtime_ns': self.mtime_ns}, f)
+      os.replace(f.name, self.state_fn)
+    except OSError:
+      pass
+
+  def clear_state(self):
+    if self.state_fn is not None:
+      try:
+        os.unlink(self.state_fn)
+      except OSError:
+        pass
+
+  def add_sent(self, n, force=False):
+    """Counts bytes as they're sent, or takes back those of a failed request"""
+    with self.lock:
+      self.sent += n
+      t = time.monotonic()
+      if self.progress is None or not (force or t - self.last_progress > PROGRESS_INTERVAL):
+        return
+      self.last_progress = t
+      sent = self.sent
+    self.progress(sent, self.size)
+
+  def chunk_done(self, i):
+    with self.lock:
+      self.done.add(i)
+      self.save_state()
+    self.add_sent(0, force=True)
+
+
+def block_id(i):
+  # all block ids of a blob have the same length
+  return base64.b64encode(b"%08d" % i).decode()
+
+
+def is_block_blob(url, headers):
+  return any(k.lower() == 'x-ms-blob-type' and v == 'BlockBlob' for k, v in headers.items())
+
+
+class UploadEngine():
+  def __init__(self, workers=UPLOAD_WORKERS, chunk_size=CHUNK_SIZE, max_rate=UPLOAD_MAX_RATE,
+               retries=5, timeout=10, state_dir=STATE_DIR):
+    """Uploads files to signed urls, shared by the uploader and athenad.
+
+    Large files going to Azure block blobs, which is what the upload urls of the api point
+    at, are sent in chunks of chunk_size as blocks that are committed once all of them
+    are there. Failed chunks are retried with backoff and finished ones are remembered
+    across restarts. Other uploads are a single PUT retried from the start.
+
+    Args:
+      workers: Number of chunks in flight over all uploads, also the connection pool size
+      chunk_size: Bytes per block
+      max_rate: Upload bandwidth cap over all uploads in bytes/s, 0 for none
+      retries: Attempts per chunk after the first one
+      timeout: Connect and read timeout of every request
+      state_dir: Directory for the progress of unfinished uploads, None to not keep it
+    """
+    self.workers = workers
+    self.chunk_size = chunk_size
+    self.retries = retries
+    self.timeout = timeout
+    self.state_dir = state_dir
+    self.limiter = RateLimiter(max_rate)
+
+    self.session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    self.session.mount('http://', adapter)
+    self.session.mount('https://', adapter)
+    self.executor = ThreadPoolExecutor(max_workers=workers)
+
+  def upload(self, path, url, headers, cancel=None, progress=None):
+    """Uploads path, blocks until it's done. Returns the last response, raises on
+    network errors that persisted over all retries and UploadCancelled when cancel is set.
+
+    Args:
+      cancel: Optional threading.Event to stop the upload
+      progress: Optional callback taking (bytes sent, total bytes)
+    """
+    transfer = Transfer(self, path, url, headers, cancel, progress)
+    if transfer.n_chunks == 1 or not is_block_blob(url, headers):
+      resp = self.put(transfer, url, transfer.headers, 0, transfer.size)
+      if resp.status_code < 300:
+        transfer.add_sent(0, force=True)
+      return resp
+
+    resumed = len(transfer.done) > 0
+    pending = [i for i in range(transfer.n_chunks) if i not in transfer.done]
+    futures = [self.executor.submit(self.put_block, transfer, i) for i in pending]
+    finished = False
+    try:
+      for f in futures:
+        resp = f.result()
+        if resp.status_code >= 300:
+          return resp
+      finished = True
+    finally:
+      if not finished:
+        # the rest of a failed upload isn't sent
+        transfer.stop.set()
+        for f in futures:
+          f.cancel()
+
+    resp = self.put_block_list(transfer)
+    if resp.status_code < 300:
+      transfer.clear_state()
+    elif resp.status_code < 500:
+      # the blocks of earlier attempts are gone, uncommitted blocks expire and another put
+      # of the blob drops them. all of it is sent again
+      transfer.clear_state()
+      if resumed:
+        return self.upload(path, url, headers, cancel, progress)
+    return resp
+
+  def put_block(self, transfer, i):
+    resp = self.put(transfer, self.with_query(transfer.url, f"comp=block&blockid={block_id(i)}"),
+                    {k: v for k, v in transfer.headers.items() if k.lower() != 'x-ms-blob-type'},
+                    i * transfer.chunk_size, transfer.chunk_len(i))
+    if resp.status_code < 300:
+      transfer.chunk_done(i)
+    return resp
+
+  def put_block_list(self, transfer):
+    blocks = ''.join(f"<Latest>{block_id(i)}</Latest>" for i in range(transfer.n_chunks))
+    body = f'<?xml version="1.0" encoding="utf-8"?><BlockList>{blocks}</BlockList>'.encode()
+    headers = {k: v for k, v in transfer.headers.items() if k.lower() != 'x-ms-blob-type'}
+    return self.request(transfer, lambda: self.session.put(self.with_query(transfer.url, "comp=blocklist"),
+                                                           data=body, headers=headers, timeout=self.timeout))
+
+  def put(self, transfer, url, headers, offset, size):
+    def send():
+      with ChunkBody(transfer, offset, size, self.limiter) as body:
+        try:
+          resp = self.session.put(url, data=body, headers={**headers, 'Content-Length': str(size)}, timeout=self.timeout)
+        except BaseException:
+          transfer.add_sent(-body.sent)
+          raise
+        if resp.status_code >= 300:
+          transfer.add_sent(-body.sent)
+        return resp
+    return self.request(transfer, send)
+
+  def request(self, transfer, send):
+    for attempt in range(self.retries + 1):
+      if transfer.cancelled():
+        raise UploadCancelled()
+      try:
+        resp = send()
+        if resp.status_code not in RETRY_STATUS or attempt == self.retries:
+          return resp
+      except UploadCancelled:
+        raise
+      except requests.exceptions.RequestException:
+        if attempt == self.retries:
+          raise
+      # backoff, cut short by a cancel
+      transfer.wait(min(0.5 * 2 ** attempt, 30) * random.uniform(0.5, 1.0))
+
+  def prune_state(self):
+    """Removes the progress of uploads whose file was deleted or changed"""
+    if not self.state_dir:
+      return
+    try:
+      names = os.listdir(self.state_dir)
+    except OSError:
+      return
+    for name in names:
+      fn = os.path.join(self.state_dir, name)
+      try:
+        if name.endswith('.json'):
+          with open(fn) as f:
+            state = json.load(f)
+          st = os.stat(state['path'])
+          if (st.st_size, st.st_mtime_ns) == (state['size'], state['mtime_ns']):
+            continue
+        elif time.time() - os.path.getmtime(fn) < 3600:
+          # being written
+          continue
+      except (OSError, ValueError, KeyError, TypeError):
+        pass
+      try:
+        os.unlink(fn)
+      except OSError:
+        pass
+
+  @staticmethod
+  def with_query(url, query):
+    return url + ('&' if urlsplit(url).query else '?') + query
+
+  def close(self):
+    self.executor.shutdown(wait=True)
+    self.session.close()
+
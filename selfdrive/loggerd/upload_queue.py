@@ -0,0 +1,239 @@
+import errno
+import heapq
+import os
+
+from common.inotify import (IN_CREATE, IN_DELETE, IN_IGNORED, IN_ISDIR, IN_MOVED_FROM, IN_MOVED_TO, IN_ONLYDIR,
+                            IN_Q_OVERFLOW, Inotify)
+
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+
+TIER_IMMEDIATE, TIER_HIGH, TIER_OTHER = 0, 1, 2
+
+
+def get_directory_sort(d):
+  return list(map(lambda s: s.rjust(10, '0'), d.rsplit('--', 1)))
+
+
+class UploadQueue():
+  """Files under root waiting for upload, in the order the uploader picks them: qlogs and
+  qcameras first, then rlogs and camera files, then everything else, oldest segment first.
+
+  Root is scanned once, after that the queue follows inotify events on root and on the
+  segments being logged. Picking the next file is a heap lookup, only that file's upload
+  flag is read again since another process can upload it too. Without inotify every call
+  rescans root.
+
+  With a state, an UploadState, the files seen on disk are kept in it as well."""
+  def __init__(self, root, immediate_priority, high_priority, is_uploaded, state=None):
+    self.root = root
+    self.immediate_priority = immediate_priority
+    self.high_priority = high_priority
+    self.is_uploaded = is_uploaded
+    self.state = state
+
+    self.heap = []
+    self.files = {}  # logname -> {name: heap entry}
+    self.locks = {}  # logname -> names of the lock files, the segment is being written
+    self.count = 0
+
+    self.wds = {}  # watch descriptor -> logname, None for root
+    self.root_wd = None
+    try:
+      self.inotify = Inotify()
+    except OSError:
+      self.inotify = None
+
+    self.seed()
+
+  def entry(self, logname, name):
+    if name in self.immediate_priority:
+      tier, sort = TIER_IMMEDIATE, self.immediate_priority[name]
+    elif name in self.high_priority:
+      tier, sort = TIER_HIGH, self.high_priority[name]
+    else:
+      tier, sort = TIER_OTHER, 0
+    return (tier, tuple(get_directory_sort(logname)), sort, name, logname)
+
+  def seed(self):
+    self.heap, self.files, self.locks, self.count = [], {}, {}, 0
+    if self.inotify is not None:
+      for wd in list(self.wds):
+        self.inotify.rm_watch(wd)
+      self.wds, self.root_wd = {}, None
+
+    if not os.path.isdir(self.root):
+      return
+    if self.inotify is not None:
+      self.root_wd = self.watch(self.root, None)
+
+    on_disk = {}
+    for logname in os.listdir(self.root):
+      on_disk[logname] = self.add_dir(logname, seeding=True)
+    heapq.heapify(self.heap)
+    if self.state is not None:
+      self.state.sync(on_disk)
+
+  def watch(self, path, logname):
+    try:
+      wd = self.inotify.add_watch(path, WATCH_MASK)
+    except OSError as e:
+      if e.errno == errno.ENOSPC:
+        # out of watches, fall back to rescanning
+        self.close()
+      return None
+    self.wds[wd] = logname
+    return wd
+
+  def add_dir(self, logname, seeding=False):
+    path = os.path.join(self.root, logname)
+    # watched before listing it, so files created in between aren't missed
+    wd = self.watch(path, logname) if self.inotify is not None else None
+    try:
+      names = os.listdir(path)
+    except OSError:
+      names = []
+
+    files = [name for name in names if self.add_file(logname, name, check_uploaded=seeding, push=not seeding)]
+
+    # nothing is added to a finished segment anymore. segments created while running stay
+    # watched until deleted, the encoders lock and unlock their files independently
+    if seeding and wd is not None and logname not in self.locks:
+      self.unwatch(wd)
+    return files
+
+  def unwatch(self, wd):
+    if self.inotify is not None:
+      self.inotify.rm_watch(wd)
+    self.wds.pop(wd, None)
+
+  def add_file(self, logname, name, check_uploaded=False, push=True):
+    """Returns whether name is a file to upload, uploaded already or not"""
+    if name.endswith('.lock'):
+      self.locks.setdefault(logname, set()).add(name)
+      return False
+    if name.endswith('.tmp'):
+      return False
+    if self.state is not None and not check_uploaded:
+      # a new file, seeding syncs the state in one go
+      self.state.add(os.path.join(logname, name), autocommit=False)
+    if check_uploaded:
+      try:
+        if self.is_uploaded(os.path.join(self.root, logname, name)):
+          return True
+      except OSError:
+        return False
+
+    files = self.files.setdefault(logname, {})
+    if name in files:
+      return True
+    entry = files[name] = self.entry(logname, name)
+    self.count += 1
+    if push:
+      heapq.heappush(self.heap, entry)
+    else:
+      self.heap.append(entry)
+    return True
+
+  def remove_file(self, logname, name):
+    if name.endswith('.lock'):
+      locks = self.locks.get(logname)
+      if locks is not None:
+        locks.discard(name)
+        if not locks:
+          # the segment is done, its files can be uploaded now
+          del self.locks[logname]
+          for entry in self.files.get(logname, {}).values():
+            heapq.heappush(self.heap, entry)
+      return
+
+    files = self.files.get(logname)
+    if files is not None and files.pop(name, None) is not None:
+      self.count -= 1
+
+  def remove_dir(self, logname):
+    self.count -= len(self.files.pop(logname, {}))
+    self.locks.pop(logname, None)
+
+  def mark_uploaded(self, key):
+    logname, name = os.path.split(key)
+    self.remove_file(logname, name)
+
+  def valid(self, entry):
+    _, _, _, name, logname = entry
+    return self.files.get(logname, {}).get(name) is entry and logname not in self.locks
+
+  def process_events(self):
+    while True:
+      events = self.inotify.read_events()
+      if not events:
+        return
+      for wd, mask, name in events:
+        if mask & IN_Q_OVERFLOW:
+          self.seed()
+          return
+        if mask & IN_IGNORED:
+          self.wds.pop(wd, None)
+          if wd == self.root_wd:
+            self.root_wd = None
+          continue
+        if wd not in self.wds:
+          continue
+
+        logname = self.wds[wd]
+        if logname is None:
+          if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            self.add_dir(name)
+          elif mask & IN_ISDIR and mask & (IN_DELETE | IN_MOVED_FROM):
+            self.remove_dir(name)
+            if self.state is not None:
+              self.state.remove_segment(name, autocommit=False)
+        elif mask & (IN_CREATE | IN_MOVED_TO):
+          self.add_file(logname, name)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+          self.remove_file(logname, name)
+          if self.state is not None and not name.endswith('.lock'):
+            self.state.remove(os.path.join(logname, name), autocommit=False)
+
+  def update(self):
+    if self.inotify is None or self.root_wd is None:
+      self.seed()
+    else:
+      self.process_events()
+    if self.state is not None:
+      self.state.commit()
+
+    # drop stale entries once they outnumber the queued files
+    if len(self.heap) > 2 * self.count + 64:
+      self.heap = [e for files in self.files.values() for e in files.values()]
+      heapq.heapify(self.heap)
+
+  def next_file(self, with_raw):
+    """Returns (key, fn) of the next file to upload, only qlogs and qcameras without with_raw"""
+    self.update()
+    while self.heap:
+      entry = self.heap[0]
+      tier, _, _, name, logname = entry
+      if not self.valid(entry):
+        # removed, uploaded or in a segment being written, pushed again when it's unlocked
+        heapq.heappop(self.heap)
+        continue
+      if tier != TIER_IMMEDIATE and not with_raw:
+        return None
+
+      key = os.path.join(logname, name)
+      fn = os.path.join(self.root, key)
+      try:
+        uploaded = self.is_uploaded(fn)
+      except OSError:
+        uploaded = True  # deleter could have deleted
+      if uploaded:
+        self.remove_file(logname, name)
+        continue
+      return (key, fn)
+    return None
+
+  def close(self):
+    if self.inotify is not None:
+      self.inotify.close()
+      self.inotify = None
+      self.wds, self.root_wd = {}, None
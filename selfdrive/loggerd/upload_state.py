@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import threading
+import time
+
+from common.xattr import getxattr
+from selfdrive.loggerd.config import ROOT
+
+if os.environ.get('UPLOAD_STATE_DB', False):
+  UPLOAD_STATE_DB = os.environ['UPLOAD_STATE_DB']
+else:
+  UPLOAD_STATE_DB = '/data/upload_state.db'
+
+# upload flag that was kept on the files themselves before
+UPLOAD_ATTR_NAME = 'user.upload'
+
+STATUS_PENDING, STATUS_UPLOADING, STATUS_UPLOADED = 0, 1, 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+  segment TEXT NOT NULL,
+  name TEXT NOT NULL,
+  status INTEGER NOT NULL DEFAULT 0,
+  size INTEGER,
+  bytes_sent INTEGER NOT NULL DEFAULT 0,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  last_attempt REAL,
+  PRIMARY KEY (segment, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+  key TEXT PRIMARY KEY,
+  value TEXT
+) WITHOUT ROWID;
+"""
+
+
+def split_key(key):
+  return os.path.split(key)
+
+
+class UploadState():
+  def __init__(self, path=UPLOAD_STATE_DB, root=ROOT):
+    """Upload status of the files under root, in an SQLite database shared by the uploader
+    and athenad. Rows are keyed on segment directory and file name, the uploader adds them
+    as loggerd writes files and drops them as the deleter removes them.
+
+    Writes made with autocommit=False are kept in one transaction until commit()."""
+    self.root = root
+    self.lock = threading.RLock()
+    self.db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+    self.db.execute("PRAGMA journal_mode=WAL")
+    self.db.execute("PRAGMA synchronous=NORMAL")
+    self.db.execute("PRAGMA cache_size=-1024")  # KiB
+    self.db.executescript(SCHEMA)
+    self.migrate()
+
+  def migrate(self):
+    """Moves the upload xattrs of files already on disk into the database, once"""
+    with self.lock:
+      self.db.execute("BEGIN IMMEDIATE")
+      try:
+        if self.db.execute("SELECT 1 FROM meta WHERE key = 'xattr_migrated'").fetchone() is None:
+          rows = []
+          for segment in os.listdir(self.root) if os.path.isdir(self.root) else []:
+            try:
+              names = os.listdir(os.path.join(self.root, segment))
+            except OSError:
+              continue
+            for name in names:
+              if name.endswith('.lock') or name.endswith('.tmp'):
+                continue
+              fn = os.path.join(self.root, segment, name)
+              try:
+                uploaded = getxattr(fn, UPLOAD_ATTR_NAME) is not None
+                size = os.path.getsize(fn)
+              except OSError:
+                continue
+              rows.append((segment, name, STATUS_UPLOADED if uploaded else STATUS_PENDING, size, size if uploaded else 0))
+          self.db.executemany("INSERT OR REPLACE INTO files (segment, name, status, size, bytes_sent) VALUES (?, ?, ?, ?, ?)", rows)
+          self.db.execute("INSERT INTO meta VALUES ('xattr_migrated', ?)", (str(time.time()),))
+        self.db.execute("COMMIT")
+      except BaseException:
+        self.db.execute("ROLLBACK")
+        raise
+
+  def execute(self, sql, args=(), autocommit=True):
+    with self.lock:
+      if not autocommit and not self.db.in_transaction:
+        self.db.execute("BEGIN")
+      return self.db.execute(sql, args).fetchall()
+
+  def commit(self):
+    with self.lock:
+      if self.db.in_transaction:
+        self.db.execute("COMMIT")
+
+  def add(self, key, autocommit=True):
+    self.execute("INSERT OR IGNORE INTO files (segment, name) VALUES (?, ?)", split_key(key), autocommit)
+
+  def remove(self, key, autocommit=True):
+    self.execute("DELETE FROM files WHERE segment = ? AND name = ?", split_key(key), autocommit)
+
+  def remove_segment(self, segment, autocommit=True):
+    self.execute("DELETE FROM files WHERE segment = ?", (segment,), autocommit)
+
+  def sync(self, files):
+    """Makes the rows match the files on disk, files is {segment: [names]}"""
+    with self.lock:
+      self.commit()
+      self.db.execute("BEGIN")
+      try:
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS disk (segment TEXT NOT NULL, name TEXT NOT NULL, PRIMARY KEY (segment, name)) WITHOUT ROWID")
+        self.db.execute("DELETE FROM disk")
+        self.db.executemany("INSERT OR IGNORE INTO disk VALUES (?, ?)",
+                            ((segment, name) for segment, names in files.items() for name in names))
+        self.db.execute("DELETE FROM files WHERE NOT EXISTS (SELECT 1 FROM disk WHERE disk.segment = files.segment AND disk.name = files.name)")
+        self.db.execute("INSERT OR IGNORE INTO files (segment, name) SELECT segment, name FROM disk")
+        self.db.execute("DELETE FROM disk")
+        self.db.execute("COMMIT")
+      except BaseException:
+        self.db.execute("ROLLBACK")
+        raise
+
+  def is_uploaded(self, key):
+    rows = self.execute("SELECT status FROM files WHERE segment = ? AND name = ?", split_key(key))
+    return len(rows) > 0 and rows[0][0] == STATUS_UPLOADED
+
+  def start_upload(self, key, size):
+    segment, name = split_key(key)
+    self.execute("""INSERT INTO files (segment, name, status, size, attempts, last_attempt) VALUES (?, ?, ?, ?, 1, ?)
+                    ON CONFLICT (segment, name) DO UPDATE SET status = excluded.status, size = excluded.size,
+                    attempts = attempts + 1, last_attempt = excluded.last_attempt""",
+                 (segment, name, STATUS_UPLOADING, size, time.time()))
+
+  def set_progress(self, key, bytes_sent):
+    self.execute("UPDATE files SET bytes_sent = ? WHERE segment = ? AND name = ?", (bytes_sent, *split_key(key)))
+
+  def upload_failed(self, key):
+    self.execute("UPDATE files SET status = ? WHERE segment = ? AND name = ?", (STATUS_PENDING, *split_key(key)))
+
+  def set_uploaded(self, key, size=None):
+    segment, name = split_key(key)
+    self.execute("""INSERT INTO files (segment, name, status, size, bytes_sent) VALUES (?1, ?2, ?3, ?4, coalesce(?4, 0))
+                    ON CONFLICT (segment, name) DO UPDATE SET status = excluded.status,
+                    size = coalesce(excluded.size, size), bytes_sent = coalesce(excluded.size, size, bytes_sent)""",
+                 (segment, name, STATUS_UPLOADED, size))
+
+  def get(self, key):
+    rows = self.execute("SELECT status, size, bytes_sent, attempts, last_attempt FROM files WHERE segment = ? AND name = ?",
+                        split_key(key))
+    if not rows:
+      return None
+    return dict(zip(('status', 'size', 'bytes_sent', 'attempts', 'last_attempt'), rows[0]))
+
+  def statuses(self, keys):
+    """{key: status} of the keys that have a row"""
+    segments = [split_key(key)[0] for key in keys]
+    if not segments:
+      return {}
+    rows = self.execute("SELECT segment, name, status FROM files WHERE segment BETWEEN ? AND ?", (min(segments), max(segments)))
+    keys = set(keys)
+    return {key: status for key, status in ((os.path.join(segment, name), status) for segment, name, status in rows) if key in keys}
+
+  def close(self):
+    with self.lock:
+      if self.db is not None:
+        self.commit()
+        self.db.close()
+        self.db = None
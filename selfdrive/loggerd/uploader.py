@@ -4,7 +4,7 @@ import inspect
 import json
 import os
 import random
-import requests
+import sqlite3
 import threading
 import time
 import traceback
@@ -13,13 +13,13 @@ from cereal import log
 from common.api import Api
 from common.params import Params
 from selfdrive.hardware import HARDWARE
-from selfdrive.loggerd.xattr_cache import getxattr, setxattr
 from selfdrive.loggerd.config import ROOT
+from selfdrive.loggerd.upload_engine import UploadEngine
+from selfdrive.loggerd.upload_queue import UploadQueue
+from selfdrive.loggerd.upload_state import UploadState
 from selfdrive.swaglog import cloudlog
 
 NetworkType = log.ThermalData.NetworkType
-UPLOAD_ATTR_NAME = 'user.upload'
-UPLOAD_ATTR_VALUE = b'1'
 
 fake_upload = os.getenv("FAKEUPLOAD") is not None
 
@@ -46,18 +46,6 @@ def raise_on_thread(t, exctype):
     ctypes.pythonapi.PyThreadState_SetAsyncExc(tid, 0)
     raise SystemError("PyThreadState_SetAsyncExc failed")
 
-def get_directory_sort(d):
-  return list(map(lambda s: s.rjust(10, '0'), d.rsplit('--', 1)))
-
-def listdir_by_creation(d):
-  try:
-    paths = os.listdir(d)
-    paths = sorted(paths, key=get_directory_sort)
-    return paths
-  except OSError:
-    cloudlog.exception("listdir_by_creation failed")
-    return list()
-
 def clear_locks(root):
   for logname in os.listdir(root):
     path = os.path.join(root, logname)
@@ -78,6 +66,8 @@ class Uploader():
     self.root = root
 
     self.upload_thread = None
+    self.engine = UploadEngine()
+    self.state = UploadState(root=root)
 
     self.last_resp = None
     self.last_exc = None
@@ -85,58 +75,27 @@ class Uploader():
     self.immediate_priority = {"qlog.bz2": 0, "qcamera.ts": 1}
     self.high_priority = {"rlog.bz2": 0, "fcamera.hevc": 1, "dcamera.hevc": 2, "ecamera.hevc": 3}
 
-  def get_upload_sort(self, name):
-    if name in self.immediate_priority:
-      return self.immediate_priority[name]
-    if name in self.high_priority:
-      return self.high_priority[name] + 100
-    return 1000
-
-  def gen_upload_files(self):
-    if not os.path.isdir(self.root):
-      return
-    for logname in listdir_by_creation(self.root):
-      path = os.path.join(self.root, logname)
-      try:
-        names = os.listdir(path)
-      except OSError:
-        continue
-      if any(name.endswith(".lock") for name in names):
-        continue
-
-      for name in sorted(names, key=self.get_upload_sort):
-        key = os.path.join(logname, name)
-        fn = os.path.join(path, name)
-        # skip files already uploaded
-        try:
-          is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME)
-        except OSError:
-          cloudlog.event("uploader_getxattr_failed", exc=self.last_exc, key=key, fn=fn)
-          is_uploaded = True  # deleter could have deleted
-        if is_uploaded:
-          continue
-        yield (name, key, fn)
-
-  def next_file_to_upload(self, with_raw):
-    upload_files = list(self.gen_upload_files())
+    self.queue = None
 
-    # try to upload qlog files first
-    for name, key, fn in upload_files:
-      if name in self.immediate_priority:
-        return (key, fn)
+  def is_uploaded(self, fn):
+    # deleter could have deleted
+    return self.state.is_uploaded(os.path.relpath(fn, self.root)) or not os.path.exists(fn)
 
-    if with_raw:
-      # then upload the full log files, rear and front camera files
-      for name, key, fn in upload_files:
-        if name in self.high_priority:
-          return (key, fn)
-
-      # then upload other files
-      for name, key, fn in upload_files:
-        if not name.endswith('.lock') and not name.endswith(".tmp"):
-          return (key, fn)
-
-    return None
+  def next_file_to_upload(self, with_raw):
+    # qlog files first, then the full log files, rear and front camera files, then other files
+    if self.queue is None:
+      self.queue = UploadQueue(self.root, self.immediate_priority, self.high_priority, self.is_uploaded, self.state)
+      self.engine.prune_state()
+    d = self.queue.next_file(with_raw)
+    if d is None:
+      # progress of files the deleter removed
+      self.engine.prune_state()
+    return d
+
+  def mark_uploaded(self, key, size):
+    self.state.set_uploaded(key, size)
+    if self.queue is not None:
+      self.queue.mark_uploaded(key)
 
   def do_upload(self, key, fn):
     try:
@@ -159,8 +118,7 @@ class Uploader():
 
         self.last_resp = FakeResponse()
       else:
-        with open(fn, "rb") as f:
-          self.last_resp = requests.put(url, data=f, headers=headers, timeout=10)
+        self.last_resp = self.engine.upload(fn, url, headers, progress=lambda sent, total: self.state.set_progress(key, sent))
     except Exception as e:
       self.last_exc = (e, traceback.format_exc())
       raise
@@ -190,23 +148,30 @@ class Uploader():
     if sz == 0:
       try:
         # tag files of 0 size as uploaded
-        setxattr(fn, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
-      except OSError:
-        cloudlog.event("uploader_setxattr_failed", exc=self.last_exc, key=key, fn=fn, sz=sz)
+        self.mark_uploaded(key, sz)
+      except sqlite3.Error:
+        cloudlog.event("uploader_mark_uploaded_failed", exc=self.last_exc, key=key, fn=fn, sz=sz)
       success = True
     else:
       cloudlog.info("uploading %r", fn)
+      try:
+        self.state.start_upload(key, sz)
+      except sqlite3.Error:
+        cloudlog.exception("uploader_state_failed")
       stat = self.normal_upload(key, fn)
       if stat is not None and stat.status_code in (200, 201, 412):
         cloudlog.event("upload_success" if stat.status_code != 412 else "upload_ignored", key=key, fn=fn, sz=sz)
         try:
-          # tag file as uploaded
-          setxattr(fn, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
-        except OSError:
-          cloudlog.event("uploader_setxattr_failed", exc=self.last_exc, key=key, fn=fn, sz=sz)
+          self.mark_uploaded(key, sz)
+        except sqlite3.Error:
+          cloudlog.event("uploader_mark_uploaded_failed", exc=self.last_exc, key=key, fn=fn, sz=sz)
         success = True
       else:
         cloudlog.event("upload_failed", stat=stat, exc=self.last_exc, key=key, fn=fn, sz=sz)
+        try:
+          self.state.upload_failed(key)
+        except sqlite3.Error:
+          cloudlog.exception("uploader_state_failed")
         success = False
 
     return success
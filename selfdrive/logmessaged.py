@@ -1,38 +1,139 @@
 #!/usr/bin/env python3
+import os
+import time
+import threading
+from collections import Counter
+
 import zmq
 import cereal.messaging as messaging
-from selfdrive.swaglog import get_le_handler
+from selfdrive.swaglog import cloudlog, get_le_handler
 
+LOGMESSAGE_ADDR = "ipc:///tmp/logmessage"
+# records arriving within this long of the first one are published together
+BATCH_WINDOW = float(os.getenv("LOGMESSAGED_BATCH_WINDOW", "0.05"))
+MAX_BATCH_SIZE = 256
+# records held at most, lower levels are dropped first past it
+HIGH_WATER_MARK = int(os.getenv("LOGMESSAGED_HWM", "2000"))
+STATS_INTERVAL = 60.
+LE_LEVEL = 20  # logging.INFO
 
-def main():
-  le_handler = get_le_handler()
-  le_level = 20  # logging.INFO
 
-  ctx = zmq.Context().instance()
-  sock = ctx.socket(zmq.PULL)
-  sock.bind("ipc:///tmp/logmessage")
+def shed(records, high_water_mark, dropped):
+  """Drops records down to high_water_mark, oldest of the lowest level first. records are
+  (levelnum, dat), dropped counts what's dropped per level"""
+  excess = len(records) - high_water_mark
+  if excess <= 0:
+    return records
+
+  to_drop = {}
+  levels = Counter(levelnum for levelnum, _ in records)
+  for levelnum in sorted(levels):
+    n = min(excess, levels[levelnum])
+    to_drop[levelnum] = n
+    dropped[levelnum] += n
+    excess -= n
+    if excess == 0:
+      break
+
+  kept = []
+  for r in records:
+    if to_drop.get(r[0], 0) > 0:
+      to_drop[r[0]] -= 1
+    else:
+      kept.append(r)
+  return kept
+
+
+class LogMessageForwarder():
+  """Receives swaglog records, forwards them to logentries and publishes them as logMessage.
+
+  Records coming in within a window are published in one logMessage, one JSON record per
+  line. At most high_water_mark are held, under overload low level records are shed first."""
+  def __init__(self, pub_sock, le_handler=None, addr=LOGMESSAGE_ADDR, window=BATCH_WINDOW,
+               high_water_mark=HIGH_WATER_MARK, max_batch_size=MAX_BATCH_SIZE):
+    self.pub_sock = pub_sock
+    self.le_handler = le_handler
+    self.window = window
+    self.high_water_mark = high_water_mark
+    self.max_batch_size = max_batch_size
+
+    self.ctx = zmq.Context().instance()
+    self.sock = self.ctx.socket(zmq.PULL)
+    self.sock.bind(addr)
 
-  # and we publish them
-  pub_sock = messaging.pub_sock('logMessage')
+    self.received = 0
+    self.published = 0
+    self.batches = 0
+    self.dropped = Counter()  # levelnum -> records
 
-  while True:
-    dat = b''.join(sock.recv_multipart())
-    dat = dat.decode('utf8')
+  def recv(self):
+    dat = b''.join(self.sock.recv_multipart(zmq.NOBLOCK))
+    self.received += 1
+    return (dat[0], dat[1:].decode('utf8', 'replace')) if dat else None
 
-    # print "RECV", repr(dat)
+  def receive(self, timeout):
+    """Records that came in within the window of the first one, none after timeout seconds"""
+    if not self.sock.poll(int(timeout * 1000)):
+      return []
 
-    levelnum = ord(dat[0])
-    dat = dat[1:]
+    records = []
+    deadline = time.monotonic() + self.window
+    while True:
+      try:
+        record = self.recv()
+      except zmq.error.Again:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not self.sock.poll(int(remaining * 1000) + 1):
+          break
+        continue
+      if record is not None:
+        records.append(record)
+      if len(records) >= 2 * self.high_water_mark:
+        records = shed(records, self.high_water_mark, self.dropped)
+      if time.monotonic() >= deadline:
+        break
+    return shed(records, self.high_water_mark, self.dropped)
 
-    if levelnum >= le_level:
-      # push to logentries
-      # TODO: push to athena instead
-      le_handler.emit_raw(dat)
+  def forward(self, records):
+    if self.le_handler is not None:
+      for levelnum, dat in records:
+        if levelnum >= LE_LEVEL:
+          # TODO: push to athena instead
+          self.le_handler.emit_raw(dat)
 
-    # then we publish them
-    msg = messaging.new_message()
-    msg.logMessage = dat
-    pub_sock.send(msg.to_bytes())
+    for i in range(0, len(records), self.max_batch_size):
+      batch = records[i:i + self.max_batch_size]
+      msg = messaging.new_message()
+      msg.logMessage = '\n'.join(dat for _, dat in batch)
+      self.pub_sock.send(msg.to_bytes())
+      self.published += len(batch)
+      self.batches += 1
+
+  def stats(self):
+    return {
+      'received': self.received,
+      'published': self.published,
+      'batches': self.batches,
+      'dropped': {str(levelnum): n for levelnum, n in sorted(self.dropped.items())},
+    }
+
+  def run(self, exit_event, stats_interval=STATS_INTERVAL):
+    last_stats, last_received = time.monotonic(), 0
+    while not exit_event.is_set():
+      self.forward(self.receive(1.))
+
+      dt = time.monotonic() - last_stats
+      if dt >= stats_interval:
+        cloudlog.event("logmessaged_stats", rate=round((self.received - last_received) / dt, 1), **self.stats())
+        last_stats, last_received = time.monotonic(), self.received
+
+  def close(self):
+    self.sock.close(linger=0)
+
+
+def main():
+  forwarder = LogMessageForwarder(messaging.pub_sock('logMessage'), get_le_handler())
+  forwarder.run(threading.Event())
 
 
 if __name__ == "__main__":
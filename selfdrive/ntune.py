@@ -1,8 +1,8 @@
 import os
-import fcntl
-import signal
 import json
-import numpy as np
+import time
+import threading
+from common.inotify import IN_CLOSE_WRITE, IN_CREATE, IN_MOVED_TO, Inotify
 from common.realtime import DT_CTRL
 
 CONF_PATH = '/data/ntune/'
@@ -10,273 +10,329 @@ CONF_COMMON_FILE = '/data/ntune/common.json'
 CONF_LQR_FILE = '/data/ntune/lat_lqr.json'
 CONF_INDI_FILE = '/data/ntune/lat_indi.json'
 
+# key: (min, max, default)
+COMMON_LIMITS = {
+  "useLiveSteerRatio": (0., 1., 1.),
+  "steerRatio": (5.0, 25.0, 16.0),
+  "steerActuatorDelay": (0.1, 0.8, 0.25),
+  "steerRateCost": (0.1, 1.5, 0.6),
+  "cameraOffset": (-1.0, 1.0, 0.06),
+}
+
+LQR_LIMITS = {
+  "scale": (500.0, 5000.0, 2000.0),
+  "ki": (0.0, 0.2, 0.015),
+  "dcGain": (0.002, 0.004, 0.0029),
+  "steerLimitTimer": (0.5, 3.0, 2.5),
+}
+
+INDI_LIMITS = {
+  "innerLoopGain": (0.5, 10.0, 3.3),
+  "outerLoopGain": (0.5, 10.0, 2.7),
+  "timeConstant": (0.1, 5.0, 2.0),
+  "actuatorEffectiveness": (0.1, 5.0, 1.7),
+  "steerLimitTimer": (0.5, 3.0, 0.8),
+}
+
+POLL_INTERVAL = 1.0  # s, mtime polling when inotify is not available
+
+
+class TuneConfig():
+  """Immutable snapshot of one tuning file. Values are read as attributes,
+  a new snapshot with a higher version replaces it when the file changes."""
+  __slots__ = ('_values', 'version')
+
+  def __init__(self, values, version):
+    object.__setattr__(self, '_values', dict(values))
+    object.__setattr__(self, 'version', version)
+
+  def __getattr__(self, key):
+    # only called for what isn't a slot, _values is unset on an instance made without
+    # __init__ and would recurse
+    if key == '_values':
+      raise AttributeError(key)
+    try:
+      return self._values[key]
+    except KeyError:
+      raise AttributeError(key) from None
 
-class nTune():
-  def __init__(self, CP=None, controller=None):
+  def __setattr__(self, key, value):
+    raise AttributeError("TuneConfig is immutable")
 
-    self.invalidated = False
+  def __reduce__(self):
+    return (TuneConfig, (self._values, self.version))
 
-    self.CP = CP
-
-    self.lqr = None
-    self.indi = None
+  def __getitem__(self, key):
+    return self._values[key]
 
-    if "LatControlLQR" in str(type(controller)):
-      self.lqr = controller
-      self.file = CONF_LQR_FILE
-      self.lqr.A = np.array([0., 1., -0.22619643, 1.21822268]).reshape((2, 2))
-      self.lqr.B = np.array([-1.92006585e-04, 3.95603032e-05]).reshape((2, 1))
-      self.lqr.C = np.array([1., 0.]).reshape((1, 2))
-      self.lqr.K = np.array([-110., 451.]).reshape((1, 2))
-      self.lqr.L = np.array([0.33, 0.318]).reshape((2, 1))
-    elif "LatControlINDI" in str(type(controller)):
-      self.indi = controller
-      self.file = CONF_INDI_FILE
-    else:
-      self.file = CONF_COMMON_FILE
+  def __contains__(self, key):
+    return key in self._values
 
-    if not os.path.exists(CONF_PATH):
-      os.makedirs(CONF_PATH)
+  def to_dict(self):
+    return dict(self._values)
 
-    self.read()
 
-    try:
-      signal.signal(signal.SIGIO, self.handler)
-      fd = os.open(CONF_PATH, os.O_RDONLY)
-      fcntl.fcntl(fd, fcntl.F_SETSIG, 0)
-      fcntl.fcntl(fd, fcntl.F_NOTIFY, fcntl.DN_MODIFY | fcntl.DN_CREATE | fcntl.DN_MULTISHOT)
-    except Exception as ex:
-      print("exception", ex)
-      pass
-
-  def handler(self, signum, frame):
-    try:
-      if os.path.isfile(self.file):
-        with open(self.file, 'r') as f:
-          self.config = json.load(f)
-          if self.checkValid():
-            self.write_config(self.config)
-
-    except Exception as ex:
-      print("exception", ex)
-      pass
-
-    self.invalidated = True
+def check_limits(config, limits):
+  """Fill in missing keys and clamp values in place, returns True if config was changed"""
+  updated = False
+  for key, (min_, max_, default_) in limits.items():
+    if key not in config:
+      config[key] = default_
+      updated = True
+    elif min_ > config[key]:
+      config[key] = min_
+      updated = True
+    elif max_ < config[key]:
+      config[key] = max_
+      updated = True
+  return updated
 
-  def check(self):  # called by LatControlLQR.update
-    if self.invalidated:
-      self.invalidated = False
-      self.update()
 
-  def read(self):
+class TuneStore():
+  """Loads a tuning file into a TuneConfig snapshot. Reloads happen at construction and on
+  the watcher thread, readers only ever dereference self.config."""
+  def __init__(self, file, limits, defaults=None):
+    self.file = file
+    self.limits = limits
+    self.defaults = defaults if defaults is not None else {}
+    self.config = TuneConfig({k: v[2] for k, v in limits.items()}, 0)
+    self.mtime = None
+    self.reload()
 
+  def reload(self):
     try:
       if os.path.isfile(self.file):
         with open(self.file, 'r') as f:
-          self.config = json.load(f)
-          if self.checkValid():
-            self.write_config(self.config)
-
-          self.update()
+          config = json.load(f)
+        write = False
       else:
-        self.write_default()
+        config = dict(self.defaults)
+        write = True
 
-        with open(self.file, 'r') as f:
-          self.config = json.load(f)
-          if self.checkValid():
-            self.write_config(self.config)
-          self.update()
+      if check_limits(config, self.limits) or write:
+        self.write_config(config)
 
-    except:
+      for key in self.limits:
+        config[key] = float(config[key])
+
+    except Exception as ex:
+      # keep the previous snapshot, e.g. on a partially written file
+      print("exception", ex)
       return False
 
+    self.mtime = self.get_mtime()
+    if config != self.config.to_dict():
+      self.config = TuneConfig(config, self.config.version + 1)
     return True
 
-  def checkValue(self, key, min_, max_, default_):
-    updated = False
+  def get_mtime(self):
+    try:
+      return os.stat(self.file).st_mtime
+    except OSError:
+      return None
 
-    if key not in self.config:
-      self.config.update({key: default_})
-      updated = True
-    elif min_ > self.config[key]:
-      self.config.update({key: min_})
-      updated = True
-    elif max_ < self.config[key]:
-      self.config.update({key: max_})
-      updated = True
+  def write_config(self, conf):
+    try:
+      if not os.path.exists(CONF_PATH):
+        os.makedirs(CONF_PATH)
 
-    return updated
+      with open(self.file, 'w') as f:
+        json.dump(conf, f, indent=2, sort_keys=False)
+      os.chmod(self.file, 0o764)
+    except Exception:
+      pass
 
-  def checkValid(self):
 
-    if self.lqr is not None:
-      return self.checkValidLQR()
-    elif self.indi is not None:
-      return self.checkValidINDI()
-    else:
-      return self.checkValidCommon()
+class TuneWatcher(threading.Thread):
+  """Reloads the stores of this process when their file under CONF_PATH changes."""
+  def __init__(self):
+    super().__init__(name='ntune', daemon=True)
+    self.stores = {}
+    self.lock = threading.Lock()
 
-  def update(self):
+  def add(self, store):
+    with self.lock:
+      self.stores[os.path.basename(store.file)] = store
 
-    if self.lqr is not None:
-      self.updateLQR()
-    elif self.indi is not None:
-      self.updateINDI()
+  def reload(self, name):
+    with self.lock:
+      store = self.stores.get(name)
+    if store is not None:
+      store.reload()
+
+  def inotify(self):
+    """A blocking inotify watching CONF_PATH, None without inotify"""
+    try:
+      inotify = Inotify(blocking=True)
+    except OSError:
+      return None
+    try:
+      inotify.add_watch(CONF_PATH, IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+    except OSError:
+      inotify.close()
+      return None
+    return inotify
+
+  def run(self):
+    inotify = self.inotify()
+    if inotify is None:
+      self.poll()
+      return
+
+    while True:
+      for name in {name for _, _, name in inotify.read_events()}:
+        self.reload(name)
+
+  def poll(self):
+    while True:
+      time.sleep(POLL_INTERVAL)
+      with self.lock:
+        stores = list(self.stores.values())
+      for store in stores:
+        if store.get_mtime() != store.mtime:
+          store.reload()
+
+
+_stores = {}
+_watcher = None
+_stores_lock = threading.Lock()
+
+
+def get_store(file, limits, defaults=None):
+  global _watcher
+  with _stores_lock:
+    if file not in _stores:
+      try:
+        if not os.path.exists(CONF_PATH):
+          os.makedirs(CONF_PATH)
+      except OSError:
+        pass
 
-  def checkValidCommon(self):
-    updated = False
+      _stores[file] = TuneStore(file, limits, defaults)
 
-    if self.checkValue("useLiveSteerRatio", 0., 1., 1.):
-      updated = True
+      if _watcher is None:
+        _watcher = TuneWatcher()
+        _watcher.add(_stores[file])
+        _watcher.start()
+      else:
+        _watcher.add(_stores[file])
 
-    if self.checkValue("steerRatio", 5.0, 25.0, 16.0):
-      updated = True
+    return _stores[file]
 
-    if self.checkValue("steerActuatorDelay", 0.1, 0.8, 0.25):
-      updated = True
 
-    if self.checkValue("steerRateCost", 0.1, 1.5, 0.6):
-      updated = True
+def defaults_from_cp(CP, limits):
+  config = {}
 
-    if self.checkValue("cameraOffset", -1.0, 1.0, 0.06):
-      updated = True
+  try:
+    if CP is not None:
 
-    return updated
+      if limits is LQR_LIMITS and CP.lateralTuning.which() == 'lqr':
+        config["scale"] = round(CP.lateralTuning.lqr.scale, 2)
+        config["ki"] = round(CP.lateralTuning.lqr.ki, 3)
+        config["dcGain"] = round(CP.lateralTuning.lqr.dcGain, 6)
+        config["steerLimitTimer"] = round(CP.steerLimitTimer, 2)
+        config["steerMax"] = round(CP.steerMaxV[0], 2)
 
-  def checkValidLQR(self):
-    updated = False
+      elif limits is INDI_LIMITS and CP.lateralTuning.which() == 'indi':
+        config["innerLoopGain"] = round(CP.lateralTuning.indi.innerLoopGain, 2)
+        config["outerLoopGain"] = round(CP.lateralTuning.indi.outerLoopGain, 2)
+        config["timeConstant"] = round(CP.lateralTuning.indi.timeConstant, 2)
+        config["actuatorEffectiveness"] = round(CP.lateralTuning.indi.actuatorEffectiveness, 2)
+        config["steerLimitTimer"] = round(CP.steerLimitTimer, 2)
+        config["steerMax"] = round(CP.steerMaxV[0], 2)
 
-    if self.checkValue("scale", 500.0, 5000.0, 2000.0):
-      updated = True
+      elif limits is COMMON_LIMITS:
+        config["useLiveSteerRatio"] = 1.
+        config["steerRatio"] = round(CP.steerRatio, 2)
+        config["steerActuatorDelay"] = round(CP.steerActuatorDelay, 2)
+        config["steerRateCost"] = round(CP.steerRateCost, 2)
 
-    if self.checkValue("ki", 0.0, 0.2, 0.015):
-      updated = True
+  except Exception:
+    pass
 
-    if self.checkValue("dcGain", 0.002, 0.004, 0.0029):
-      updated = True
+  return config
 
-    if self.checkValue("steerLimitTimer", 0.5, 3.0, 2.5):
-      updated = True
 
-    return updated
+class nTune():
+  def __init__(self, CP=None, controller=None):
 
-  def checkValidINDI(self):
-    updated = False
+    self.CP = CP
 
-    if self.checkValue("innerLoopGain", 0.5, 10.0, 3.3):
-      updated = True
+    self.lqr = None
+    self.indi = None
 
-    if self.checkValue("outerLoopGain", 0.5, 10.0, 2.7):
-      updated = True
+    if "LatControlLQR" in str(type(controller)):
+      self.lqr = controller
+      limits = LQR_LIMITS
+      file = CONF_LQR_FILE
+      self.lqr.set_model([0., 1., -0.22619643, 1.21822268],
+                         [-1.92006585e-04, 3.95603032e-05],
+                         [1., 0.],
+                         [-110., 451.],
+                         [0.33, 0.318])
+    elif "LatControlINDI" in str(type(controller)):
+      self.indi = controller
+      limits = INDI_LIMITS
+      file = CONF_INDI_FILE
+    else:
+      limits = COMMON_LIMITS
+      file = CONF_COMMON_FILE
 
-    if self.checkValue("timeConstant", 0.1, 5.0, 2.0):
-      updated = True
+    self.store = get_store(file, limits, defaults_from_cp(CP, limits))
+    self.version = -1
+    self.check()
 
-    if self.checkValue("actuatorEffectiveness", 0.1, 5.0, 1.7):
-      updated = True
+  @property
+  def config(self):
+    return self.store.config
 
-    if self.checkValue("steerLimitTimer", 0.5, 3.0, 0.8):
-      updated = True
+  def check(self):  # called by LatControlLQR.update
+    config = self.store.config
+    if config.version != self.version:
+      self.version = config.version
+      self.update(config)
+
+  def update(self, config):
 
-    return updated
+    if self.lqr is not None:
+      self.updateLQR(config)
+    elif self.indi is not None:
+      self.updateINDI(config)
 
-  def updateLQR(self):
+  def updateLQR(self, config):
 
-    self.lqr.scale = float(self.config["scale"])
-    self.lqr.ki = float(self.config["ki"])
+    self.lqr.scale = config.scale
+    self.lqr.ki = config.ki
 
-    self.lqr.dc_gain = float(self.config["dcGain"])
+    self.lqr.dc_gain = config.dcGain
 
-    self.lqr.sat_limit = float(self.config["steerLimitTimer"])
+    self.lqr.sat_limit = config.steerLimitTimer
 
-    self.lqr.x_hat = np.array([[0], [0]])
+    self.lqr.x_hat = [0., 0.]
     self.lqr.reset()
 
-  def updateINDI(self):
+  def updateINDI(self, config):
 
-    self.indi.RC = float(self.config["timeConstant"])
-    self.indi.G = float(self.config["actuatorEffectiveness"])
-    self.indi.outer_loop_gain = float(self.config["outerLoopGain"])
-    self.indi.inner_loop_gain = float(self.config["innerLoopGain"])
+    self.indi.RC = config.timeConstant
+    self.indi.G = config.actuatorEffectiveness
+    self.indi.outer_loop_gain = config.outerLoopGain
+    self.indi.inner_loop_gain = config.innerLoopGain
     self.indi.alpha = 1. - DT_CTRL / (self.indi.RC + DT_CTRL)
 
-    self.indi.sat_limit = float(self.config["steerLimitTimer"])
+    self.indi.sat_limit = config.steerLimitTimer
 
     self.indi.reset()
 
-  def read_cp(self):
-
-    self.config = {}
-
-    try:
-      if self.CP is not None:
-
-        if self.CP.lateralTuning.which() == 'lqr' and self.lqr is not None:
-          self.config["scale"] = round(self.CP.lateralTuning.lqr.scale, 2)
-          self.config["ki"] = round(self.CP.lateralTuning.lqr.ki, 3)
-          self.config["dcGain"] = round(self.CP.lateralTuning.lqr.dcGain, 6)
-          self.config["steerLimitTimer"] = round(self.CP.steerLimitTimer, 2)
-          self.config["steerMax"] = round(self.CP.steerMaxV[0], 2)
-
-        elif self.CP.lateralTuning.which() == 'indi' and self.indi is not None:
-          self.config["innerLoopGain"] = round(self.CP.lateralTuning.indi.innerLoopGain, 2)
-          self.config["outerLoopGain"] = round(self.CP.lateralTuning.indi.outerLoopGain, 2)
-          self.config["timeConstant"] = round(self.CP.lateralTuning.indi.timeConstant, 2)
-          self.config["actuatorEffectiveness"] = round(self.CP.lateralTuning.indi.actuatorEffectiveness, 2)
-          self.config["steerLimitTimer"] = round(self.CP.steerLimitTimer, 2)
-          self.config["steerMax"] = round(self.CP.steerMaxV[0], 2)
-
-        else:
-          self.config["useLiveSteerRatio"] = 1.
-          self.config["steerRatio"] = round(self.CP.steerRatio, 2)
-          self.config["steerActuatorDelay"] = round(self.CP.steerActuatorDelay, 2)
-          self.config["steerRateCost"] = round(self.CP.steerRateCost, 2)
-
-    except:
-      pass
-
-  def write_default(self):
-
-    try:
-      self.read_cp()
-      self.checkValid()
-      self.write_config(self.config)
-    except:
-      pass
-
-  def write_config(self, conf):
-    try:
-      with open(self.file, 'w') as f:
-        json.dump(conf, f, indent=2, sort_keys=False)
-        os.chmod(self.file, 0o764)
-    except IOError:
 
-      try:
-        if not os.path.exists(CONF_PATH):
-          os.makedirs(CONF_PATH)
+def ntune_common():
+  """Current snapshot of the common tuning file, never touches the filesystem once loaded"""
+  store = _stores.get(CONF_COMMON_FILE)
+  if store is None:
+    store = get_store(CONF_COMMON_FILE, COMMON_LIMITS)
+  return store.config
 
-        with open(self.file, 'w') as f:
-          json.dump(conf, f, indent=2, sort_keys=False)
-          os.chmod(self.file, 0o764)
-      except:
-        pass
-
-ntune = None
 def ntune_get(key):
-  global ntune
-  if ntune == None:
-    ntune = nTune()
-
-  if ntune.config == None or key not in ntune.config:
-    ntune.read()
-
-  v = ntune.config[key]
-
-  if v is None:
-    ntune.read()
-    v = ntune.config[key]
-
-  return v
+  return ntune_common()[key]
 
 def ntune_isEnabled(key):
   return ntune_get(key) > 0.5
@@ -1,10 +1,20 @@
 import os
 import logging
+import threading
+from collections import deque
 
 from logentries import LogentriesHandler
 import zmq
 
-from common.logging_extra import SwagLogger, SwagFormatter
+from common.logging_extra import SwagLogger, SwagFormatter, json_robust_dumps
+
+# records waiting for the sender thread, newer ones are dropped when it's full
+QUEUE_SIZE = 4096
+# per call site, records per second and burst
+RATE_LIMIT = 50.
+RATE_LIMIT_BURST = 200
+# last records sent, for crash reports
+RECENT_RECORDS = 200
 
 
 def get_le_handler():
@@ -14,30 +24,149 @@ def get_le_handler():
 
 
 class LogMessageHandler(logging.Handler):
-  def __init__(self, formatter):
+  """Sends records to logmessaged from a background thread.
+
+  emit only rate limits the call site, snapshots the message and appends the record to a
+  bounded deque, the sender thread formats and sends the whole batch queued since it was
+  last woken up. Each record is still its own zmq message, that's what logmessaged and the
+  C++ swaglog speak. Queued records are sent on flush, logging does that at exit."""
+  def __init__(self, formatter, addr="ipc:///tmp/logmessage", queue_size=QUEUE_SIZE, rate_limit=RATE_LIMIT, burst=RATE_LIMIT_BURST):
     logging.Handler.__init__(self)
     self.setFormatter(formatter)
+    self.addr = addr
+    self.queue_size = queue_size
+    self.rate_limit = rate_limit
+    self.burst = burst
     self.pid = None
+    self.start_lock = threading.Lock()
+    self.flush_lock = threading.Lock()
+    self.recent = deque(maxlen=RECENT_RECORDS)
+    self.reset()
+
+  def reset(self):
+    self.queue = deque()
+    self.wakeup = threading.Event()
+    self.sites = {}  # (pathname, lineno) -> [tokens, last record time, dropped]
+    self.dropped = 0  # queue full
+    self.send_dropped = 0  # logmessaged not keeping up
+    self.sent = 0
+    self.reported = {}  # drops already logged, per counter
 
   def connect(self):
     self.zctx = zmq.Context()
     self.sock = self.zctx.socket(zmq.PUSH)
     self.sock.setsockopt(zmq.LINGER, 10)
-    self.sock.connect("ipc:///tmp/logmessage")
-    self.pid = os.getpid()
+    self.sock.connect(self.addr)
+
+  def start(self):
+    with self.start_lock:
+      if self.pid == os.getpid():
+        return
+      # after a fork only this thread is left, queued records are the parent's
+      self.reset()
+      self.connect()
+      threading.Thread(target=self.sender_thread, name="swaglog", daemon=True).start()
+      self.pid = os.getpid()
+
+  def allow(self, record):
+    site = (record.pathname, record.lineno)
+    bucket = self.sites.get(site)
+    if bucket is None:
+      bucket = self.sites[site] = [self.burst, record.created, 0]
+    tokens = min(self.burst, bucket[0] + (record.created - bucket[1]) * self.rate_limit)
+    bucket[1] = record.created
+    if tokens < 1:
+      bucket[0] = tokens
+      bucket[2] += 1
+      return False
+    bucket[0] = tokens - 1
+    return True
 
   def emit(self, record):
     if os.getpid() != self.pid:
-      self.connect()
+      self.start()
+
+    if not self.allow(record):
+      return
+    if len(self.queue) >= self.queue_size:
+      self.dropped += 1
+      return
+    self.prepare(record)
+    self.queue.append(record)
+    if not self.wakeup.is_set():
+      self.wakeup.set()
 
-    msg = self.format(record).rstrip('\n')
-    # print("SEND".format(repr(msg)))
+  def prepare(self, record):
+    """Takes what's only valid now, the record is formatted later on the sender thread"""
+    # the context is thread local
+    record.ctx = self.formatter.swaglogger.get_ctx()
+    # and the arguments can change after the call, an event is serialized once here and
+    # the formatter reuses it
+    if isinstance(record.msg, dict):
+      record.msg_json = json_robust_dumps(record.msg)
+    elif record.args:
+      try:
+        record.msg, record.args = record.getMessage(), None
+      except (ValueError, TypeError):
+        pass
+
+  def sender_thread(self):
+    while True:
+      self.wakeup.wait()
+      self.wakeup.clear()
+      self.flush()
+
+  def send(self, record):
     try:
-      s = chr(record.levelno)+msg
-      self.sock.send(s.encode('utf8'), zmq.NOBLOCK)
+      s = self.format(record).rstrip('\n')
+    except Exception:
+      self.handleError(record)
+      return
+    self.recent.append(s)
+    try:
+      self.sock.send((chr(record.levelno) + s).encode('utf8'), zmq.NOBLOCK)
+      self.sent += 1
     except zmq.error.Again:
       # drop :/
-      pass
+      self.send_dropped += 1
+
+  def flush(self):
+    if self.pid != os.getpid():
+      return
+    with self.flush_lock:
+      while True:
+        try:
+          record = self.queue.popleft()
+        except IndexError:
+          break
+        self.send(record)
+      self.report_drops()
+
+  def stats(self):
+    return {
+      'sent': self.sent,
+      'queued': len(self.queue),
+      'dropped': self.dropped,
+      'send_dropped': self.send_dropped,
+      'rate_limited': {f"{pathname}:{lineno}": bucket[2] for (pathname, lineno), bucket in list(self.sites.items()) if bucket[2]},
+    }
+
+  def report_drops(self):
+    stats = self.stats()
+    counts = {'dropped': stats['dropped'], 'send_dropped': stats['send_dropped'], **stats['rate_limited']}
+    new = {k: v - self.reported.get(k, 0) for k, v in counts.items() if v != self.reported.get(k, 0)}
+    if not new:
+      return
+    self.reported = counts
+    record = logging.LogRecord(self.formatter.swaglogger.name, logging.WARNING, __file__, 0,
+                               {'event': 'swaglog_dropped', 'counts': new}, None, None)
+    record.ctx = self.formatter.swaglogger.get_ctx()
+    self.send(record)
+
+  def recent_records(self):
+    """The last records, queued ones included"""
+    self.flush()
+    return list(self.recent)
 
 
 def add_logentries_handler(log):
@@ -53,4 +182,5 @@ log.setLevel(logging.DEBUG)
 
 outhandler = logging.StreamHandler()
 log.addHandler(outhandler)
-log.addHandler(LogMessageHandler(SwagFormatter(log)))
+log_handler = LogMessageHandler(SwagFormatter(log))
+log.addHandler(log_handler)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import json
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from collections import Counter
+
+import zmq
+
+import cereal.messaging as messaging
+from selfdrive.logmessaged import LogMessageForwarder, shed
+
+
+class TestLogmessaged(unittest.TestCase):
+  def setUp(self):
+    tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tmp)
+    self.addr = f"ipc://{tmp}/logmessage"
+
+    self.ctx = zmq.Context()
+    self.push = self.ctx.socket(zmq.PUSH)
+    self.push.connect(self.addr)
+    self.addCleanup(self.ctx.destroy, 0)
+
+  def forwarder(self, **kwargs):
+    f = LogMessageForwarder(messaging.pub_sock('logMessage'), addr=self.addr, **kwargs)
+    self.addCleanup(f.close)
+    return f
+
+  def send(self, levelnum, i):
+    self.push.send(bytes([levelnum]) + json.dumps({"msg": i, "levelnum": levelnum}).encode())
+
+  def test_shed(self):
+    records = [(levelnum, str(i)) for i, levelnum in enumerate([10, 20, 40, 10, 30, 20, 10, 40])]
+    dropped = Counter()
+    self.assertEqual(shed(records, 10, dropped), records)
+
+    kept = shed(records, 4, dropped)
+    self.assertEqual(kept, [(40, '2'), (30, '4'), (20, '5'), (40, '7')])
+    self.assertEqual(dropped, {10: 3, 20: 1})
+
+    # the oldest go first within a level
+    self.assertEqual(shed(kept, 1, dropped), [(40, '7')])
+    self.assertEqual(dropped, {10: 3, 20: 2, 30: 1, 40: 1})
+
+  def test_batches(self):
+    f = self.forwarder(window=0.2)
+    sub_sock = messaging.sub_sock('logMessage', timeout=1000)
+    time.sleep(0.1)
+
+    for i in range(100):
+      self.send(20, i)
+    f.forward(f.receive(1.))
+
+    msgs = messaging.drain_sock(sub_sock, wait_for_one=True)
+    self.assertEqual(len(msgs), 1)
+    records = [json.loads(line) for line in msgs[0].logMessage.splitlines()]
+    self.assertEqual([r['msg'] for r in records], list(range(100)))
+    self.assertEqual(f.stats(), {'received': 100, 'published': 100, 'batches': 1, 'dropped': {}})
+
+  def test_overload(self):
+    f = self.forwarder(window=0.2, high_water_mark=50, max_batch_size=20)
+    sub_sock = messaging.sub_sock('logMessage', timeout=1000)
+    time.sleep(0.1)
+
+    for i in range(200):
+      self.send([10, 20, 10, 40][i % 4], i)
+    f.forward(f.receive(1.))
+
+    msgs = messaging.drain_sock(sub_sock, wait_for_one=True)
+    records = [json.loads(line) for msg in msgs for line in msg.logMessage.splitlines()]
+    self.assertEqual(len(msgs), 3)
+    self.assertEqual(len(records), 50)
+    # what's left of the debug records is shed first
+    self.assertEqual(Counter(r['levelnum'] for r in records), {40: 50})
+    self.assertEqual(f.stats()['dropped'], {'10': 100, '20': 50})
+
+  def test_run(self):
+    f = self.forwarder(window=0.05)
+    sub_sock = messaging.sub_sock('logMessage', timeout=1000)
+    exit_event = threading.Event()
+    t = threading.Thread(target=f.run, args=(exit_event,))
+    t.start()
+    time.sleep(0.1)
+
+    for i in range(10):
+      self.send(10, i)
+      time.sleep(0.2)
+    exit_event.set()
+    t.join()
+
+    # records apart more than the window aren't held back
+    msgs = messaging.drain_sock(sub_sock, wait_for_one=True)
+    self.assertEqual(len(msgs), 10)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import copy
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from selfdrive import ntune
+from selfdrive.ntune import TuneConfig, TuneStore, TuneWatcher
+
+LIMITS = {
+  "steerRatio": (5.0, 25.0, 16.0),
+  "steerRateCost": (0.1, 1.5, 0.6),
+}
+
+
+class TestNTune(unittest.TestCase):
+  def setUp(self):
+    self.conf_path = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.conf_path)
+    p = mock.patch.object(ntune, 'CONF_PATH', self.conf_path)
+    p.start()
+    self.addCleanup(p.stop)
+    self.file = os.path.join(self.conf_path, 'common.json')
+
+  def write(self, config):
+    # written next to it and moved in place, like the app does
+    tmp = self.file + '.tmp'
+    with open(tmp, 'w') as f:
+      json.dump(config, f)
+    os.replace(tmp, self.file)
+
+  def wait_for_version(self, store, version, timeout=5.):
+    end = time.monotonic() + timeout
+    while store.config.version < version and time.monotonic() < end:
+      time.sleep(0.01)
+    self.assertEqual(store.config.version, version)
+
+  def test_defaults(self):
+    store = TuneStore(self.file, LIMITS, defaults={"steerRatio": 30.})
+    # clamped and written back
+    self.assertEqual(store.config.steerRatio, 25.)
+    self.assertEqual(store.config.steerRateCost, 0.6)
+    with open(self.file) as f:
+      self.assertEqual(json.load(f), {"steerRatio": 25., "steerRateCost": 0.6})
+
+  def test_snapshot_swap(self):
+    self.write({"steerRatio": 15., "steerRateCost": 0.5})
+    store = TuneStore(self.file, LIMITS)
+    old = store.config
+    self.assertEqual((old.steerRatio, old.version), (15., 1))
+
+    self.write({"steerRatio": 14., "steerRateCost": 0.5})
+    self.assertTrue(store.reload())
+    # readers holding the old snapshot still see consistent values
+    self.assertEqual((old.steerRatio, old.version), (15., 1))
+    self.assertEqual((store.config.steerRatio, store.config.version), (14., 2))
+    with self.assertRaises(AttributeError):
+      store.config.steerRatio = 1.
+
+    # the same values don't make a new snapshot
+    self.write({"steerRatio": 14., "steerRateCost": 0.5})
+    store.reload()
+    self.assertEqual(store.config.version, 2)
+
+    # a partially written file keeps the previous one
+    with open(self.file, 'w') as f:
+      f.write('{"steerRatio": 1')
+    self.assertFalse(store.reload())
+    self.assertEqual(store.config.steerRatio, 14.)
+
+  def test_copy(self):
+    config = TuneConfig({"steerRatio": 15.}, 1)
+    self.assertEqual(copy.deepcopy(config).steerRatio, 15.)
+    # made without __init__
+    self.assertFalse(hasattr(TuneConfig.__new__(TuneConfig), 'steerRatio'))
+
+  def test_watcher(self):
+    self.write({"steerRatio": 15., "steerRateCost": 0.5})
+    store = TuneStore(self.file, LIMITS)
+    watcher = TuneWatcher()
+    watcher.add(store)
+    watcher.start()
+
+    # until the watcher thread has its watch on the directory
+    end = time.monotonic() + 5.
+    while store.config.version < 2 and time.monotonic() < end:
+      self.write({"steerRatio": 12., "steerRateCost": 0.5})
+      time.sleep(0.05)
+    self.assertEqual((store.config.steerRatio, store.config.version), (12., 2))
+
+  def test_watcher_without_inotify(self):
+    self.write({"steerRatio": 15., "steerRateCost": 0.5})
+    store = TuneStore(self.file, LIMITS)
+    watcher = TuneWatcher()
+    watcher.add(store)
+    with mock.patch.object(watcher, 'inotify', return_value=None), \
+         mock.patch.object(ntune, 'POLL_INTERVAL', 0.01):
+      watcher.start()
+      self.write({"steerRatio": 12., "steerRateCost": 0.5})
+      # the mtime may not have moved within its resolution
+      os.utime(self.file, (store.mtime + 1, store.mtime + 1))
+      self.wait_for_version(store, 2)
+    self.assertEqual(store.config.steerRatio, 12.)
+
+
+if __name__ == "__main__":
+  unittest.main()
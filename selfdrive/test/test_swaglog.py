@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+import json
+import logging
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import zmq
+
+from common.logging_extra import SwagFormatter, SwagLogger
+from selfdrive.swaglog import LogMessageHandler
+
+
+class TestSwaglog(unittest.TestCase):
+  def setUp(self):
+    tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tmp)
+    self.addr = f"ipc://{tmp}/logmessage"
+    self.ctx = zmq.Context()
+    self.sock = self.ctx.socket(zmq.PULL)
+    self.sock.bind(self.addr)
+    self.addCleanup(self.ctx.destroy, 0)
+
+  def logger(self, **kwargs):
+    log = SwagLogger()
+    log.setLevel(logging.DEBUG)
+    handler = LogMessageHandler(SwagFormatter(log), addr=self.addr, **kwargs)
+    log.addHandler(handler)
+    return log, handler
+
+  def recv(self, timeout=1000):
+    out = []
+    while self.sock.poll(timeout):
+      dat = self.sock.recv()
+      out.append((dat[0], json.loads(dat[1:])))
+      timeout = 100
+    return out
+
+  def test_send(self):
+    log, handler = self.logger()
+
+    def worker():
+      log.bind(worker=1)
+      for i in range(100):
+        log.info("worker %d", i)
+    t = threading.Thread(target=worker)
+    t.start()
+    t.join()
+    log.error("main")
+
+    records = self.recv()
+    self.assertEqual([r['msg'] for _, r in records], [f"worker {i}" for i in range(100)] + ["main"])
+    # the context of the thread that logged
+    self.assertEqual(records[0][1]['ctx'], {'worker': 1})
+    self.assertEqual(records[-1][1]['ctx'], {})
+    self.assertEqual(records[-1][0], logging.ERROR)
+    self.assertEqual(handler.stats()['sent'], 101)
+
+  def test_rate_limit(self):
+    log, handler = self.logger(rate_limit=0, burst=10)
+    for i in range(100):
+      log.info("storm %d", i)
+    log.warning("elsewhere")
+
+    records = [r for _, r in self.recv()]
+    msgs = [r['msg'] for r in records]
+    self.assertEqual([m for m in msgs if isinstance(m, str)], [f"storm {i}" for i in range(10)] + ["elsewhere"])
+    dropped = [m for m in msgs if isinstance(m, dict) and m['event'] == 'swaglog_dropped']
+    self.assertEqual(sum(sum(d['counts'].values()) for d in dropped), 90)
+    self.assertEqual(list(handler.stats()['rate_limited'].values()), [90])
+
+  def test_queue_full(self):
+    log, handler = self.logger(queue_size=10)
+    log.info("start")
+    self.recv()
+    # the sender is busy
+    with handler.flush_lock:
+      for i in range(20):
+        log.info("queued %d", i)
+    stats = handler.stats()
+    self.assertEqual(stats['dropped'], 10)
+
+    msgs = [r['msg'] for _, r in self.recv()]
+    self.assertEqual(msgs[:10], [f"queued {i}" for i in range(10)])
+    self.assertEqual(msgs[10]['counts'], {'dropped': 10})
+
+  def test_snapshot(self):
+    log, handler = self.logger()
+    data = [1, 2]
+    with handler.flush_lock:
+      log.event("snapshot", data=data)
+      log.info("args %s", data)
+      data.append(3)
+    msgs = [r['msg'] for _, r in self.recv()]
+    self.assertEqual(msgs, [{'event': 'snapshot', 'data': [1, 2]}, "args [1, 2]"])
+
+  def test_event_serialized_once(self):
+    log, handler = self.logger()
+    encoded = []
+    dumps = json.dumps
+
+    def spy(obj, **kwargs):
+      encoded.append(dumps(obj, **kwargs))
+      return encoded[-1]
+    with mock.patch('json.dumps', side_effect=spy):
+      log.event("once", data=[1, 2])
+      handler.flush()
+    self.assertEqual(sum('"once"' in s for s in encoded), 1)
+    self.assertEqual([r['msg'] for _, r in self.recv()], [{'event': 'once', 'data': [1, 2]}])
+
+  def test_recent_records(self):
+    log, handler = self.logger(burst=1000)
+    for i in range(300):
+      log.info("line %d", i)
+    recent = handler.recent_records()
+    self.assertLessEqual(len(recent), 200)
+    self.assertEqual(json.loads(recent[-1])['msg'], "line 299")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""Streaming reader for rlog/qlog segments, bz2 compressed or raw concatenated capnp Events.
+
+Messages are framed from the capnp segment tables and their Event union is read straight
+from the message bytes, so messages of other services are skipped without being decoded.
+The offsets of every message are kept in a per-segment index on disk, later reads of a
+subset of services seek to those messages directly.
+"""
+import bz2
+import hashlib
+import os
+import stat
+import struct
+import sys
+import tempfile
+import multiprocessing
+from collections import deque
+from itertools import islice
+
+import numpy as np
+
+from cereal import log as capnp_log
+
+# index files, keyed on path, size and mtime of the log. empty disables the index
+CACHE_HOME = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+INDEX_DIR = os.environ.get('LOGREADER_INDEX_DIR', os.path.join(CACHE_HOME, 'logreader_index'))
+
+READ_SIZE = 1 << 16
+DECODE_BATCH_SIZE = 1 << 20  # bytes of messages handed to capnp at once
+PROCESSES = 2  # segments read ahead by MultiLogIterator
+QUEUE_BATCHES = 4  # batches a worker gets ahead of the reader, per segment
+MAX_SEGMENTS = 512  # capnp segments in one message, more means the stream is corrupt
+
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('size', '<u4'), ('which', '<u2')])
+
+_EVENT = capnp_log.Event.schema.node.struct
+DISCRIMINANT_OFFSET = 2 * _EVENT.discriminantOffset  # bytes into the data section
+SERVICES = {f.name: f.discriminantValue for f in _EVENT.fields if f.discriminantValue != 0xffff}
+UNKNOWN = 0xffff
+
+
+def open_log(fn):
+  if fn.endswith('.bz2'):
+    return bz2.BZ2File(fn, 'rb')
+  return open(fn, 'rb', buffering=READ_SIZE)
+
+
+def read_frames(f):
+  """Yields (offset, message bytes) for every complete message in the stream. A message cut
+  off by the end of the file (a segment still being logged) ends the iteration, the return
+  value is True when the stream ended cleanly after a message."""
+  offset = 0
+  while True:
+    try:
+      head = f.read(4)
+      if len(head) < 4:
+        return len(head) == 0
+      n = struct.unpack('<I', head)[0] + 1
+      if n > MAX_SEGMENTS:
+        raise ValueError(f"corrupt log, message at {offset} has {n} segments")
+
+      # segment sizes in words, the table is padded to a whole word
+      table_size = 4 * n + (4 if n % 2 == 0 else 0)
+      table = f.read(table_size)
+      if len(table) < table_size:
+        return False
+      size = 8 * sum(struct.unpack_from('<%dI' % n, table))
+      body = f.read(size)
+      if len(body) < size:
+        return False
+    except EOFError:
+      # compressed stream without its end marker
+      return False
+
+    msg = head + table + body
+    yield offset, msg
+    offset += len(msg)
+
+
+def event_which(msg):
+  """Discriminant of the Event union, read from the root struct of an unpacked message"""
+  n = struct.unpack_from('<I', msg)[0] + 1
+  seg0 = 4 * (n + 1 + (n + 1) % 2)
+  if len(msg) < seg0 + 8:
+    return UNKNOWN
+  ptr = struct.unpack_from('<Q', msg, seg0)[0]
+  if ptr & 3 != 0:
+    # far pointer to the root, let capnp find it
+    return SERVICES.get(next(capnp_log.Event.read_multiple_bytes(msg)).which(), UNKNOWN)
+
+  # signed 30 bit offset in words from the end of the pointer
+  offset = (ptr & 0xffffffff) >> 2
+  if offset & (1 << 29):
+    offset -= 1 << 30
+  data_start = seg0 + 8 + 8 * offset
+  data_words = (ptr >> 32) & 0xffff
+  if DISCRIMINANT_OFFSET + 2 > 8 * data_words:
+    # older message without the union in its data section, capnp reads the default
+    return 0
+  return struct.unpack_from('<H', msg, data_start + DISCRIMINANT_OFFSET)[0]
+
+
+def service_ids(services):
+  return None if services is None else {SERVICES[s] for s in services}
+
+
+def index_dir():
+  """INDEX_DIR, created owner-only. None when indexing is off or the directory
+  can't be trusted: a symlink, not ours or writable by others"""
+  if not INDEX_DIR:
+    return None
+
+  try:
+    os.makedirs(INDEX_DIR, mode=0o700, exist_ok=True)
+    st = os.lstat(INDEX_DIR)
+  except OSError:
+    return None
+  if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+    return None
+  return INDEX_DIR
+
+
+def index_path(directory, fn):
+  st = os.stat(fn)
+  key = f"{os.path.realpath(fn)}:{st.st_size}:{st.st_mtime_ns}"
+  return os.path.join(directory, hashlib.sha256(key.encode()).hexdigest() + '.npy')
+
+
+def load_index(fn):
+  directory = index_dir()
+  if directory is None:
+    return None
+  try:
+    return np.load(index_path(directory, fn))
+  except (OSError, ValueError):
+    return None
+
+
+def save_index(fn, index):
+  directory = index_dir()
+  if directory is None:
+    return
+  try:
+    path = index_path(directory, fn)
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as f:
+      np.save(f, index)
+    os.replace(f.name, path)
+  except OSError:
+    pass
+
+
+def iter_segment(fn, services=None):
+  """Yields the bytes of each message of the segment, only those of the given services"""
+  ids = service_ids(services)
+  index = load_index(fn)
+
+  if index is not None:
+    if ids is not None:
+      index = index[np.isin(index['which'], list(ids))]
+    with open_log(fn) as f:
+      for offset, size in zip(index['offset'].tolist(), index['size'].tolist()):
+        f.seek(offset)
+        yield f.read(size)
+    return
+
+  # first read of this segment, index it on the way
+  entries = []
+  with open_log(fn) as f:
+    frames = read_frames(f)
+    while True:
+      try:
+        offset, msg = next(frames)
+      except StopIteration as e:
+        complete = e.value
+        break
+      which = event_which(msg)
+      entries.append((offset, len(msg), which))
+      if ids is None or which in ids:
+        yield msg
+
+  # an unfinished segment gives a partial index, don't keep it
+  if complete:
+    save_index(fn, np.array(entries, dtype=INDEX_DTYPE))
+
+
+def batches(msgs):
+  """Message bytes joined into batches of about DECODE_BATCH_SIZE"""
+  batch, batch_size = [], 0
+  for msg in msgs:
+    batch.append(msg)
+    batch_size += len(msg)
+    if batch_size >= DECODE_BATCH_SIZE:
+      yield b''.join(batch)
+      batch, batch_size = [], 0
+  if batch:
+    yield b''.join(batch)
+
+
+def decode(msgs):
+  """Event readers for message bytes, decoded in batches"""
+  for batch in batches(msgs):
+    yield from capnp_log.Event.read_multiple_bytes(batch)
+
+
+class LogReader():
+  def __init__(self, fn, services=None):
+    """Reads the Events of one rlog/qlog segment.
+
+    Args:
+      fn: Path to the log, .bz2 for compressed logs
+      services: Optional list of Event union names to read, other messages are skipped
+    """
+    self.fn = fn
+    self.services = services
+
+  def __iter__(self):
+    return decode(iter_segment(self.fn, self.services))
+
+
+def read_segment(fn, services, queue):
+  """Worker process, puts the segment's messages on the queue in batches and None once done"""
+  try:
+    for batch in batches(iter_segment(fn, services)):
+      queue.put(batch)
+  except Exception as e:
+    queue.put(e)
+  queue.put(None)
+
+
+class MultiLogIterator():
+  def __init__(self, log_paths, wraparound=False, services=None, processes=None):
+    """Reads the Events of consecutive segments in order. Segments are decompressed, framed
+    and filtered in worker processes, a few segments ahead of the one being read. Workers
+    hand over batches of messages through bounded queues, so at most
+    processes * QUEUE_BATCHES batches are held whatever the size of the segments.
+
+    Args:
+      log_paths: Segment paths in order, None for missing segments
+      wraparound: Start over at the first segment after the last one
+      services: Optional list of Event union names to read
+      processes: Number of worker processes, 1 reads in this process
+    """
+    self.log_paths = [p for p in log_paths if p is not None]
+    self.wraparound = wraparound
+    self.services = services
+    self.processes = processes or PROCESSES
+
+  def __iter__(self):
+    while True:
+      if self.processes > 1 and len(self.log_paths) > 1:
+        yield from self._iter_parallel()
+      else:
+        for fn in self.log_paths:
+          yield from LogReader(fn, self.services)
+
+      if not self.wraparound or not self.log_paths:
+        return
+
+  def _iter_parallel(self):
+    ctx = multiprocessing.get_context()
+    pending = deque()  # (process, queue) for each segment being read, in order
+
+    def start(fn):
+      queue = ctx.Queue(QUEUE_BATCHES)
+      proc = ctx.Process(target=read_segment, args=(fn, self.services, queue), daemon=True)
+      proc.start()
+      pending.append((proc, queue))
+
+    paths = iter(self.log_paths)
+    for fn in islice(paths, self.processes):
+      start(fn)
+
+    try:
+      while pending:
+        proc, queue = pending[0]
+        for batch in iter(queue.get, None):
+          if isinstance(batch, Exception):
+            raise batch
+          yield from capnp_log.Event.read_multiple_bytes(batch)
+        pending.popleft()
+        proc.join()
+
+        fn = next(paths, None)
+        if fn is not None:
+          start(fn)
+    finally:
+      # the iteration was stopped early, workers may be blocked on a full queue
+      for proc, _ in pending:
+        proc.terminate()
+        proc.join()
+
+
+if __name__ == "__main__":
+  for m in MultiLogIterator(sys.argv[1:]):
+    print(m)
@@ -0,0 +1,42 @@
+import os
+import re
+
+from selfdrive.loggerd.config import ROOT
+
+SEGMENT_NAME_RE = re.compile(r'^(?P<route>.+)--(?P<segment>\d+)$')
+
+
+class Route():
+  def __init__(self, route_name, data_dir=ROOT):
+    """Segments of a route logged by loggerd under data_dir.
+
+    Args:
+      route_name: "<dongle id>|<route>" or just the route, like 2020-01-01--12-00-00
+      data_dir: Directory holding the <route>--<segment> directories
+    """
+    self.route_name = route_name
+    self.data_dir = data_dir
+    self.name = route_name.split('|')[-1]
+
+    self.segments = {}
+    for d in os.listdir(data_dir) if os.path.isdir(data_dir) else []:
+      m = SEGMENT_NAME_RE.match(d)
+      if m is not None and m.group('route') == self.name and os.path.isdir(os.path.join(data_dir, d)):
+        self.segments[int(m.group('segment'))] = os.path.join(data_dir, d)
+
+  def _paths(self, names):
+    paths = [None] * (max(self.segments) + 1 if self.segments else 0)
+    for n, d in self.segments.items():
+      for name in names:
+        if os.path.isfile(os.path.join(d, name)):
+          paths[n] = os.path.join(d, name)
+          break
+    return paths
+
+  def log_paths(self):
+    """rlog path of every segment, None for segments without one"""
+    return self._paths(['rlog.bz2', 'rlog'])
+
+  def qlog_paths(self):
+    """qlog path of every segment, None for segments without one"""
+    return self._paths(['qlog.bz2', 'qlog'])
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+import bz2
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from itertools import islice
+from unittest import mock
+
+from cereal import log
+import cereal.messaging as messaging
+from tools.lib import logreader
+from tools.lib.logreader import LogReader, MultiLogIterator
+from tools.lib.route import Route
+
+SEGMENT_SECONDS = 60
+# service, rate in Hz
+SERVICES = [('can', 100), ('sensorEvents', 100), ('carState', 100), ('controlsState', 100),
+            ('gpsLocationExternal', 10), ('thermal', 2)]
+
+
+def synthetic_segment(start_time):
+  """A segment of SEGMENT_SECONDS of logging, as the bytes loggerd writes"""
+  msgs = []
+  init = messaging.new_message('initData')
+  init.logMonoTime = int(start_time * 1e9)
+  msgs.append((init.logMonoTime, init.to_bytes()))
+  for service, hz in SERVICES:
+    for i in range(SEGMENT_SECONDS * hz):
+      msg = messaging.new_message(service, 5) if service in ('can', 'sensorEvents') else messaging.new_message(service)
+      msg.logMonoTime = int((start_time + i / hz) * 1e9)
+      if service == 'carState':
+        msg.carState.vEgo = i / hz
+      msgs.append((msg.logMonoTime, msg.to_bytes()))
+  return b''.join(m for _, m in sorted(msgs, key=lambda m: m[0]))
+
+
+def summary(msgs):
+  return [(m.which(), m.logMonoTime) for m in msgs]
+
+
+class TestLogReader(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.data_dir = tempfile.mkdtemp()
+    cls.segments = []
+    for n in range(3):
+      d = os.path.join(cls.data_dir, f"2020-01-01--12-00-00--{n}")
+      os.mkdir(d)
+      dat = synthetic_segment(n * SEGMENT_SECONDS)
+      with open(os.path.join(d, 'rlog'), 'wb') as f:
+        f.write(dat)
+      with open(os.path.join(d, 'qlog.bz2'), 'wb') as f:
+        f.write(bz2.compress(dat))
+      cls.segments.append(dat)
+
+  @classmethod
+  def tearDownClass(cls):
+    shutil.rmtree(cls.data_dir)
+
+  def setUp(self):
+    self.index_dir = tempfile.mkdtemp()
+    patcher = mock.patch.object(logreader, 'INDEX_DIR', self.index_dir)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.route = Route("0123456789abcdef|2020-01-01--12-00-00", data_dir=self.data_dir)
+
+  def test_read(self):
+    for paths in (self.route.log_paths(), self.route.qlog_paths()):
+      for fn, dat in zip(paths, self.segments):
+        self.assertEqual(summary(LogReader(fn)), summary(log.Event.read_multiple_bytes(dat)))
+
+  def test_which_from_bytes(self):
+    with open(self.route.log_paths()[0], 'rb') as f:
+      frames = list(logreader.read_frames(f))
+    for _, msg in frames:
+      self.assertEqual(logreader.SERVICES[next(log.Event.read_multiple_bytes(msg)).which()], logreader.event_which(msg))
+
+  def test_services(self):
+    fn = self.route.qlog_paths()[0]
+    expected = [m for m in summary(LogReader(fn)) if m[0] in ('carState', 'thermal')]
+    self.assertEqual(summary(LogReader(fn, services=['carState', 'thermal'])), expected)
+
+  def test_index(self):
+    for fn in (self.route.log_paths()[1], self.route.qlog_paths()[1]):
+      everything = summary(LogReader(fn))
+      # the first read indexed the segment, now it's read without framing the stream
+      with mock.patch.object(logreader, 'read_frames', side_effect=AssertionError("not indexed")):
+        self.assertEqual(summary(LogReader(fn)), everything)
+        self.assertEqual(summary(LogReader(fn, services=['gpsLocationExternal'])),
+                         [m for m in everything if m[0] == 'gpsLocationExternal'])
+    self.assertEqual(len(os.listdir(self.index_dir)), 2)
+
+  def test_unfinished_segment(self):
+    # loggerd has written some of the messages, and the compressed blocks completed so far.
+    # small blocks so the synthetic data spans more than one
+    dat = self.segments[0]
+    for name, contents in (('rlog', dat[:len(dat) // 2]), ('qlog.bz2', bz2.BZ2Compressor(1).compress(dat))):
+      fn = os.path.join(tempfile.mkdtemp(), name)
+      with open(fn, 'wb') as f:
+        f.write(contents)
+      msgs = summary(LogReader(fn))
+      self.assertGreater(len(msgs), 0)
+      self.assertEqual(msgs, summary(log.Event.read_multiple_bytes(dat))[:len(msgs)])
+    self.assertEqual(os.listdir(self.index_dir), [])
+
+  def test_untrusted_index_dir(self):
+    fn = self.route.log_paths()[0]
+    os.chmod(self.index_dir, 0o777)
+    self.assertEqual(summary(LogReader(fn)), summary(log.Event.read_multiple_bytes(self.segments[0])))
+    self.assertEqual(os.listdir(self.index_dir), [])
+
+    # created owner-only
+    index_dir = os.path.join(self.index_dir, 'new')
+    with mock.patch.object(logreader, 'INDEX_DIR', index_dir):
+      list(LogReader(fn))
+    self.assertEqual(os.stat(index_dir).st_mode & 0o777, 0o700)
+    self.assertEqual(len(os.listdir(index_dir)), 1)
+
+  def test_multi_log_iterator(self):
+    expected = summary(log.Event.read_multiple_bytes(b''.join(self.segments)))
+    for processes in (1, 2):
+      self.assertEqual(summary(MultiLogIterator(self.route.log_paths(), processes=processes)), expected)
+      self.assertEqual(summary(MultiLogIterator(self.route.qlog_paths() + [None], processes=processes, services=['carState'])),
+                       [m for m in expected if m[0] == 'carState'])
+
+    # stopping early doesn't leave workers blocked on their queues
+    msgs = iter(MultiLogIterator(self.route.log_paths(), processes=2))
+    self.assertEqual(summary(islice(msgs, 10)), expected[:10])
+    msgs.close()
+    self.assertEqual(multiprocessing.active_children(), [])
+
+  def test_missing_segment(self):
+    with self.assertRaises(FileNotFoundError):
+      list(MultiLogIterator(self.route.log_paths() + ['/nonexistent/rlog'], processes=2))
+
+
+if __name__ == "__main__":
+  unittest.main()